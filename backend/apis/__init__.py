@@ -11,7 +11,10 @@ from flask import Blueprint
 from flask_restplus import Api
 
 from .startup import api as startup, version
+from .utils import db_manager
+from .utils.path_manager import pin_db_path, unpin_db_path
 
+from .admin import api as admin
 from .locations import api as locations
 from .explorer import api as explorer
 from .lineage_independent import api as lineage_independent
@@ -26,15 +29,36 @@ api.init_app(api_blueprint)
 def handler(e):
     """
     When the "OperationalError: database is locked" exception is thrown, it converts the error into a
-    response with error code 423. This occurs when the database is locked due to a dataset update.
+    response with error code 423. This occurs when the database is locked due to a dataset update,
+    or when it is not yet created during the first dataset import. Once a database version has been served,
+    a missing database file or table is an actual error instead.
     """
-    if str(e) == 'database is locked':
+    not_created = str(e) == 'unable to open database file' or str(e).startswith('no such table')
+    if str(e) == 'database is locked' or (not_created and not db_manager.db_served):
         return {'message': 'Resource Unavailable: The server is temporarily unable to service ' +
                            'your request due to maintenance downtime. Please try again later.'}, 423
     # Otherwise proceed as usual
 
+@api_blueprint.before_request
+def pin_database():
+    """
+    Pins the database version in use for the whole request, so that the requests in progress
+    during a database switch complete on the previous version
+    """
+    pin_db_path()
+
+
+@api_blueprint.teardown_request
+def unpin_database(exception=None):
+    """
+    Releases the database version pinned for the request
+    """
+    unpin_db_path()
+
+
 # Import startup code
 api.add_namespace(startup)
+api.add_namespace(admin)
 
 # Import APIs
 api.add_namespace(locations)
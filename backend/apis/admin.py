@@ -0,0 +1,130 @@
+"""
+
+    ADMINISTRATION APIS @ /admin
+    These APIs allow the maintenance of the running server.
+    They are accessible only from the local host
+
+"""
+
+import os
+import time
+
+from flask import request
+from flask_restplus import Namespace, Resource
+
+from .utils.cache_manager import get_cache_stats, clear_cache
+from .utils.path_manager import get_db_path, reload_db_path, remove_old_db_versions
+
+api = Namespace(name='Administration', path='/admin')
+
+local_addresses = ('127.0.0.1', '::1', 'localhost')  # addresses allowed to access the administration APIs
+
+
+def check_local_request():
+    """
+    Aborts the request if it does not come from the local host
+    """
+    if request.remote_addr not in local_addresses:
+        api.abort(403, 'Forbidden: administration APIs are accessible only from the local host')
+
+
+# ######################################################################################
+# ############################   [POST] /reloadDatabase   ##############################
+# ######################################################################################
+
+@api.route('/reloadDatabase')
+class ReloadDatabase(Resource):
+    @api.doc()
+    def post(self):
+        """
+        API to switch to the database version built by a separate ingest process
+        (e.g., `app.py --ingest-only --regenerate`). The requests in progress complete on the previous version.
+        Sending SIGHUP to the server process has the same effect.
+
+        Success response (code 200):
+            {
+                'previous': name of the database file in use before the call
+                'current':  name of the database file in use after the call
+            }
+
+        Error responses
+        # code 403: Forbidden: request not coming from the local host
+        # code 500: Generic server error
+
+        """
+        exec_start = time.time()
+        check_local_request()
+        previous_path = get_db_path()
+        current_path = reload_db_path()
+        remove_old_db_versions()
+
+        print(f'\t[POST] /reloadDatabase: processed in {time.time() - exec_start:.5f} seconds.')
+        return {'previous': os.path.basename(previous_path), 'current': os.path.basename(current_path)}
+
+
+# ######################################################################################
+# ##############################   [GET] /getCacheStats   ##############################
+# ######################################################################################
+
+@api.route('/getCacheStats')
+class CacheStats(Resource):
+    @api.doc()
+    def get(self):
+        """
+        API to obtain the counters of the cache of the analysis results
+
+        Success response (code 200):
+            {
+                'hits':             number of results served from memory
+                'disk_hits':        number of results served from disk
+                'misses':           number of results computed
+                'evictions':        number of results evicted from memory to free space
+                'invalidations':    number of times the cache has been emptied due to a dataset update
+                'hit_ratio':        fraction of the results served from the cache
+                'version':          dataset version of the cached results
+                'memory_entries':   number of results kept in memory
+                'memory_bytes':     size of the results kept in memory
+                'max_memory_bytes': max size of the results kept in memory
+                'disk_entries':     number of results kept on disk
+                'disk_bytes':       size of the results kept on disk
+                'max_disk_bytes':   max size of the results kept on disk
+            }
+
+        Error responses
+        # code 403: Forbidden: request not coming from the local host
+        # code 500: Generic server error
+
+        """
+        exec_start = time.time()
+        check_local_request()
+        cache_stats = get_cache_stats()
+
+        print(f'\t[GET] /getCacheStats: processed in {time.time() - exec_start:.5f} seconds.')
+        return cache_stats
+
+
+# ######################################################################################
+# ###############################   [POST] /clearCache   ###############################
+# ######################################################################################
+
+@api.route('/clearCache')
+class ClearCache(Resource):
+    @api.doc()
+    def post(self):
+        """
+        API to remove all the cached analysis results, both from memory and from disk
+
+        Success response (code 200):
+            Counters of the cache after the removal (see /getCacheStats)
+
+        Error responses
+        # code 403: Forbidden: request not coming from the local host
+        # code 500: Generic server error
+
+        """
+        exec_start = time.time()
+        check_local_request()
+        clear_cache()
+
+        print(f'\t[POST] /clearCache: processed in {time.time() - exec_start:.5f} seconds.')
+        return get_cache_stats()
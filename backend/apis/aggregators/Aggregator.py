@@ -0,0 +1,154 @@
+class Aggregator:
+    """
+    Generic aggregator for the parsed data
+    In its implementations, this class stages the sequences and aa substitutions produced by the parser
+    and aggregates them into the aggr_sequences and aggr_aa_substitutions tables
+    """
+
+    def __init__(self, con):
+        """
+        Initializes the aggregator object
+        Args:
+            con:    The connection to the db
+        """
+        self.con = con
+
+    @classmethod
+    def create_shard(cls, shard_idx):
+        """
+        Creates the aggregator used by a parsing worker to stage the data of a shard
+        Args:
+            shard_idx:  The index of the shard
+
+        Returns: The aggregator for the shard
+
+        """
+        pass
+
+    def create_staging(self):
+        """
+        Prepares the structures used to stage the parsed data
+        """
+        pass
+
+    def add_sequences(self, batch):
+        """
+        Stages a batch of sequences
+        Args:
+            batch:  List of (sequence_id, date, lineage_id, continent_id, country_id, region_id) tuples.
+                    Country and region ids are None when unknown
+        """
+        pass
+
+    def add_substitutions(self, batch):
+        """
+        Stages a batch of aa substitutions
+        Args:
+            batch:  List of (sequence_id, mut_id) tuples
+        """
+        pass
+
+    def export_shard(self):
+        """
+        Finalizes the staging of a shard parsed by a worker
+
+        Returns: Picklable object describing the staged data of the shard, to be passed to merge_shard
+
+        """
+        pass
+
+    def merge_shard(self, shard_data, lineage_map, mutation_map, location_map, sequences_offset):
+        """
+        Merges the data staged by a parsing worker, by translating the local identifiers into the global ones
+        Args:
+            shard_data:         The object returned by export_shard
+            lineage_map:        List of (local_id, global_id) pairs for lineages
+            mutation_map:       List of (local_id, global_id) pairs for mutations
+            location_map:       List of (local_id, global_id) pairs for locations
+            sequences_offset:   The offset to be added to the local sequence ids
+        """
+        pass
+
+    def aggregate(self, sequences_table='aggr_sequences', substitutions_table='aggr_aa_substitutions'):
+        """
+        Aggregates the staged data into the aggr_sequences and aggr_aa_substitutions tables
+        and releases the staging structures
+        Args:
+            sequences_table:        The name of the table where the sequences counts are inserted
+            substitutions_table:    The name of the table where the aa substitutions counts are inserted
+        """
+        pass
+
+    def merge_delta(self, sequences_table, substitutions_table):
+        """
+        Adds the counts of the given delta tables (having the same structure of aggr_sequences and
+        aggr_aa_substitutions) into the aggr tables, updating the existing rows and inserting the new ones
+        Args:
+            sequences_table:        The name of the delta table with the sequences counts
+            substitutions_table:    The name of the delta table with the aa substitutions counts
+        """
+        cur = self.con.cursor()
+        cur.execute(f'''  UPDATE aggr_sequences
+                        SET count = aggr_sequences.count + D.count
+                        FROM {sequences_table} AS D
+                        WHERE aggr_sequences.date = D.date AND aggr_sequences.lineage_id = D.lineage_id 
+                            AND aggr_sequences.location_id = D.location_id;''')
+        cur.execute(f'''  INSERT INTO aggr_sequences
+                        SELECT date, lineage_id, location_id, count
+                        FROM {sequences_table} AS D
+                        WHERE NOT EXISTS (
+                            SELECT 1
+                            FROM aggr_sequences AS SQ
+                            WHERE SQ.date = D.date AND SQ.lineage_id = D.lineage_id AND SQ.location_id = D.location_id
+                            );''')
+
+        cur.execute(f'''  UPDATE aggr_aa_substitutions
+                        SET count = aggr_aa_substitutions.count + D.count
+                        FROM {substitutions_table} AS D
+                        WHERE aggr_aa_substitutions.location_id = D.location_id AND aggr_aa_substitutions.date = D.date
+                            AND aggr_aa_substitutions.lineage_id = D.lineage_id 
+                            AND aggr_aa_substitutions.mut_id = D.mut_id;''')
+        cur.execute(f'''  INSERT INTO aggr_aa_substitutions
+                        SELECT date, lineage_id, location_id, mut_id, count
+                        FROM {substitutions_table} AS D
+                        WHERE NOT EXISTS (
+                            SELECT 1
+                            FROM aggr_aa_substitutions AS SB
+                            WHERE SB.location_id = D.location_id AND SB.date = D.date AND SB.lineage_id = D.lineage_id 
+                                AND SB.mut_id = D.mut_id
+                            );''')
+        self.con.commit()
+
+    def recharacterize(self, sequences_table):
+        """
+        Recomputes the lineages characteristics of the lineages appearing in the given delta table,
+        based on the continent-level counts of the aggr tables
+        Args:
+            sequences_table:    The name of the delta table with the sequences counts
+        """
+        cur = self.con.cursor()
+        cur.execute(f'''  CREATE TEMP TABLE touched_lineages AS
+                            SELECT DISTINCT lineage_id
+                            FROM {sequences_table};''')
+
+        cur.execute('''   DELETE FROM lineages_characteristics
+                        WHERE lineage_id IN (SELECT lineage_id FROM touched_lineages);''')
+
+        # Each sequence is counted exactly once at continent level
+        cur.execute('''   CREATE TEMP TABLE touched_lin_counts AS
+                            SELECT lineage_id, sum(count) AS count
+                            FROM aggr_sequences JOIN continents ON location_id = continent_id
+                            WHERE lineage_id IN (SELECT lineage_id FROM touched_lineages)
+                            GROUP BY lineage_id;''')
+
+        # Compute lineages characteristics as the mutations affecting at least 50% of lineage's sequences
+        cur.execute('''   INSERT INTO lineages_characteristics
+                            SELECT SB.lineage_id, mut_id
+                            FROM aggr_aa_substitutions AS SB JOIN continents ON SB.location_id = continent_id
+                                JOIN touched_lin_counts AS LC ON SB.lineage_id = LC.lineage_id
+                            GROUP BY SB.lineage_id, mut_id
+                            HAVING sum(SB.count) >= max(LC.count)*0.5;''')
+
+        cur.execute('''   DROP TABLE temp.touched_lin_counts;''')
+        cur.execute('''   DROP TABLE temp.touched_lineages;''')
+        self.con.commit()
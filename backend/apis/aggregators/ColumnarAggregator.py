@@ -0,0 +1,249 @@
+import numpy as np
+
+from .Aggregator import Aggregator
+
+
+def count_rows(keys, weights=None):
+    """
+    Sort/unique-count kernel: groups the identical rows of an integer matrix.
+    When the value ranges of the columns allow it, rows are packed into a single int64 key before sorting.
+    Args:
+        keys:       Integer matrix of shape (n, k)
+        weights:    If set, array of shape (n,) whose values are summed for each group. Otherwise, rows are counted
+
+    Returns:    The unique rows of keys and the corresponding counts (or sums of weights)
+
+    """
+    if len(keys) == 0:
+        return keys, np.zeros(0, dtype=np.int64)
+
+    shifted = keys.astype(np.int64) - keys.min(axis=0)
+    bits = [int(max_value).bit_length() for max_value in shifted.max(axis=0)]
+    if sum(bits) <= 63:
+        # Pack the columns into a single key
+        packed = np.zeros(len(keys), dtype=np.int64)
+        for col, col_bits in zip(shifted.T, bits):
+            packed = (packed << col_bits) | col
+        del shifted
+        order = np.argsort(packed, kind='stable')
+        packed = packed[order]
+        starts = np.flatnonzero(np.concatenate(([True], packed[1:] != packed[:-1])))
+    else:
+        del shifted
+        order = np.lexsort(keys.T[::-1])
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.concatenate(([True], (sorted_keys[1:] != sorted_keys[:-1]).any(axis=1))))
+
+    unique_keys = keys[order[starts]]
+    if weights is None:
+        counts = np.diff(np.append(starts, len(keys)))
+    else:
+        counts = np.add.reduceat(weights[order], starts)
+    return unique_keys, counts
+
+
+def merge_partials(partials):
+    """
+    Merges a list of partial aggregations into a single one
+    Args:
+        partials:   List of (keys, counts) pairs, as returned by count_rows
+
+    Returns:    The merged (keys, counts) pair
+
+    """
+    if len(partials) == 1:
+        return partials[0]
+    keys = np.concatenate([keys for keys, _ in partials])
+    counts = np.concatenate([counts for _, counts in partials])
+    return count_rows(keys, counts)
+
+
+def rollup(keys, counts):
+    """
+    Aggregates the rows at region, country and continent level. The rows of the input are unique, hence they are
+    already aggregated at the finest location: region level rows are taken as they are, while each upper level
+    is obtained by rolling up the previous one into its parent, together with the rows not reaching that level
+    Args:
+        keys:   Unique rows of the form date, lineage_id, continent_id, country_id, region_id (+ other key columns)
+        counts: Counts of the rows
+
+    Returns:    Dictionary of the form {level_name: (keys, counts)}, with keys of the form
+                date, lineage_id, location_id (+ other key columns)
+
+    """
+    extra = list(range(5, keys.shape[1]))
+    levels = {}
+
+    is_region = keys[:, 4] >= 0
+    levels['region'] = keys[is_region][:, [0, 1, 4] + extra], counts[is_region]
+
+    # Rows are unique on the region: the ones with a known country are grouped by country (keeping the continent)
+    is_country = keys[:, 3] >= 0
+    country_keys, country_counts = count_rows(keys[is_country][:, [0, 1, 2, 3] + extra], counts[is_country])
+    levels['country'] = country_keys[:, [0, 1, 3] + list(range(4, country_keys.shape[1]))], country_counts
+
+    # Continents are rolled up from the countries and the rows with unknown country
+    levels['continent'] = count_rows(
+        np.concatenate((country_keys[:, [0, 1, 2] + list(range(4, country_keys.shape[1]))],
+                        keys[~is_country][:, [0, 1, 2] + extra])),
+        np.concatenate((country_counts, counts[~is_country])))
+    return levels
+
+
+def to_map_array(pairs):
+    """
+    Converts a list of (local_id, global_id) pairs into an array indexed by local_id
+    Args:
+        pairs:  List of (local_id, global_id) pairs
+
+    Returns:    Array whose value in position local_id is global_id
+
+    """
+    map_array = np.full(max([local_id for local_id, _ in pairs], default=-1) + 1, -1, dtype=np.int32)
+    for local_id, global_id in pairs:
+        map_array[local_id] = global_id
+    return map_array
+
+
+class ColumnarAggregator(Aggregator):
+    """
+    Aggregator keeping the parsed rows in memory as packed NumPy integer arrays. Substitutions are joined with
+    their sequences and partially aggregated in chunks through sort/unique-count kernels, so that only the final
+    aggregated rows are inserted into the database. Unknown country and region ids are represented as -1.
+    """
+
+    compaction_size = 10000000  # number of staged aa substitutions triggering a partial aggregation
+    max_partials = 4  # number of partial aggregations triggering their merge
+
+    def __init__(self, con):
+        super().__init__(con)
+
+        # Staged sequences, indexed by sequence_id: date, lineage_id, continent_id, country_id, region_id
+        self.sequences = np.empty((0, 5), dtype=np.int32)
+        self.sequences_num = 0
+
+        # Staged substitutions, waiting to be aggregated: sequence_id, mut_id
+        self.substitutions = []
+        self.substitutions_num = 0
+
+        # Partial aggregations, as (keys, counts) pairs. Keys of sequences are:
+        # date, lineage_id, continent_id, country_id, region_id (+ mut_id, for substitutions)
+        self.seq_partials = []
+        self.sub_partials = []
+
+    @classmethod
+    def create_shard(cls, shard_idx):
+        return cls(None)
+
+    def add_sequences(self, batch):
+        if len(batch) == 0:
+            return
+        ids = np.array([row[0] for row in batch], dtype=np.int64)
+        rows = np.array([(date, lineage_id, continent_id,
+                          -1 if country_id is None else country_id,
+                          -1 if region_id is None else region_id)
+                         for _, date, lineage_id, continent_id, country_id, region_id in batch], dtype=np.int32)
+
+        size = int(ids.max()) + 1
+        if size > len(self.sequences):
+            # Grow the array geometrically
+            grown = np.empty((max(size, 2 * len(self.sequences)), 5), dtype=np.int32)
+            grown[:self.sequences_num] = self.sequences[:self.sequences_num]
+            self.sequences = grown
+        self.sequences[ids] = rows
+        self.sequences_num = max(self.sequences_num, size)
+
+    def add_substitutions(self, batch):
+        if len(batch) == 0:
+            return
+        rows = np.array(batch, dtype=np.int32)
+        self.substitutions.append(rows)
+        self.substitutions_num += len(rows)
+        if self.substitutions_num >= self.compaction_size:
+            self.compact()
+
+    def compact(self):
+        """
+        Aggregates the staged substitutions whose sequences have been already staged
+        """
+        if self.substitutions_num == 0:
+            return
+        substitutions = np.concatenate(self.substitutions)
+        is_ready = substitutions[:, 0] < self.sequences_num
+        ready = substitutions[is_ready]
+        self.substitutions = [substitutions[~is_ready]]
+        self.substitutions_num = len(self.substitutions[0])
+        del substitutions
+
+        keys = np.column_stack((self.sequences[ready[:, 0]], ready[:, 1]))
+        self.sub_partials.append(count_rows(keys))
+        if len(self.sub_partials) > self.max_partials:
+            self.sub_partials = [merge_partials(self.sub_partials)]
+
+    def finalize(self):
+        """
+        Completes the partial aggregation of all the staged data, releasing the staged rows
+        """
+        self.compact()
+        if self.sequences_num > 0:
+            self.seq_partials.append(count_rows(self.sequences[:self.sequences_num]))
+            self.sequences = np.empty((0, 5), dtype=np.int32)
+            self.sequences_num = 0
+        if len(self.seq_partials) == 0:
+            self.seq_partials.append((np.empty((0, 5), dtype=np.int32), np.zeros(0, dtype=np.int64)))
+        if len(self.sub_partials) == 0:
+            self.sub_partials.append((np.empty((0, 6), dtype=np.int32), np.zeros(0, dtype=np.int64)))
+        self.seq_partials = [merge_partials(self.seq_partials)]
+        self.sub_partials = [merge_partials(self.sub_partials)]
+
+    def export_shard(self):
+        self.finalize()
+        return {'sequences': self.seq_partials[0],
+                'substitutions': self.sub_partials[0]}
+
+    def merge_shard(self, shard_data, lineage_map, mutation_map, location_map, sequences_offset):
+        lineage_map = to_map_array(lineage_map)
+        mutation_map = to_map_array(mutation_map)
+        location_map = to_map_array(location_map)
+
+        for (keys, counts), partials in ((shard_data['sequences'], self.seq_partials),
+                                         (shard_data['substitutions'], self.sub_partials)):
+            keys = keys.copy()
+            keys[:, 1] = lineage_map[keys[:, 1]]
+            for col in (2, 3, 4):
+                is_known = keys[:, col] >= 0
+                keys[is_known, col] = location_map[keys[is_known, col]]
+            if keys.shape[1] > 5:
+                keys[:, 5] = mutation_map[keys[:, 5]]
+            partials.append((keys, counts))
+            if len(partials) > self.max_partials:
+                partials[:] = [merge_partials(partials)]
+
+    def aggregate(self, sequences_table='aggr_sequences', substitutions_table='aggr_aa_substitutions'):
+        self.finalize()
+        seq_keys, seq_counts = self.seq_partials.pop()
+        sub_keys, sub_counts = self.sub_partials.pop()
+        level_names = ('continent', 'country', 'region')
+
+        levels = rollup(sub_keys, sub_counts)
+        del sub_keys, sub_counts
+        for level_name in level_names:
+            print(f"\t\tProcessing aa substitutions by {level_name} ...")
+            keys, counts = levels.pop(level_name)
+            query = f''' INSERT INTO {substitutions_table} (date, lineage_id, location_id, mut_id, count) 
+                        VALUES (?,?,?,?,?)'''
+            self.con.executemany(query, ((date, lineage_id, location_id, mut_id, count)
+                                         for (date, lineage_id, location_id, mut_id), count
+                                         in zip(keys.tolist(), counts.tolist())))
+            self.con.commit()
+
+        levels = rollup(seq_keys, seq_counts)
+        del seq_keys, seq_counts
+        for level_name in level_names:
+            print(f"\t\tProcessing sequences by {level_name} ...")
+            keys, counts = levels.pop(level_name)
+            query = f''' INSERT INTO {sequences_table} (date, lineage_id, location_id, count) VALUES (?,?,?,?)'''
+            self.con.executemany(query, ((date, lineage_id, location_id, count)
+                                         for (date, lineage_id, location_id), count
+                                         in zip(keys.tolist(), counts.tolist())))
+            self.con.commit()
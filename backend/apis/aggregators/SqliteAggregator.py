@@ -0,0 +1,153 @@
+import os
+from sqlite3 import connect
+
+from .Aggregator import Aggregator
+from ..utils.db_manager import connection_preset, clear_db
+from ..utils.path_manager import db_paths as paths, get_shard_db_paths
+
+
+class SqliteAggregator(Aggregator):
+    """
+    Aggregator staging every sequence and every aa substitution into two temporary SQLite databases,
+    then aggregated through GROUP BY queries
+    """
+
+    def __init__(self, con, staging_paths=(paths.temp_db1_path, paths.temp_db2_path)):
+        """
+        Initializes the aggregator object
+        Args:
+            con:            The connection to the db
+            staging_paths:  Paths of the temporary databases for sequences and aa substitutions
+        """
+        super().__init__(con)
+        self.staging_paths = staging_paths
+
+    @classmethod
+    def create_shard(cls, shard_idx):
+        aggregator = cls(connect(':memory:', check_same_thread=False), get_shard_db_paths(shard_idx))
+        aggregator.create_staging()
+        return aggregator
+
+    def run_query(self, query, params=None):
+        self.con.execute(query) if params is None else self.con.execute(query, params)
+        self.con.commit()
+
+    def create_staging(self):
+        seqs_path, subs_path = self.staging_paths
+        clear_db(db_name=seqs_path)
+        clear_db(db_name=subs_path)
+        self.con.execute(f''' ATTACH DATABASE '{seqs_path}' AS temp_table1; ''')
+        self.con.execute(f''' ATTACH DATABASE '{subs_path}' AS temp_table2;''')
+        connection_preset(self.con)
+
+        self.run_query('''  CREATE TABLE temp_table1.sequences
+                            (sequence_id int, date int, lineage_id int, continent_id int, country_id int, region_id int )''')
+        self.run_query('''  CREATE TABLE temp_table2.aa_substitutions
+                            (sequence_id int, mut_id int)''')
+
+    def add_sequences(self, batch):
+        query = ''' INSERT INTO temp_table1.sequences(sequence_id, date, lineage_id, continent_id, country_id, region_id) 
+                    VALUES (?,?,?,?,?,?)'''
+        self.con.executemany(query, batch)
+        self.con.commit()
+
+    def add_substitutions(self, batch):
+        query = ''' INSERT INTO temp_table2.aa_substitutions(sequence_id, mut_id) 
+                    VALUES (?,?)'''
+        self.con.executemany(query, batch)
+        self.con.commit()
+
+    def export_shard(self):
+        self.con.commit()
+        self.con.close()
+        return self.staging_paths
+
+    def merge_shard(self, shard_data, lineage_map, mutation_map, location_map, sequences_offset):
+        cur = self.con.cursor()
+        for table, data in (('lineage_map', lineage_map), ('mutation_map', mutation_map),
+                            ('location_map', location_map)):
+            cur.execute(f'''CREATE TEMP TABLE IF NOT EXISTS {table} (local_id int primary key, global_id int)''')
+            cur.execute(f'''DELETE FROM {table}''')
+            cur.executemany(f'''INSERT INTO {table} (local_id, global_id) VALUES (?,?)''', data)
+        self.con.commit()
+
+        seqs_path, subs_path = shard_data
+        cur.execute('''ATTACH DATABASE ? AS shard_table1''', (seqs_path,))
+        cur.execute('''ATTACH DATABASE ? AS shard_table2''', (subs_path,))
+        cur.execute('''  INSERT INTO temp_table1.sequences(sequence_id, date, lineage_id, continent_id, country_id, region_id)
+                        SELECT SQ.sequence_id + :offset, SQ.date, LIN.global_id, CON.global_id, COU.global_id, REG.global_id
+                        FROM shard_table1.sequences SQ
+                            JOIN lineage_map LIN ON SQ.lineage_id = LIN.local_id
+                            JOIN location_map CON ON SQ.continent_id = CON.local_id
+                            LEFT JOIN location_map COU ON SQ.country_id = COU.local_id
+                            LEFT JOIN location_map REG ON SQ.region_id = REG.local_id;''',
+                    {'offset': sequences_offset})
+        cur.execute('''  INSERT INTO temp_table2.aa_substitutions(sequence_id, mut_id)
+                        SELECT SB.sequence_id + :offset, MU.global_id
+                        FROM shard_table2.aa_substitutions SB
+                            JOIN mutation_map MU ON SB.mut_id = MU.local_id;''',
+                    {'offset': sequences_offset})
+        self.con.commit()
+        cur.execute('''DETACH DATABASE shard_table1''')
+        cur.execute('''DETACH DATABASE shard_table2''')
+        os.remove(seqs_path)
+        os.remove(subs_path)
+
+    def aggregate(self, sequences_table='aggr_sequences', substitutions_table='aggr_aa_substitutions'):
+        seqs_path, subs_path = self.staging_paths
+
+        # Map each location to its continent, country and region (NULL for the levels below the location)
+        self.run_query('''  CREATE TEMP TABLE location_levels AS
+                                SELECT continent_id AS location_id, continent_id, NULL AS country_id, NULL AS region_id
+                                FROM continents
+                                UNION ALL
+                                SELECT country_id, continent_id, country_id, NULL
+                                FROM countries
+                                UNION ALL
+                                SELECT region_id, continent_id, RE.country_id, region_id
+                                FROM regions RE JOIN countries CO ON RE.country_id = CO.country_id;''')
+
+        # Staged rows are read only once, to aggregate them at the finest location known for each sequence.
+        # The counts of each level are then rolled up from these partial aggregates.
+        print("\t\tProcessing aa substitutions by finest location ...")
+        self.run_query('''  CREATE TEMP TABLE finest_aa_substitutions AS
+                                SELECT date, lineage_id, coalesce(region_id, country_id, continent_id) AS location_id, 
+                                    mut_id, count(*) AS count 
+                                FROM temp_table1.sequences SQ JOIN temp_table2.aa_substitutions SB ON SQ.sequence_id=SB.sequence_id
+                                GROUP BY date, lineage_id, coalesce(region_id, country_id, continent_id), mut_id;''')
+
+        self.run_query('''  DETACH DATABASE 'temp_table2';''')
+        clear_db(db_name=subs_path)
+
+        for level in ('continent', 'country', 'region'):
+            print(f"\t\tProcessing aa substitutions by {level} ...")
+            self.run_query(f'''  INSERT INTO {substitutions_table} 
+                                SELECT date, lineage_id, {level}_id AS location_id, mut_id, sum(count) AS count 
+                                FROM temp.finest_aa_substitutions FS 
+                                    JOIN temp.location_levels LL ON FS.location_id = LL.location_id
+                                WHERE {level}_id IS NOT NULL
+                                GROUP BY date, lineage_id, {level}_id, mut_id;''')
+
+        self.run_query('''  DROP TABLE temp.finest_aa_substitutions;''')
+
+        print("\t\tProcessing sequences by finest location ...")
+        self.run_query('''  CREATE TEMP TABLE finest_sequences AS
+                                SELECT date, lineage_id, coalesce(region_id, country_id, continent_id) AS location_id, 
+                                    count(*) AS count 
+                                FROM temp_table1.sequences 
+                                GROUP BY date, lineage_id, coalesce(region_id, country_id, continent_id);''')
+
+        self.run_query('''  DETACH DATABASE 'temp_table1';''')
+        clear_db(db_name=seqs_path)
+
+        for level in ('continent', 'country', 'region'):
+            print(f"\t\tProcessing sequences by {level} ...")
+            self.run_query(f'''  INSERT INTO {sequences_table} 
+                                SELECT date, lineage_id, {level}_id AS location_id, sum(count) AS count 
+                                FROM temp.finest_sequences FS 
+                                    JOIN temp.location_levels LL ON FS.location_id = LL.location_id
+                                WHERE {level}_id IS NOT NULL 
+                                GROUP BY date, lineage_id, {level}_id;''')
+
+        self.run_query('''  DROP TABLE temp.finest_sequences;''')
+        self.run_query('''  DROP TABLE temp.location_levels;''')
@@ -5,10 +5,11 @@
 
 """
 
-import sqlite3
+import numpy as np
 
 from ..startup import is_public
-from ..utils.path_manager import db_path
+from ..utils.db_manager import get_connection, release_connection
+from ..utils.manifest_manager import get_manifest, has_coverage
 from ..utils.utils import compute_date_from_diff
 
 
@@ -28,7 +29,7 @@ def extract_seq_num(location, lineages):
                 ]
 
     """
-    con = sqlite3.connect(db_path)
+    con = get_connection()
     cur = con.cursor()
 
     def execute_query():
@@ -52,7 +53,7 @@ def extract_seq_num(location, lineages):
         return [{'date': x[0], 'seq_count': x[1]} for x in seqs]
 
     daily_sequence_counts = execute_query()
-    con.close()
+    release_connection(con)
     return daily_sequence_counts
 
 
@@ -72,60 +73,57 @@ def extract_lineage_breakdown(location, period):
                 Example: {'BA.5':{'876':1, '878':3}, ... ,'Others':{'873':14, '874':3}}
 
     """
-    con = sqlite3.connect(db_path)
+    if not has_coverage(location, period['begin'] - 1, period['end']):
+        return {}  # no sequences in the period, according to the manifest
+
+    con = get_connection()
     cur = con.cursor()
 
-    def extract_lineages():
-        # Extract lineages present in the given location and period
-        query = ''' SELECT DISTINCT SQ.lineage_id, lineage
-                    FROM aggr_sequences SQ
-                        JOIN lineages LN ON SQ.lineage_id = LN.lineage_id
-                    WHERE location_id=:loc_id AND date>=:begin AND date<=:end
-                    ORDER BY lineage;'''
-        res = cur.execute(query, {'loc_id': location, 'begin': period['begin'], 'end': period['end']}).fetchall()
-        return {k: v for k, v in res}
-
-    def extract_day_threshold(day):
-        # Given a day, extracts how much is 10% of the sequences collected on that day
-        query = ''' SELECT 0.10 * sum(count)
-                    FROM aggr_sequences SQ
-                    WHERE location_id=:loc_id AND date=:day;'''
-        day_threshold = cur.execute(query, {'loc_id': location, 'day': day}).fetchone()
-        return day_threshold[0] if day_threshold[0] is not None else 0
-
-    def extract_lineage_data(lin_id, day):
-        # Extracts the number of sequences associated with a given lineage on a given day,
-        # for the location considered
-        query = ''' SELECT sum(count)
-                    FROM aggr_sequences SQ
-                    WHERE lineage_id=:lin_id AND location_id=:loc_id and date=:day
-                    GROUP BY date, lineage_id, SQ.location_id;'''
-        day_count = cur.execute(query, {'lin_id': lin_id, 'loc_id': location, 'day': day}).fetchone()
-        return day_count[0] if day_count is not None else 0
-
-    lineages = extract_lineages()  # extract the lineages to be considered for the loc and period
+    # Extract the daily counts of the lineages present in the given location and period, in a single query
+    query = ''' SELECT lineage, date, sum(count)
+                FROM aggr_sequences SQ
+                    JOIN lineages LN ON SQ.lineage_id = LN.lineage_id
+                WHERE location_id=:loc_id AND date>=:begin AND date<=:end
+                GROUP BY SQ.lineage_id, date
+                ORDER BY lineage;'''
+    rows = cur.execute(query, {'loc_id': location, 'begin': period['begin'], 'end': period['end']}).fetchall()
+    release_connection(con)
+    if len(rows) == 0:
+        return {}
+
+    # Matrix of the counts: a row for each day in the period, a column for each lineage (sorted by name)
+    lineage_ids = {}
+    for lineage_name, _, _ in rows:
+        lineage_ids.setdefault(lineage_name, len(lineage_ids))
+    lineage_names = list(lineage_ids)
+    days = np.arange(period['begin'], period['end'] + 1)
+    counts = np.zeros((len(days), len(lineage_names)), dtype=np.int64)
+    counts[[date - period['begin'] for _, date, _ in rows], [lineage_ids[name] for name, _, _ in rows]] = \
+        [seq_count for _, _, seq_count in rows]
+
+    # Lineages appear standalone only if they exceed 10% of the sequences collected on the day, otherwise under 'Others'
+    thresholds = 0.10 * counts.sum(axis=1)
+    standalone = counts > thresholds[:, np.newaxis]
+    others = ~standalone
+
+    # Keys are ordered by their first appearance, iterating over the days and then over the lineages
+    first_appearances = [(standalone[:, j].argmax(), j, lineage_name)
+                         for j, lineage_name in enumerate(lineage_names) if standalone[:, j].any()]
+    if others.any():
+        first_day, first_lineage = np.unravel_index(others.argmax(), others.shape)
+        first_appearances.append((first_day, first_lineage, 'Others'))
+    first_appearances.sort()
+
+    days = days.tolist()
+    others_counts = np.where(others, counts, 0).sum(axis=1).tolist()
+    others_days = np.flatnonzero(others.any(axis=1)).tolist()
     lineage_breakdown = {}
-    # Iterate over the days in the considered period
-    for date in range(period['begin'], period['end'] + 1):
-        threshold = extract_day_threshold(date)  # extract minimum number of seq to appear in the result
-
-        # Iterate over the lineages in the period
-        for lineage_id, lineage_name in lineages.items():
-            seq_count = extract_lineage_data(lineage_id, date)  # extract the count
-            # Decide whether it appears as standalone or under others
-            key = lineage_name if seq_count > threshold else 'Others'
-
-            # Lineage already in the dictionary?
-            if key in lineage_breakdown.keys():
-                # Do we need to accumulate in 'Others'?
-                if key == 'Others' and date in lineage_breakdown['Others'].keys():
-                    lineage_breakdown[key][date] += seq_count
-                else:
-                    lineage_breakdown[key][date] = seq_count
-            else:
-                lineage_breakdown[key] = {date: seq_count}
-
-    con.close()
+    for _, j, key in first_appearances:
+        if key == 'Others':
+            lineage_breakdown[key] = {days[d]: others_counts[d] for d in others_days}
+        else:
+            lineage_breakdown[key] = {days[d]: int(counts[d, j]) for d in np.flatnonzero(standalone[:, j]).tolist()}
+
     return lineage_breakdown
 
 
@@ -146,25 +144,10 @@ def extract_dataset_info():
                 } 
 
     """
-    con = sqlite3.connect(db_path)
-    cur = con.cursor()
-
-    def extract_last_update():
-        # Fetch date of the most recent sequence in the database
-        query = ''' SELECT max(date) 
-                    FROM aggr_sequences;'''
-        diff = cur.execute(query).fetchone()[0]
-        return compute_date_from_diff(diff) if diff is not None else None
-
-    def extract_parsing_info():
-        # Fetch metadata from info table
-        query = ''' SELECT file_type, filtered_countries, beginning_date, end_date, parse_date, version
-                    FROM  info;'''
-        return cur.execute(query).fetchone()
-
-    parsing_info = extract_parsing_info()  # extract metadata
+    manifest = get_manifest()  # both the info and the last date are read from the manifest, without queries
+    parsing_info = manifest['info']
     info = {
-        'last_update': extract_last_update(),  # extract last sequence
+        'last_update': compute_date_from_diff(manifest['last_date']) if manifest['last_date'] is not None else None,
         'file_type': parsing_info[0],
         'filtered_countries': parsing_info[1] if len(parsing_info[1]) > 0 else "all",
         'begin_date': parsing_info[2],
@@ -173,8 +156,6 @@ def extract_dataset_info():
         'version': parsing_info[5],
         'is_public': is_public
     }
-
-    con.close()
     return info
 
 
@@ -188,7 +169,7 @@ def extract_lineage_characterization(lineages):
     Returns:    List of characterizing mutation for the lineages.
 
     """
-    con = sqlite3.connect(db_path)
+    con = get_connection()
     cur = con.cursor()
 
     def extract_muts_from_lineage():
@@ -196,14 +177,15 @@ def extract_lineage_characterization(lineages):
         query = ''' SELECT DISTINCT protein, mut
                     FROM lineages_characteristics LC
                         JOIN lineages LN ON LC.lineage_id = LN.lineage_id
-                        JOIN proteins PR ON LC.protein_id = PR.protein_id
+                        JOIN mutations MU ON LC.mut_id = MU.mut_id
+                        JOIN proteins PR ON MU.protein_id = PR.protein_id
                     WHERE lineage in (%s) ''' % ("?," * len(lineages))[:-1] + '''
                     ORDER BY protein, mut;'''
         return [x[0] + '_' + x[1] for x in cur.execute(query, lineages).fetchall()]
 
     characterizing_muts = extract_muts_from_lineage()
 
-    con.close()
+    release_connection(con)
     return characterizing_muts
 
 
@@ -218,18 +200,19 @@ def extract_characterized_lineages(prot, mut):
                 (such that at least 50 percent of the lineage sequences have the mutation)
 
     """
-    con = sqlite3.connect(db_path)
+    con = get_connection()
     cur = con.cursor()
 
     query = ''' SELECT L.lineage
                 FROM lineages_characteristics AS LC
-                    JOIN proteins AS P  ON P.protein_id=LC.protein_id
+                    JOIN mutations AS M ON M.mut_id=LC.mut_id
+                    JOIN proteins AS P  ON P.protein_id=M.protein_id
                     JOIN lineages AS L ON L.lineage_id=LC.lineage_id
-                WHERE P.protein=:prot AND LC.mut=:mut
+                WHERE P.protein=:prot AND M.mut=:mut
                 ORDER BY  L.lineage;'''
     lineages = [lineage for [lineage] in cur.execute(query, {'prot': prot, 'mut': mut}).fetchall()]
 
-    con.close()
+    release_connection(con)
     return lineages
 
 
@@ -246,15 +229,15 @@ def extract_mutation_history(prot, mut):
                 Example: {'BA.2':{'abs':12, 'percentage':53.4},...}
 
     """
-    con = sqlite3.connect(db_path)
+    con = get_connection()
     cur = con.cursor()
 
     # Extract the list of lineages and the number of seq having the given mutation
     query = ''' SELECT L.lineage, SUM(AA.count)
                 FROM aggr_aa_substitutions AS AA
-                    JOIN proteins AS P  ON P.protein_id = AA.protein_id
                     JOIN lineages AS L ON AA.lineage_id = L.lineage_id
-                WHERE P.protein=:prot AND AA.mut=:mut
+                WHERE AA.mut_id = (SELECT M.mut_id FROM mutations AS M JOIN proteins AS P ON P.protein_id = M.protein_id
+                                   WHERE P.protein=:prot AND M.mut=:mut)
                 GROUP BY L.lineage
                 HAVING SUM(AA.count)>0
                 ORDER BY SUM(AA.count) DESC ;'''
@@ -269,5 +252,5 @@ def extract_mutation_history(prot, mut):
     for lineage in history:
         history[lineage]['percentage'] = 100 * history[lineage]['abs'] / total
 
-    con.close()
+    release_connection(con)
     return history
@@ -5,9 +5,9 @@
 
 """
 
-import sqlite3
+from ..utils.db_manager import get_connection, release_connection, has_tables
 
-from ..utils.path_manager import db_path
+batch_size = 100  # max number of locations whose mutations are extracted by a single query
 
 
 def extract_week_seq_counts(location, w, prot=None, mut=None):
@@ -25,33 +25,56 @@ def extract_week_seq_counts(location, w, prot=None, mut=None):
                 [tot_week1, tot_week2, tot_week3, tot_week4]
 
     """
-    con = sqlite3.connect(db_path)
+    con = get_connection()
     cur = con.cursor()
 
-    def extract_week_count(start, stop):
+    if has_tables('cumul_location_sequences', 'cumul_aa_substitutions'):
+        # Differences of the cumulative counts at the ends of the 4 weeks
         if prot is not None and mut is not None:
-            # Count the seq collected daily for a given week and location having a given prot_mut
-            query = ''' SELECT sum(count)
-                        FROM  aggr_aa_substitutions SB
-                            JOIN proteins PR ON SB.protein_id = PR.protein_id
-                        WHERE date > :start AND date <= :stop AND location_id = :loc_id
-                            AND mut=:mut AND protein=:prot 
-                        GROUP BY date, SB.location_id;'''
+            query = ''' WITH bounds(pos, day) AS (VALUES (0, :w1_begin), (1, :w2_begin), (2, :w3_begin),
+                                                     (3, :w4_begin), (4, :w4_end))
+                        SELECT (SELECT count FROM cumul_aa_substitutions
+                                WHERE location_id = :loc_id AND date <= day
+                                    AND mut_id = (SELECT mut_id FROM mutations MU
+                                                    JOIN proteins PR ON MU.protein_id = PR.protein_id
+                                                  WHERE protein=:prot AND mut=:mut)
+                                ORDER BY date DESC LIMIT 1)
+                        FROM bounds
+                        ORDER BY pos;'''
         else:
-            # Count the seq collected daily for a given week and location
-            query = ''' SELECT sum(count)
-                        FROM  aggr_sequences SQ
-                        WHERE date > :start AND date <= :stop AND location_id = :loc_id
-                        GROUP BY date, SQ.location_id;'''
-        params = {'start': start, 'stop': stop, 'loc_id': location, 'prot': prot, 'mut': mut}
-        return sum([x[0] for x in cur.execute(query, params).fetchall()])  # sum daily counts within the week
-
-    tot_seq_w4 = extract_week_count(w['w4_begin'], w['w4_end'])
-    tot_seq_w3 = extract_week_count(w['w3_begin'], w['w3_end'])
-    tot_seq_w2 = extract_week_count(w['w2_begin'], w['w2_end'])
-    tot_seq_w1 = extract_week_count(w['w1_begin'], w['w1_end'])
-    con.close()
-    return [tot_seq_w1, tot_seq_w2, tot_seq_w3, tot_seq_w4]
+            query = ''' WITH bounds(pos, day) AS (VALUES (0, :w1_begin), (1, :w2_begin), (2, :w3_begin),
+                                                     (3, :w4_begin), (4, :w4_end))
+                        SELECT (SELECT count FROM cumul_location_sequences
+                                WHERE location_id = :loc_id AND date <= day
+                                ORDER BY date DESC LIMIT 1)
+                        FROM bounds
+                        ORDER BY pos;'''
+        params = {**w, 'loc_id': location, 'prot': prot, 'mut': mut}
+        cumul_counts = [count or 0 for count, in cur.execute(query, params).fetchall()]
+        release_connection(con)
+        return [cumul_counts[week + 1] - cumul_counts[week] for week in range(4)]
+
+    # Count the seq collected in the 4 weeks with a single scan, bucketing the days into weeks (from 0 to 3)
+    if prot is not None and mut is not None:
+        # Count only the seq having a given prot_mut
+        query = ''' SELECT (date - :begin - 1) / 7 AS week, sum(count)
+                    FROM  aggr_aa_substitutions
+                    WHERE date > :begin AND date <= :end AND location_id = :loc_id
+                        AND mut_id = (SELECT mut_id FROM mutations MU JOIN proteins PR ON MU.protein_id = PR.protein_id
+                                      WHERE protein=:prot AND mut=:mut)
+                    GROUP BY week;'''
+    else:
+        query = ''' SELECT (date - :begin - 1) / 7 AS week, sum(count)
+                    FROM  aggr_sequences
+                    WHERE date > :begin AND date <= :end AND location_id = :loc_id
+                    GROUP BY week;'''
+    params = {'begin': w['w1_begin'], 'end': w['w4_end'], 'loc_id': location, 'prot': prot, 'mut': mut}
+    week_counts = [0, 0, 0, 0]
+    for week, count in cur.execute(query, params).fetchall():
+        week_counts[week] = count
+
+    release_connection(con)
+    return week_counts
 
 
 def extract_mutation_data(location, w, min_sequences=0):
@@ -63,29 +86,158 @@ def extract_mutation_data(location, w, min_sequences=0):
         min_sequences:  Minimum number of sequence required for the mutations appearing in week 4
                         to be considered in the result
 
-    Returns: A list describing the mutations for each week
+    Returns:    A list describing the mutations of the 4th week for each week, as dictionaries of the form
+                {mut_id: count}, and a dictionary of the form {mut_id: (protein, mut)} naming them
+
+    """
+    con = get_connection()
+    cur = con.cursor()
+
+    if has_tables('cumul_aa_substitutions'):
+        # Differences of the cumulative counts at the ends of the weeks (NULL if absent). The 4th week is
+        # computed first, for the mutations detected in it, then the other weeks for the ones having tot>min_seq
+        query = '''     SELECT SB.mut_id, protein, mut,
+                               nullif(ifnull(b1, 0) - ifnull(b0, 0), 0) AS c1,
+                               nullif(ifnull(b2, 0) - ifnull(b1, 0), 0) AS c2,
+                               nullif(b3 - ifnull(b2, 0), 0) AS c3,
+                               c4
+                        FROM (  SELECT mut_id, b3, c4,
+                                       (SELECT count FROM cumul_aa_substitutions CM
+                                        WHERE CM.location_id = :loc_id AND CM.mut_id = W4.mut_id AND date <= :w1_begin
+                                        ORDER BY date DESC LIMIT 1) AS b0,
+                                       (SELECT count FROM cumul_aa_substitutions CM
+                                        WHERE CM.location_id = :loc_id AND CM.mut_id = W4.mut_id AND date <= :w2_begin
+                                        ORDER BY date DESC LIMIT 1) AS b1,
+                                       (SELECT count FROM cumul_aa_substitutions CM
+                                        WHERE CM.location_id = :loc_id AND CM.mut_id = W4.mut_id AND date <= :w3_begin
+                                        ORDER BY date DESC LIMIT 1) AS b2
+                                FROM (  SELECT mut_id, ifnull(b3, 0) AS b3, b4 - ifnull(b3, 0) AS c4
+                                        FROM (  SELECT mut_id,
+                                                               (SELECT count FROM cumul_aa_substitutions CM
+                                                                WHERE CM.location_id = :loc_id AND CM.mut_id = CD.mut_id AND date <= :w4_begin
+                                                                ORDER BY date DESC LIMIT 1) AS b3,
+                                                               (SELECT count FROM cumul_aa_substitutions CM
+                                                                WHERE CM.location_id = :loc_id AND CM.mut_id = CD.mut_id AND date <= :w4_end
+                                                                ORDER BY date DESC LIMIT 1) AS b4
+                                                FROM (  SELECT DISTINCT mut_id
+                                                        FROM cumul_aa_substitutions INDEXED BY cumul_aa_substitutions_idx
+                                                        WHERE location_id = :loc_id
+                                                            AND date > :w4_begin AND date <= :w4_end) CD)
+                                        WHERE b4 - ifnull(b3, 0) >= :min_seq) W4) SB
+                            JOIN mutations MU ON SB.mut_id = MU.mut_id
+                            JOIN proteins PR ON MU.protein_id = PR.protein_id
+                        ORDER BY MU.protein_id, mut;'''
+    else:
+        # Count the muts of the 4 weeks with a single scan, pivoting the weeks into columns (NULL if absent).
+        # Names are joined only after the aggregation, for the mutations having tot>min_seq in the 4th week
+        query = '''     SELECT SB.mut_id, protein, mut, c1, c2, c3, c4
+                        FROM (  SELECT mut_id,
+                                       sum(CASE WHEN date <= :w1_end THEN count END) AS c1,
+                                       sum(CASE WHEN date > :w2_begin AND date <= :w2_end THEN count END) AS c2,
+                                       sum(CASE WHEN date > :w3_begin AND date <= :w3_end THEN count END) AS c3,
+                                       sum(CASE WHEN date > :w4_begin THEN count END) AS c4
+                                FROM aggr_aa_substitutions
+                                WHERE date > :w1_begin AND date <= :w4_end AND location_id = :loc_id
+                                GROUP BY mut_id
+                                HAVING c4 >= :min_seq) SB
+                            JOIN mutations MU ON SB.mut_id = MU.mut_id
+                            JOIN proteins PR ON MU.protein_id = PR.protein_id
+                        ORDER BY MU.protein_id, mut;'''
+    params = {**w, 'loc_id': location, 'min_seq': min_sequences}
+    rows = cur.execute(query, params).fetchall()
+
+    week_mutations = [{m: counts[week] for m, _, _, *counts in rows if counts[week] is not None} for week in range(4)]
+    mutation_names = {m: (p, mut) for m, p, mut, *_ in rows}
+    release_connection(con)
+    return week_mutations, mutation_names
+
+
+def extract_batch_week_seq_counts(locations, w):
+    """
+    Extract weekly sequence counts for the given locations and weeks, with a single scan for all the locations
+    Args:
+        locations:  List of identifiers of the locations to be considered
+        w:          Dictionary describing the weeks to be considered
+
+    Returns:    Dictionary of the form {location identifier: [tot_week1, tot_week2, tot_week3, tot_week4]}
+                (see extract_week_seq_counts)
 
     """
-    con = sqlite3.connect(db_path)
+    week_counts = {location: [0, 0, 0, 0] for location in locations}
+    if len(locations) == 0:
+        return week_counts
+
+    con = get_connection()
+    cur = con.cursor()
+
+    # Count the seq collected in the 4 weeks, bucketing the days into weeks (from 0 to 3) for each location.
+    # The rows of the 4 weeks are read through the date index, instead of the whole history of each location
+    query = ''' SELECT location_id, (date - ? - 1) / 7 AS week, sum(count)
+                FROM  aggr_sequences INDEXED BY aggr_sequences_idx1
+                WHERE date > ? AND date <= ? AND location_id IN (%s)
+                GROUP BY location_id, week;''' % ("?," * len(locations))[:-1]
+    params = [w['w1_begin'], w['w1_begin'], w['w4_end']] + list(locations)
+    for location, week, count in cur.execute(query, params).fetchall():
+        week_counts[location][week] = count
+
+    release_connection(con)
+    return week_counts
+
+
+def extract_batch_mutation_data(min_sequences, w):
+    """
+    Extract weekly mutation data for the given locations and weeks, with a single query for up to batch_size locations
+    Args:
+        min_sequences:  Dictionary of the form {location identifier: min number of sequences}, with the locations
+                        to be considered and the minimum number of sequence required for the mutations appearing
+                        in their week 4 to be considered in the result
+        w:              Dictionary describing the weeks to be considered
+
+    Returns:    Dictionary of the form {location identifier: (week mutations, mutation names)}, with the
+                mutation data of each location (see extract_mutation_data)
+
+    """
+    mutation_data = {location: ([{}, {}, {}, {}], {}) for location in min_sequences}
+    if len(min_sequences) == 0:
+        return mutation_data
+
+    con = get_connection()
     cur = con.cursor()
 
-    def extract_week_mutation(start, stop, is_target=False):
-        having_clause = "HAVING sum(count) >= :min_seq"
-        query = f'''    SELECT protein, mut, sum(count) 
-                        FROM aggr_aa_substitutions SB
-                            JOIN proteins PR ON SB.protein_id = PR.protein_id
-                        WHERE date > :start AND date <= :stop AND location_id = :loc_id
-                        GROUP BY SB.protein_id, mut
-                        {having_clause if is_target else ""};'''
-        params = {'start': start, 'stop': stop, 'loc_id': location, 'min_seq': min_sequences}
-        return {p + '_' + m: c for p, m, c in cur.execute(query, params).fetchall()}
-
-    muts_w4 = extract_week_mutation(w['w4_begin'], w['w4_end'], is_target=True)  # extract muts having tot>min_seq
-    muts_w3 = extract_week_mutation(w['w3_begin'], w['w3_end'])  # extract all muts
-    muts_w2 = extract_week_mutation(w['w2_begin'], w['w2_end'])  # extract all muts
-    muts_w1 = extract_week_mutation(w['w1_begin'], w['w1_end'])  # extract all muts
-    con.close()
-    return [muts_w1, muts_w2, muts_w3, muts_w4]
+    # Count the muts of the 4 weeks of each location, pivoting the weeks into columns (NULL if absent), and keep
+    # the ones having tot>min_seq in the 4th week. The locations are grouped separately, sorting only their own
+    # rows, but within the same query. Names are joined only after the aggregation
+    location_query = '''    SELECT location_id, mut_id,
+                                   sum(CASE WHEN date <= :w1_end THEN count END) AS c1,
+                                   sum(CASE WHEN date > :w2_begin AND date <= :w2_end THEN count END) AS c2,
+                                   sum(CASE WHEN date > :w3_begin AND date <= :w3_end THEN count END) AS c3,
+                                   sum(CASE WHEN date > :w4_begin THEN count END) AS c4
+                            FROM aggr_aa_substitutions
+                            WHERE date > :w1_begin AND date <= :w4_end AND location_id = :loc_id_%d
+                            GROUP BY mut_id
+                            HAVING c4 >= :min_seq_%d'''
+    locations = list(min_sequences)
+    for chunk_start in range(0, len(locations), batch_size):
+        chunk = range(chunk_start, min(chunk_start + batch_size, len(locations)))
+        query = ''' SELECT SB.location_id, SB.mut_id, protein, mut, c1, c2, c3, c4
+                    FROM (%s) SB
+                        JOIN mutations MU ON SB.mut_id = MU.mut_id
+                        JOIN proteins PR ON MU.protein_id = PR.protein_id
+                    ORDER BY SB.location_id, MU.protein_id, mut;''' % ' UNION ALL '.join(location_query % (i, i)
+                                                                                for i in chunk)
+        params = dict(w)
+        for i in chunk:
+            params['loc_id_%d' % i], params['min_seq_%d' % i] = locations[i], min_sequences[locations[i]]
+
+        for location, m, p, mut, *counts in cur.execute(query, params).fetchall():
+            week_mutations, mutation_names = mutation_data[location]
+            for week in range(4):
+                if counts[week] is not None:
+                    week_mutations[week][m] = counts[week]
+            mutation_names[m] = (p, mut)
+
+    release_connection(con)
+    return mutation_data
 
 
 def extract_lineages_data(location, prot, mut, w):
@@ -112,48 +264,33 @@ def extract_lineages_data(location, prot, mut, w):
                 ]
 
     """
-    con = sqlite3.connect(db_path)
+    con = get_connection()
     cur = con.cursor()
 
-    # Extract week seq counts for the mutation
-    week_sequence_counts = extract_week_seq_counts(location, w, prot, mut)
-    tot_seq_w1, tot_seq_w2, tot_seq_w3, tot_seq_w4 = week_sequence_counts
-
-    def extract_all_lineages(start, stop):
-        # Extract the lineages for the considered period, location, prot and mut
-        query = f'''    SELECT DISTINCT SB.lineage_id, lineage
-                        FROM aggr_aa_substitutions SB
-                            JOIN lineages LN ON SB.lineage_id = LN.lineage_id
-                            JOIN proteins PR ON SB.protein_id = PR.protein_id
-                        WHERE date > :start AND date <= :stop AND location_id = :loc_id
-                            AND mut=:mut AND protein=:prot
-                        ORDER BY lineage;'''
-        params = {'start': start, 'stop': stop, 'loc_id': location, 'prot': prot, 'mut': mut}
-        return {k: v for k, v in cur.execute(query, params).fetchall()}
-
-    def extract_week_info(lin_id, start, stop):
-        # Extract the daily total number of mutations detected in the period and location associated
-        # with the given lineage and mutation
-        query = f'''    SELECT sum(count) 
-                        FROM aggr_aa_substitutions SB
-                            JOIN proteins PR ON SB.protein_id = PR.protein_id
-                        WHERE date > :start AND date <= :stop AND location_id = :loc_id
-                            AND lineage_id = :lin_id AND mut=:mut AND protein=:prot
-                        GROUP BY date, SB.location_id, SB.protein_id, mut, lineage_id;'''
-        params = {'start': start, 'stop': stop, 'loc_id': location, 'prot': prot, 'mut': mut, 'lin_id': lin_id}
-        return sum([x[0] for x in cur.execute(query, params).fetchall()])  # sum daily counts within the week
-
-    lineages = extract_all_lineages(w['w1_begin'], w['w4_end'])  # extract all the lineages in the period and location
-    lineages_data = []
+    # Count the seq having the mutation for each lineage in the 4 weeks with a single scan,
+    # pivoting the weeks into columns
+    query = '''     SELECT lineage, c1, c2, c3, c4
+                    FROM (  SELECT lineage_id,
+                                   sum(CASE WHEN date <= :w1_end THEN count ELSE 0 END) AS c1,
+                                   sum(CASE WHEN date > :w2_begin AND date <= :w2_end THEN count ELSE 0 END) AS c2,
+                                   sum(CASE WHEN date > :w3_begin AND date <= :w3_end THEN count ELSE 0 END) AS c3,
+                                   sum(CASE WHEN date > :w4_begin THEN count ELSE 0 END) AS c4
+                            FROM aggr_aa_substitutions
+                            WHERE date > :w1_begin AND date <= :w4_end AND location_id = :loc_id
+                                AND mut_id = (SELECT mut_id FROM mutations MU JOIN proteins PR ON MU.protein_id = PR.protein_id
+                                              WHERE protein=:prot AND mut=:mut)
+                            GROUP BY lineage_id) SB
+                        JOIN lineages LN ON SB.lineage_id = LN.lineage_id
+                    ORDER BY lineage;'''
+    params = {**w, 'loc_id': location, 'prot': prot, 'mut': mut}
+    rows = cur.execute(query, params).fetchall()
+    release_connection(con)
 
-    # Iterate over the lineages
-    for lineage_id, lineage_name in lineages.items():
-        # Extracts the counts of the sequences, associated with the lineage, having the mutation, in the 4 weeks
-        lin_w4 = extract_week_info(lineage_id, w['w4_begin'], w['w4_end'])
-        lin_w3 = extract_week_info(lineage_id, w['w3_begin'], w['w3_end'])
-        lin_w2 = extract_week_info(lineage_id, w['w2_begin'], w['w2_end'])
-        lin_w1 = extract_week_info(lineage_id, w['w1_begin'], w['w1_end'])
+    # The week seq counts for the mutation are the sums over the lineages
+    tot_seq_w1, tot_seq_w2, tot_seq_w3, tot_seq_w4 = [sum(row[week] for row in rows) for week in range(1, 5)]
+    lineages_data = []
 
+    for lineage_name, lin_w1, lin_w2, lin_w3, lin_w4 in rows:
         # Store the data in the final structure
         lineages_data.append({
             'name': lineage_name,
@@ -169,5 +306,67 @@ def extract_lineages_data(location, prot, mut, w):
             'w4': lin_w4
         })
 
-    con.close()
     return lineages_data
+
+
+def extract_daily_seq_counts(location, begin, end):
+    """
+    Extract daily sequence counts for the given location and period
+    Args:
+        location:   Identifier of the location to be considered
+        begin:      Begin date (as diff from reference date) of the period, excluded
+        end:        End date (as diff from reference date) of the period, included
+
+    Returns:    List of the number of sequences collected in each day of the period
+
+    """
+    con = get_connection()
+    cur = con.cursor()
+
+    query = ''' SELECT date, sum(count)
+                FROM  aggr_sequences
+                WHERE date > :begin AND date <= :end AND location_id = :loc_id
+                GROUP BY date;'''
+    daily_counts = [0] * (end - begin)
+    for date, count in cur.execute(query, {'begin': begin, 'end': end, 'loc_id': location}).fetchall():
+        daily_counts[date - begin - 1] = count
+
+    release_connection(con)
+    return daily_counts
+
+
+def extract_daily_mutation_data(location, begin, end):
+    """
+    Extract daily mutation counts for the given location and period
+    Args:
+        location:   Identifier of the location to be considered
+        begin:      Begin date (as diff from reference date) of the period, excluded
+        end:        End date (as diff from reference date) of the period, included
+
+    Returns:    A list with the daily counts of each mutation found in the period, as lists of the number of sequences
+                having the mutation in each day of the period, and a list of the (protein, mut) pairs naming them.
+                Mutations are sorted as in extract_mutation_data
+
+    """
+    con = get_connection()
+    cur = con.cursor()
+
+    # Names are joined only after the aggregation
+    query = '''     SELECT SB.mut_id, protein, mut, date, count
+                    FROM (  SELECT mut_id, date, sum(count) AS count
+                            FROM aggr_aa_substitutions
+                            WHERE date > :begin AND date <= :end AND location_id = :loc_id
+                            GROUP BY mut_id, date) SB
+                        JOIN mutations MU ON SB.mut_id = MU.mut_id
+                        JOIN proteins PR ON MU.protein_id = PR.protein_id
+                    ORDER BY MU.protein_id, mut;'''
+    daily_counts = {}  # {mut_id: daily counts}
+    mutation_names = []
+    for m, p, mut, date, count in cur.execute(query, {'begin': begin, 'end': end, 'loc_id': location}).fetchall():
+        if m not in daily_counts:
+            daily_counts[m] = [0] * (end - begin)
+            mutation_names.append((p, mut))
+        daily_counts[m][date - begin - 1] = count
+
+    release_connection(con)
+    return list(daily_counts.values()), mutation_names
@@ -5,10 +5,10 @@
 
 """
 
-import sqlite3
 from datetime import datetime
 
-from ..utils.path_manager import db_path
+from ..utils.db_manager import get_connection, release_connection, has_tables
+from ..utils.manifest_manager import has_coverage
 from ..utils.utils import start_date
 
 
@@ -19,13 +19,13 @@ def get_all_lineages():
     Returns: A list of lineage names
 
     """
-    con = sqlite3.connect(db_path)
+    con = get_connection()
     cur = con.cursor()
 
     query = "SELECT lineage FROM lineages ORDER BY lineage;"
     extracted_lineages = [x[0] for x in cur.execute(query).fetchall()]
 
-    con.close()
+    release_connection(con)
     return extracted_lineages
 
 
@@ -48,8 +48,10 @@ def get_lineages_from_loc_date(location, date):
     stop = (datetime.strptime(date, "%Y-%m-%d") - start_date).days  # date to day-diff conversion
     start = stop - 7  # last week only, not the whole period!
     period_start = stop - 28
+    if not has_coverage(location, start, stop):
+        return {'possible_lineages': [], 'availability': {}}  # no sequences in the last week, according to the manifest
 
-    con = sqlite3.connect(db_path)
+    con = get_connection()
     cur = con.cursor()
     query = '''     SELECT lineage, sum(count)
                     FROM aggr_sequences SQ
@@ -68,7 +70,7 @@ def get_lineages_from_loc_date(location, date):
         'availability': {x[0]: x[1] for x in res}
     }
 
-    con.close()
+    release_connection(con)
     return extracted_lineages
 
 
@@ -82,7 +84,7 @@ def get_lineages_from_loc(location):
     Returns: A list of lineage names
 
     """
-    con = sqlite3.connect(db_path)
+    con = get_connection()
     cur = con.cursor()
 
     query = ''' SELECT DISTINCT lineage 
@@ -92,89 +94,203 @@ def get_lineages_from_loc(location):
                 ORDER BY lineage;'''
     extracted_lineages = [x[0] for x in cur.execute(query, {'loc_id': location}).fetchall()]
 
-    con.close()
+    release_connection(con)
     return extracted_lineages
 
 
-def extract_week_seq_counts(location, lineages, w):
+def extract_lineage_ids(lineages):
+    """
+    Resolve the given lineage names to their identifiers, so that the analyses filter on the identifiers only
+    Args:
+        lineages:   List of string representing the lineages to be considered
+
+    Returns: A list of lineage identifiers (unknown lineages are ignored)
+
+    """
+    con = get_connection()
+    cur = con.cursor()
+
+    query = ''' SELECT lineage_id
+                FROM lineages
+                WHERE lineage IN (%s);''' % ("?," * len(lineages))[:-1]
+    lineage_ids = [x[0] for x in cur.execute(query, lineages).fetchall()]
+
+    release_connection(con)
+    return lineage_ids
+
+
+def extract_family_selection(location, w, groups, lineage_ids):
+    """
+    Replaces the lineages of the given groups with the lineage families having pre-summed counts, if available.
+    A family includes all the descendants of a group, hence the ones with sequences in the 4 weeks but not selected
+    (i.e., without sequences in the last week) are to be subtracted: a family is used only if these are fewer than
+    the selected lineages it replaces
+    Args:
+        location:       Identifier of the location to be considered
+        w:              Dictionary describing the weeks to be considered
+        groups:         Dictionary of the groups in star notation (see parse_lineages)
+        lineage_ids:    List of identifiers of the selected lineages (see extract_lineage_ids)
+
+    Returns:    The identifiers of the families, of the selected lineages not replaced by them and of the lineages
+                to be subtracted from them
+
+    """
+    if len(groups) == 0 or not has_tables('lineage_families'):
+        return [], lineage_ids, []
+
+    con = get_connection()
+    cur = con.cursor()
+
+    # Descendants of the families of the groups having sequences in the 4 weeks
+    query = ''' SELECT family_id, lineage_id
+                FROM lineage_families F
+                    JOIN lineages_hierarchy H ON F.family = H.ancestor
+                WHERE F.family IN (%s)
+                    AND EXISTS (SELECT 1 FROM aggr_sequences SQ
+                                WHERE SQ.location_id = ? AND SQ.lineage_id = H.lineage_id
+                                    AND date > ? AND date <= ?);''' % ("?," * len(groups))[:-1]
+    params = [group[:-2] for group in groups] + [location, w['w1_begin'], w['w4_end']]
+    family_lineages = {}
+    for family_id, lineage_id in cur.execute(query, params).fetchall():
+        family_lineages.setdefault(family_id, set()).add(lineage_id)
+    release_connection(con)
+
+    # Larger families first, so that the nested ones are skipped
+    selected = set(lineage_ids)
+    covered, family_ids, excluded_ids = set(), [], []
+    for family_id, lineages in sorted(family_lineages.items(), key=lambda x: -len(x[1])):
+        excluded = lineages - selected
+        if not lineages <= covered and len(excluded) < len(lineages & selected):
+            covered |= lineages
+            family_ids.append(family_id)
+            excluded_ids.extend(excluded)
+    return family_ids, [x for x in lineage_ids if x not in covered], excluded_ids
+
+
+def extract_week_seq_counts(location, lineage_ids, w):
     """
     Extract weekly sequence counts for the given location, lineage and weeks
     Args:
-        location:   Identifier of the location to be considered
-        lineages:    List of string representing the lineages to be considered
-        w:          Dictionary describing the weeks to be considered
+        location:       Identifier of the location to be considered
+        lineage_ids:    List of identifiers of the lineages to be considered (see extract_lineage_ids)
+        w:              Dictionary describing the weeks to be considered
 
     Returns:    Array containing for each of the 4 weeks, the total number of sequences
                 matching the input parameters.
                 [tot_week1, tot_week2, tot_week3, tot_week4]
 
     """
-    con = sqlite3.connect(db_path)
+    con = get_connection()
     cur = con.cursor()
 
-    def extract_week_count(start, stop):
-        # Count the seq collected daily for a given week, lineage and location
-        query = ''' SELECT sum(count) 
-                    FROM aggr_sequences SQ
-                        JOIN lineages LN on SQ.lineage_id = LN.lineage_id
-                    WHERE date > ? AND date <= ? AND location_id = ? 
-                        AND lineage in (%s) ''' % ("?," * len(lineages))[:-1] + '''
-                    GROUP BY date;'''
-        params = [start, stop, location]
-        params.extend(lineages)
-        return sum([x[0] for x in cur.execute(query, params).fetchall()])  # sum daily counts within the week
-
-    tot_seq_w4 = extract_week_count(w['w4_begin'], w['w4_end'])
-    tot_seq_w3 = extract_week_count(w['w3_begin'], w['w3_end'])
-    tot_seq_w2 = extract_week_count(w['w2_begin'], w['w2_end'])
-    tot_seq_w1 = extract_week_count(w['w1_begin'], w['w1_end'])
-    con.close()
-    return [tot_seq_w1, tot_seq_w2, tot_seq_w3, tot_seq_w4]
-
-
-def extract_mutation_data(location, lineages, w, min_sequences=0):
+    if has_tables('cumul_sequences'):
+        # Differences of the cumulative counts at the ends of the 4 weeks, summed over the lineages
+        query = ''' WITH bounds(pos, day) AS (VALUES (0, ?), (1, ?), (2, ?), (3, ?), (4, ?))
+                    SELECT ifnull(sum((SELECT count FROM cumul_sequences CM
+                                       WHERE CM.location_id = ? AND CM.lineage_id = LN.lineage_id AND date <= day
+                                       ORDER BY date DESC LIMIT 1)), 0)
+                    FROM bounds, lineages LN
+                    WHERE LN.lineage_id IN (%s)
+                    GROUP BY pos
+                    ORDER BY pos;''' % ("?," * len(lineage_ids))[:-1]
+        params = [w['w1_begin'], w['w2_begin'], w['w3_begin'], w['w4_begin'], w['w4_end'], location]
+        params.extend(lineage_ids)
+        cumul_counts = [count for count, in cur.execute(query, params).fetchall()] or [0] * 5
+        release_connection(con)
+        return [cumul_counts[week + 1] - cumul_counts[week] for week in range(4)]
+
+    # Count the seq collected in the 4 weeks with a single scan, bucketing the days into weeks (from 0 to 3)
+    query = ''' SELECT (date - ? - 1) / 7 AS week, sum(count)
+                FROM aggr_sequences
+                WHERE date > ? AND date <= ? AND location_id = ?
+                    AND lineage_id IN (%s) ''' % ("?," * len(lineage_ids))[:-1] + '''
+                GROUP BY week;'''
+    params = [w['w1_begin'], w['w1_begin'], w['w4_end'], location]
+    params.extend(lineage_ids)
+    week_counts = [0, 0, 0, 0]
+    for week, count in cur.execute(query, params).fetchall():
+        week_counts[week] = count
+
+    release_connection(con)
+    return week_counts
+
+
+def extract_mutation_data(location, lineage_ids, w, min_sequences=0, family_ids=(), excluded_ids=()):
     """
     Extract weekly mutation data for the given location, lineage and weeks
     Args:
         location:       Identifier of the location to be considered
-        lineages:        List of string representing the lineages to be considered
+        lineage_ids:    List of identifiers of the lineages to be considered (see extract_lineage_ids)
         w:              Dictionary describing the weeks to be considered
         min_sequences:  Minimum number of sequence required for the mutations appearing in week 4
                         to be considered in the result
+        family_ids:     List of identifiers of the lineage families to be considered (see extract_family_selection)
+        excluded_ids:   List of identifiers of the lineages to be subtracted from the families
 
-    Returns: A list describing the mutations for each week
+    Returns:    A list describing the mutations of the 4th week for each week, as dictionaries of the form
+                {mut_id: count}, and a dictionary of the form {mut_id: (protein, mut)} naming them
 
     """
-    con = sqlite3.connect(db_path)
+    con = get_connection()
     cur = con.cursor()
 
-    def extract_week_mutation(start, stop, is_target=False):
-        having_clause = "HAVING sum(count) >= ?"
-        query = '''     SELECT protein, mut, sum(count) 
-                        FROM aggr_aa_substitutions SB
-                            JOIN proteins PR ON SB.protein_id = PR.protein_id
-                            JOIN lineages LN ON SB.lineage_id = LN.lineage_id
-                        WHERE date > ? AND date <= ? AND location_id = ?
-                           AND lineage in (%s) ''' % ("?," * len(lineages))[:-1] + f'''
-                        GROUP BY SB.protein_id, mut 
-                        {having_clause if is_target else ""};'''
-        params = [start, stop, location]
-        params.extend(lineages)
-        if is_target:
-            params.append(min_sequences)
-        return {p + '_' + m: c for p, m, c in cur.execute(query, params).fetchall()}
-
-    muts_w4 = extract_week_mutation(w['w4_begin'], w['w4_end'], is_target=True)  # extract muts having tot>min_seq
-    muts_w3 = extract_week_mutation(w['w3_begin'], w['w3_end'])  # extract all muts
-    muts_w2 = extract_week_mutation(w['w2_begin'], w['w2_end'])  # extract all muts
-    muts_w1 = extract_week_mutation(w['w1_begin'], w['w1_end'])  # extract all muts
-    con.close()
-    return [muts_w1, muts_w2, muts_w3, muts_w4]
+    if len(family_ids) > 0:
+        # Pre-summed rows of the families, plus the rows of the other lineages and minus the ones of the lineages
+        # to be subtracted. These are looked up day by day, instead of scanning all the rows of the location
+        days = list(range(w['w1_begin'] + 1, w['w4_end'] + 1))
+        rows_query = '''( SELECT date, mut_id, count
+                            FROM family_aa_substitutions
+                            WHERE location_id = ? AND family_id IN (%s) AND date > ? AND date <= ?
+                            UNION ALL
+                            SELECT date, mut_id, count
+                            FROM aggr_aa_substitutions
+                            WHERE location_id = ? AND date IN (%s) AND lineage_id IN (%s)
+                            UNION ALL
+                            SELECT date, mut_id, -count
+                            FROM aggr_aa_substitutions
+                            WHERE location_id = ? AND date IN (%s) AND lineage_id IN (%s))''' % (
+            ("?," * len(family_ids))[:-1], ("?," * len(days))[:-1], ("?," * len(lineage_ids))[:-1],
+            ("?," * len(days))[:-1], ("?," * len(excluded_ids))[:-1])
+        rows_params = [location, *family_ids, w['w1_begin'], w['w4_end'],
+                       location, *days, *lineage_ids,
+                       location, *days, *excluded_ids]
+    else:
+        rows_query = '''( SELECT date, mut_id, count
+                            FROM aggr_aa_substitutions
+                            WHERE date > ? AND date <= ? AND location_id = ? AND lineage_id IN (%s))''' % (
+            ("?," * len(lineage_ids))[:-1])
+        rows_params = [w['w1_begin'], w['w4_end'], location, *lineage_ids]
+
+    # Count the muts of the 4 weeks with a single scan, pivoting the weeks into columns (NULL if absent).
+    # Names are joined only after the aggregation, for the mutations having tot>min_seq in the 4th week
+    query = '''     SELECT SB.mut_id, protein, mut, c1, c2, c3, c4
+                    FROM (  SELECT mut_id,
+                                   nullif(sum(CASE WHEN date <= ? THEN count END), 0) AS c1,
+                                   nullif(sum(CASE WHEN date > ? AND date <= ? THEN count END), 0) AS c2,
+                                   nullif(sum(CASE WHEN date > ? AND date <= ? THEN count END), 0) AS c3,
+                                   nullif(sum(CASE WHEN date > ? THEN count END), 0) AS c4
+                            FROM %s
+                            GROUP BY mut_id
+                            HAVING c4 >= ?) SB
+                        JOIN mutations MU ON SB.mut_id = MU.mut_id
+                        JOIN proteins PR ON MU.protein_id = PR.protein_id
+                    ORDER BY MU.protein_id, mut;''' % rows_query
+    params = [w['w1_end'], w['w2_begin'], w['w2_end'], w['w3_begin'], w['w3_end'], w['w4_begin']]
+    params.extend(rows_params)
+    params.append(min_sequences)
+    rows = cur.execute(query, params).fetchall()
+
+    week_mutations = [{m: counts[week] for m, _, _, *counts in rows if counts[week] is not None} for week in range(4)]
+    mutation_names = {m: (p, mut) for m, p, mut, *_ in rows}
+    release_connection(con)
+    return week_mutations, mutation_names
 
 
 def parse_lineages(location, stop, lineages):
     """
-    Given a set of lineages possibly in star notation, it categorizes them in items, groups and all
+    Given a set of lineages possibly in star notation, it categorizes them in items, groups and all.
+    A group (e.g., BA.2.*) includes the lineage and all its descendants, also the aliased ones when the aliases
+    have been given at import (e.g., BA.* in B.1.1.529.*)
     Args:
         location:       Identifier of the location to be considered
         stop:           End date (as diff from reference date) of the analysis period to be considered
@@ -200,20 +316,42 @@ def parse_lineages(location, stop, lineages):
     # Compute the lineages of the group, if any
     if len(group_names) > 0:
         start = stop - 7  # last week only, not the whole period!
+        if not has_coverage(location, start, stop):
+            # No sequences in the last week, according to the manifest: the groups are empty
+            return items, {group: [] for group in group_names}, all_lineages
 
-        con = sqlite3.connect(db_path)
+        con = get_connection()
         cur = con.cursor()
-        for group in group_names:
-            query = ''' SELECT DISTINCT LN.lineage
-                        FROM aggr_sequences AS SQ
-                            JOIN lineages LN ON SQ.lineage_id = LN.lineage_id 
-                        WHERE SQ.date > :start AND SQ.date <= :stop AND SQ.location_id = :loc_id
-                             AND (LN.lineage LIKE :group OR LN.lineage=:father)
-                        ORDER BY LN.lineage; '''
-            params = {'start': start, 'stop': stop, 'loc_id': location,
-                      'group': group[:-2] + '.%', 'father': group[:-2]}
-            res = [row[0] for row in cur.execute(query, params).fetchall()]
-            all_lineages.extend(res)  # update summary
-            groups[group] = res  # update mapping
-        con.close()
+        if has_tables('lineages_hierarchy'):
+            # Expand all the groups at once through the lineages hierarchy, which resolves the aliases
+            query = ''' SELECT H.ancestor, LN.lineage
+                        FROM lineages_hierarchy H
+                            JOIN lineages LN ON H.lineage_id = LN.lineage_id
+                        WHERE H.ancestor IN (%s)
+                            AND EXISTS (SELECT 1 FROM aggr_sequences SQ
+                                        WHERE SQ.location_id = ? AND SQ.lineage_id = H.lineage_id
+                                            AND date > ? AND date <= ?)
+                        ORDER BY LN.lineage;''' % ("?," * len(group_names))[:-1]
+            params = [group[:-2] for group in group_names] + [location, start, stop]
+            descendants = {}
+            for ancestor, lineage in cur.execute(query, params).fetchall():
+                descendants.setdefault(ancestor, []).append(lineage)
+            for group in group_names:
+                res = descendants.get(group[:-2], [])
+                all_lineages.extend(res)  # update summary
+                groups[group] = res  # update mapping
+        else:
+            for group in group_names:
+                query = ''' SELECT DISTINCT LN.lineage
+                            FROM aggr_sequences AS SQ
+                                JOIN lineages LN ON SQ.lineage_id = LN.lineage_id 
+                            WHERE SQ.date > :start AND SQ.date <= :stop AND SQ.location_id = :loc_id
+                                 AND (LN.lineage LIKE :group OR LN.lineage=:father)
+                            ORDER BY LN.lineage; '''
+                params = {'start': start, 'stop': stop, 'loc_id': location,
+                          'group': group[:-2] + '.%', 'father': group[:-2]}
+                res = [row[0] for row in cur.execute(query, params).fetchall()]
+                all_lineages.extend(res)  # update summary
+                groups[group] = res  # update mapping
+        release_connection(con)
     return items, groups, all_lineages
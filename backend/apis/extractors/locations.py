@@ -5,9 +5,55 @@
 
 """
 
-import sqlite3
+import heapq
+import json
 
-from ..utils.path_manager import db_path
+from ..utils import path_manager
+from ..utils.db_manager import get_connection, release_connection, has_tables
+from ..utils.path_manager import get_db_path
+
+locations_trees = {}  # {database path: locations tree of the database version (see get_locations_tree)}
+
+
+def get_locations_tree():
+    """
+    Gets the hierarchy of the locations of the database version in use. Database versions are never modified,
+    hence it is loaded once and kept in memory until the database is updated
+    Returns:    A dictionary as follows
+                {
+                    'paths': { location identifier: (continent, country, region) }, where each of them is a tuple
+                             (identifier, name) or None if the location is not in the subtree of such a location
+                    'ids': { (continent name[, country name[, region name]]): location identifier }
+                }
+
+    """
+    db_path = get_db_path()
+    tree = locations_trees.get(db_path)
+    if tree is None:
+        con = get_connection()
+        cur = con.cursor()
+        names = dict(cur.execute('''SELECT location_id, location FROM locations'''))
+        query = ''' SELECT continent_id, NULL, NULL FROM continents
+                    UNION ALL
+                    SELECT continent_id, country_id, NULL FROM countries
+                    UNION ALL
+                    SELECT continent_id, RE.country_id, region_id
+                    FROM regions RE JOIN countries CC ON RE.country_id = CC.country_id;'''
+        paths, ids = {}, {}
+        for row in cur.execute(query).fetchall():
+            path = [(loc_id, names[loc_id]) for loc_id in row if loc_id is not None]
+            paths[path[-1][0]] = tuple(path + [None] * (3 - len(path)))
+            ids.setdefault(tuple(name for _, name in path), path[-1][0])
+        release_connection(con)
+
+        # Only the tree of the current database version is kept
+        tree = {'paths': paths, 'ids': ids}
+        for tree_path in list(locations_trees):
+            if tree_path != path_manager.current_db_path:
+                locations_trees.pop(tree_path, None)
+        if db_path == path_manager.current_db_path:
+            locations_trees[db_path] = tree
+    return tree
 
 
 def extract_location_id(location_name):
@@ -19,40 +65,7 @@ def extract_location_id(location_name):
     Returns:    Integer identifier for the location or None if not found
 
     """
-    locs = location_name.split('/')
-    locs_len = len(locs)
-
-    con = sqlite3.connect(db_path)
-    cur = con.cursor()
-
-    if locs_len == 1:
-        # Is a continent
-        query = ''' SELECT CO.continent_id
-                    FROM continents AS CO
-                        JOIN locations AS CO_LO ON CO.continent_id=CO_LO.location_id
-                    WHERE CO_LO.location=?;'''
-    elif locs_len == 2:
-        # Is a country
-        query = ''' SELECT COU.country_id
-                    FROM continents AS CO
-                        JOIN locations AS CO_LO ON CO.continent_id=CO_LO.location_id
-                        JOIN countries COU ON CO.continent_id = COU.continent_id
-                        JOIN locations AS COU_LO ON COU.country_id=COU_LO.location_id
-                    WHERE CO_LO.location=? AND COU_LO.location=?;'''
-    else:
-        # Is a region
-        query = ''' SELECT RE.region_id
-                    FROM continents AS CO
-                        JOIN locations AS CO_LO ON CO.continent_id=CO_LO.location_id
-                        JOIN countries COU ON CO.continent_id = COU.continent_id
-                        JOIN locations AS COU_LO ON COU.country_id=COU_LO.location_id
-                        JOIN regions RE ON RE.country_id = COU.country_id
-                        JOIN locations AS RE_LO ON RE.region_id=RE_LO.location_id
-                    WHERE CO_LO.location=? AND COU_LO.location=? AND RE_LO.location=?;'''
-    location_id = cur.execute(query, locs).fetchone()
-
-    con.close()
-    return location_id[0] if location_id is not None else None
+    return get_locations_tree()['ids'].get(tuple(location_name.split('/')))
 
 
 def extract_location_data(location):
@@ -68,48 +81,53 @@ def extract_location_data(location):
                     'region': null if the location is not a region, otherwise { 'id': identifier,'text': region name}
                 }
     """
-    con = sqlite3.connect(db_path)
-    cur = con.cursor()
+    continent, country, region = get_locations_tree()['paths'][int(location)]
+    return {
+        'region': {'id': region[0], 'text': region[1]} if region is not None else None,
+        'country': {'id': country[0], 'text': country[1]} if country is not None else None,
+        'continent': {'id': continent[0], 'text': continent[1]}}
 
-    query = '''
-                SELECT  LO.location AS reg_name, LO.location_id AS reg_id, 
-                        COU.location AS cou_name, COU.location_id AS cou_id,
-                        CON.location AS cont_name, CON.location_id AS cont_id
-                FROM locations AS LO
-                JOIN regions AS RE ON LO.location_id=RE.region_id
-                JOIN locations AS COU ON COU.location_id=RE.country_id
-                JOIN countries AS CC ON CC.country_id=RE.country_id
-                JOIN locations AS CON ON CON.location_id=CC.continent_id
-                WHERE LO.location_id=:loc
-                UNION
-                SELECT  null AS reg_name, null AS reg_id, 
-                        LO.location AS cou_name, LO.location_id AS cou_id,
-                        CON.location AS cont_name, CON.location_id AS cont_id
-                FROM locations AS LO
-                JOIN countries AS CO ON LO.location_id=CO.country_id
-                JOIN locations AS CON ON CON.location_id=CO.continent_id
-                WHERE LO.location_id=:loc
-                UNION
-                SELECT  null AS reg_name, null AS reg_id, 
-                        null AS cou_name, null AS cou_id,
-                        LO.location AS cont_name, LO.location_id AS cont_id
-                FROM locations AS LO JOIN continents AS CO ON LO.location_id=CO.continent_id
-                WHERE LO.location_id=:loc
-            '''
-    data = cur.execute(query, {'loc': location}).fetchone()
 
-    con.close()
-    return {
-        'region': {'id': data[1], 'text': data[0]} if data[0] is not None else None,
-        'country': {'id': data[3], 'text': data[2]} if data[2] is not None else None,
-        'continent': {'id': data[5], 'text': data[4]}}
+def extract_continent_countries(continent):
+    """
+    Extract the countries of a given continent
+    Args:
+        continent:  Identifier of the continent to be considered
+
+    Returns:    List of the identifiers of the countries, sorted by name (empty if the continent is not found)
+
+    """
+    if not str(continent).isdigit():
+        return []
+    countries = [country for cont, country, region in get_locations_tree()['paths'].values()
+                 if country is not None and region is None and cont[0] == int(continent)]
+    return [country_id for country_id, _ in sorted(countries, key=lambda country: country[1])]
+
+
+def extract_known_locations(locations):
+    """
+    Filter the given location identifiers, keeping only the existing ones
+    Args:
+        locations:  List of location identifiers (possibly as strings)
+
+    Returns:    List of the integer identifiers of the existing locations, without duplicates, in the given order
+
+    """
+    paths = get_locations_tree()['paths']
+    known_locations = []
+    for location in locations:
+        location = int(location) if str(location).isdigit() else None
+        if location in paths and location not in known_locations:
+            known_locations.append(location)
+    return known_locations
 
 
-def extract_locations(string):
+def extract_locations(string, limit=None):
     """
     Extract all the locations starting with or related to a given string
     Args:
         string:   String representing the name of a location. Possibly partially written.
+        limit:    If set, max number of locations to be returned (positive)
 
     Returns:    List of dictionaries representing possible locations.
                 [
@@ -128,14 +146,20 @@ def extract_locations(string):
                         }
                     }, ...
                 ]
+                With the full-text index of the location names (see search_locations), the locations whose name
+                matches the string come first, the ones matching it exactly or by prefix first among them, and then
+                the ones whose continent or country matches
     """
-    con = sqlite3.connect(db_path)
-    cur = con.cursor()
-    locations = []
     params = {
         'first_w': string + '%',  # e.g., "Eu" will match "Europe"
         'middle_w': '% ' + string + '%'  # e.g., "Kin" will match "United Kingdom"
     }
+    if has_tables('locations_search') and any(c.isalnum() for c in string):
+        return search_locations(string, params, limit)
+
+    con = get_connection()
+    cur = con.cursor()
+    locations = []
 
     # Fetch continents starting with/containing string
     query = ''' SELECT LO.location AS cont_name, LO.location_id AS cont_id
@@ -182,5 +206,70 @@ def extract_locations(string):
          'continent': {'id': x[5], 'text': x[4]}
          } for x in cur.execute(query, params).fetchall()])
 
-    con.close()
-    return locations
+    release_connection(con)
+    return locations[:limit]
+
+
+def search_locations(string, params, limit=None):
+    """
+    Extract all the locations starting with or related to a given string through the full-text index of
+    the location names (see extract_locations)
+    Args:
+        string:   String representing the name of a location. Possibly partially written.
+        params:   Dictionary with the LIKE patterns matching the string
+        limit:    If set, max number of locations to be returned (positive)
+
+    Returns:    List of dictionaries representing possible locations, as extract_locations
+
+    """
+    con = get_connection()
+    cur = con.cursor()
+    columns = ''' SELECT  TR.type, TR.location, TR.location_id, COU.location, COU.location_id,
+                        CON.location, CON.location_id
+                FROM locations_tree TR
+                    JOIN locations AS CON ON CON.location_id = TR.continent_id
+                    LEFT JOIN locations AS COU ON COU.location_id = TR.country_id '''
+
+    # The index finds the names having words starting with the words of the string, as candidates for the LIKE
+    # patterns. Matching names are ranked by exact, prefix or word match
+    query = ''' WITH matches(location_id, rank) AS (
+                    SELECT rowid, CASE WHEN upper(location) = upper(:string) THEN 0
+                                       WHEN upper(location) LIKE upper(:first_w) THEN 1
+                                       ELSE 2 END
+                    FROM locations_search
+                    WHERE locations_search MATCH :match
+                        AND ((upper(location) LIKE upper(:first_w)) OR (upper(location) LIKE upper(:middle_w))))
+            ''' + columns + '''
+                    JOIN matches M ON M.location_id = TR.location_id
+                ORDER BY M.rank, TR.type, TR.location
+                LIMIT :limit;'''
+    params = {**params, 'string': string, 'match': '"' + string.replace('"', '""') + '"*',
+              'limit': limit if limit is not None else -1}
+    rows = cur.execute(query, params).fetchall()
+
+    # The locations of the continents and countries matching the string follow, ordered by type and name,
+    # unless the limit has been reached (all the matching names have been read otherwise). They are read in order
+    # from the subtree of each of them, then merged
+    if limit is None or len(rows) < limit:
+        seen = {row[2] for row in rows}
+        subtrees = []
+        for loc_type, _, parent_id, *_ in [row for row in rows if row[0] != 'region']:
+            query = columns + '''
+                        WHERE TR.%s = :parent AND TR.location_id NOT IN (SELECT value FROM json_each(:matches))
+                        ORDER BY TR.type, TR.location
+                        LIMIT :limit;''' % ('continent_id' if loc_type == 'continent' else 'country_id')
+            params = {'parent': parent_id, 'matches': json.dumps(list(seen)),
+                      'limit': limit - len(rows) if limit is not None else -1}
+            subtrees.append(cur.execute(query, params).fetchall())
+        for row in heapq.merge(*subtrees, key=lambda x: (x[0], x[1])):
+            if row[2] not in seen:  # regions in the subtrees of both their continent and country
+                seen.add(row[2])
+                rows.append(row)
+
+    release_connection(con)
+    return [
+        {'value': {'id': loc_id, 'text': loc_name},
+         'type': loc_type,
+         'country': {'id': cou_id, 'text': cou_name} if loc_type == 'region' else None,
+         'continent': {'id': cont_id, 'text': cont_name} if loc_type != 'continent' else None
+         } for loc_type, loc_name, loc_id, cou_name, cou_id, cont_name, cont_id in rows[:limit]]
@@ -11,12 +11,19 @@ from flask import request
 from flask_restplus import Namespace, Resource
 
 from .explorer import extract_dataset_info
-from .extractors.lineage_independent import extract_week_seq_counts, extract_mutation_data, extract_lineages_data
-from .extractors.locations import extract_location_data, extract_location_id
-from .utils.utils import compute_weeks_from_date, produce_statistics
+from .extractors.lineage_independent import extract_week_seq_counts, extract_mutation_data, extract_lineages_data, \
+    extract_batch_week_seq_counts, extract_batch_mutation_data, extract_daily_seq_counts, extract_daily_mutation_data
+from .extractors.locations import extract_location_data, extract_location_id, extract_continent_countries, \
+    extract_known_locations
+from .utils.cache_manager import get_cached_result
+from .utils.manifest_manager import get_manifest, has_coverage
+from .utils.utils import normalize_date, compute_weeks_from_date, compute_diff_from_date, produce_statistics, \
+    produce_statistics_series
 
 api = Namespace(name='Lineage independent analysis',path='/lineage_independent')
 
+max_series_days = 366  # max number of end dates of a statistics series
+
 # ##############################################################################################
 # ##################################   [GET] /getStatistics   ##################################
 # ##############################################################################################
@@ -94,31 +101,225 @@ class FieldList(Resource):
         """
         exec_start = time.time()
         args = request.args
-        location = args.get('location')
+        location = args.get('location', type=int)
         if location is None:
             location_name = args.get('locationName')
             location = extract_location_id(location_name)
-        date = args.get('date')
+        date = normalize_date(args.get('date'))
 
-        w = compute_weeks_from_date(date)
+        def compute_statistics():
+            w = compute_weeks_from_date(date)
+
+            if has_coverage(location, w['w1_begin'], w['w4_end']):
+                week_sequence_counts = extract_week_seq_counts(location, w)
 
-        week_sequence_counts = extract_week_seq_counts(location, w)
+                min_sequences = int(week_sequence_counts[-1] * 0.005 + 1)  # 0.5% of seq in the last week
+                mutation_data, mutation_names = extract_mutation_data(location, w, min_sequences)
 
-        min_sequences = int(week_sequence_counts[-1] * 0.005 + 1)  # 0.5% of seq in the last week
-        mutation_data = extract_mutation_data(location, w, min_sequences)
+                statistics = produce_statistics(week_sequence_counts, mutation_data, mutation_names)
+            else:
+                # No sequences in the period, according to the manifest: nothing to be queried
+                week_sequence_counts, statistics = [0, 0, 0, 0], []
 
-        statistics = produce_statistics(week_sequence_counts, mutation_data)
+            metadata = {
+                'date': date,
+                'location': extract_location_data(location),
+                'dataset_info': extract_dataset_info()
+            }
+            return {'rows': statistics,
+                    'tot_seq': week_sequence_counts,
+                    'metadata': metadata}
 
-        metadata = {
-            'date': date,
-            'location': extract_location_data(location),
-            'dataset_info': extract_dataset_info()
-        }
+        result = get_cached_result('/lineage_independent/getStatistics',
+                                   {'location': location, 'date': date}, compute_statistics)
 
         print(f'\t[GET] /getStatistics: processed in {time.time() - exec_start:.5f} seconds.')
-        return {'rows': statistics,
-                'tot_seq': week_sequence_counts,
-                'metadata': metadata}
+        return result
+
+
+# ###################################################################################################
+# #################################   [GET] /getStatisticsSeries   ##################################
+# ###################################################################################################
+
+
+@api.route('/getStatisticsSeries')
+class FieldList(Resource):
+    @api.doc()
+    def get(self):
+        """
+        API to perform a lineage-independent analysis for every end date of a period (see /getStatistics),
+        reporting how the statistics of each mutation evolve day by day.
+
+        Query params:
+        - location (int):           Location identifier
+        - locationName (string):    Location name specified using continent[/country[/region]] notation
+                                    (used in alternative to location, when the id is not known)
+        - begin (string):           First end date of the 4-weeks periods to be considered. Takes format YYYY-mm-dd
+        - end (string):             Last end date of the 4-weeks periods to be considered. Takes format YYYY-mm-dd
+                                    The period can include at most 366 end dates. The end dates whose 4 weeks
+                                    have no sequences in the dataset are not considered
+
+        Success response (code 200):
+           Dictionary containing the statistics series
+           {
+                'metadata': {
+                    'dataset_info': dataset info (see /getStatistics)
+                    'begin': first end date of the 4-weeks periods. Takes format YYYY-mm-dd
+                    'end': last end date of the 4-weeks periods. Takes format YYYY-mm-dd
+                    'location': location data (see /getStatistics)
+                },
+                'dates': list of the end dates of the 4-weeks periods. Take format YYYY-mm-dd
+                'tot_seq': list reporting for each end date the total number of sequences of each of the 4 weeks
+                           [[tot_seq_week1, tot_seq_week2, tot_seq_week3, tot_seq_week4], ...]
+                'rows': [
+                    {
+                        'item_key': row identifier obtained as protein_mut
+                        'protein': name of the protein, example='NSP4'
+                        'mut': name of the mutation, example='A146V'
+                        'positions': list of the positions in 'dates' of the end dates in which the mutation
+                                     is reported by /getStatistics
+                        'slope', 'f1', 'f2', 'f3', 'f4', 'w1', 'w2', 'w3', 'w4',
+                        'p_value_with_mut', 'p_value_without_mut', 'p_value_comp':
+                            lists reporting for each of those end dates the value of /getStatistics
+                    },...
+                ]
+           }
+
+        Error responses
+        # code 400: Bad request: begin follows end or the period is longer than 366 days
+        # code 423: Resource unavailable: dataset update in progress
+        # code 500: Generic server error
+
+        """
+        exec_start = time.time()
+        args = request.args
+        location = args.get('location', type=int)
+        if location is None:
+            location_name = args.get('locationName')
+            location = extract_location_id(location_name)
+        begin = normalize_date(args.get('begin'))
+        end = normalize_date(args.get('end'))
+        if begin > end:
+            api.abort(400, 'Bad request: begin follows end')
+        if compute_diff_from_date(end) - compute_diff_from_date(begin) >= max_series_days:
+            api.abort(400, f'Bad request: the period cannot be longer than {max_series_days} days')
+
+        def compute_statistics_series():
+            # End dates whose 4 weeks have no sequences in the dataset are not considered
+            begin_day, end_day = compute_diff_from_date(begin), compute_diff_from_date(end)
+            manifest = get_manifest()
+            if manifest['last_date'] is not None:
+                begin_day = max(begin_day, manifest['first_date'])
+                end_day = min(end_day, manifest['last_date'] + 27)
+
+            # Daily counts of the 4 weeks ending on the first end date, up to the last end date
+            first_day = begin_day - 27
+            last_day = max(end_day, first_day + 26)
+
+            if has_coverage(location, first_day - 1, last_day):
+                daily_sequence_counts = extract_daily_seq_counts(location, first_day - 1, last_day)
+                daily_mutation_counts, mutation_names = extract_daily_mutation_data(location, first_day - 1, last_day)
+            else:
+                # No sequences in the period, according to the manifest: nothing to be queried
+                daily_sequence_counts, daily_mutation_counts, mutation_names = [0] * (last_day - first_day + 1), [], []
+
+            series = produce_statistics_series(first_day, daily_sequence_counts, daily_mutation_counts,
+                                               mutation_names)
+            series['metadata'] = {
+                'begin': begin,
+                'end': end,
+                'location': extract_location_data(location),
+                'dataset_info': extract_dataset_info()
+            }
+            return series
+
+        result = get_cached_result('/lineage_independent/getStatisticsSeries',
+                                   {'location': location, 'begin': begin, 'end': end}, compute_statistics_series)
+
+        print(f'\t[GET] /getStatisticsSeries: processed in {time.time() - exec_start:.5f} seconds.')
+        return result
+
+
+# ###################################################################################################
+# ##################################   [GET] /getBatchStatistics   ##################################
+# ###################################################################################################
+
+
+@api.route('/getBatchStatistics')
+class FieldList(Resource):
+    @api.doc()
+    def get(self):
+        """
+        API to perform a lineage-independent analysis of several locations at once (see /getStatistics).
+        Given a list of locations (or a continent) and a 4-week period, it extracts for each location the
+        mutations present in the last week of the period and analyzes their trend over the 4 weeks.
+        The counts of all the locations are extracted with a single scan.
+
+        Query params:
+        - locations (list):     List of location identifiers
+        - continent (int):      Continent identifier, to consider all its countries
+                                (used in alternative to locations)
+        - date (string):        End date of the 4-weeks period to be considered. Takes format YYYY-mm-dd
+
+        Success response (code 200):
+           Dictionary containing the statistics of each location, in the given order (countries are sorted by name)
+           {
+                'metadata': {
+                    'dataset_info': dataset info (see /getStatistics)
+                    'date': end date of the 4-weeks period to be considered. Takes format YYYY-mm-dd
+                },
+                'locations': [
+                    {
+                        'location': location data (see /getStatistics)
+                        'rows': statistics of the mutations of the location (see /getStatistics)
+                        'tot_seq': List reporting for each of the 4 weeks the total number of sequences
+                                   collected for that period and location.
+                    },...
+                ]
+           }
+
+        Error responses
+        # code 423: Resource unavailable: dataset update in progress
+        # code 500: Generic server error
+
+        """
+        exec_start = time.time()
+        args = request.args
+        continent = args.get('continent')
+        if continent is not None:
+            locations = extract_continent_countries(continent)
+        else:
+            locations = extract_known_locations(args.getlist('locations'))
+        date = normalize_date(args.get('date'))
+
+        def compute_statistics():
+            w = compute_weeks_from_date(date)
+
+            # Locations without sequences in the period, according to the manifest, are not queried
+            covered_locations = [loc for loc in locations if has_coverage(loc, w['w1_begin'], w['w4_end'])]
+            week_sequence_counts = extract_batch_week_seq_counts(covered_locations, w)
+
+            min_sequences = {loc: int(counts[-1] * 0.005 + 1) for loc, counts in week_sequence_counts.items()}
+            mutation_data = extract_batch_mutation_data(min_sequences, w)
+
+            statistics = {loc: produce_statistics(week_sequence_counts[loc], *mutation_data[loc])
+                          for loc in covered_locations}
+
+            metadata = {
+                'date': date,
+                'dataset_info': extract_dataset_info()
+            }
+            return {'locations': [{'location': extract_location_data(location),
+                                   'rows': statistics.get(location, []),
+                                   'tot_seq': week_sequence_counts.get(location, [0, 0, 0, 0])}
+                                  for location in locations],
+                    'metadata': metadata}
+
+        result = get_cached_result('/lineage_independent/getBatchStatistics',
+                                   {'locations': locations, 'date': date}, compute_statistics)
+
+        print(f'\t[GET] /getBatchStatistics: processed in {time.time() - exec_start:.5f} seconds.')
+        return result
 
 
 # ################################################################################################
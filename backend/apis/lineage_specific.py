@@ -12,9 +12,11 @@ from flask_restplus import Namespace, Resource
 
 from .extractors.explorer import extract_lineage_characterization, extract_dataset_info
 from .extractors.lineage_specific import get_all_lineages, get_lineages_from_loc, get_lineages_from_loc_date, \
-    extract_week_seq_counts, extract_mutation_data, parse_lineages
+    extract_lineage_ids, extract_week_seq_counts, extract_mutation_data, parse_lineages, extract_family_selection
 from .extractors.locations import extract_location_data, extract_location_id
-from .utils.utils import compute_weeks_from_date, produce_statistics
+from .utils.cache_manager import get_cached_result
+from .utils.manifest_manager import has_coverage, has_lineage_sequences
+from .utils.utils import normalize_date, compute_weeks_from_date, produce_statistics
 
 api = Namespace(name='Lineage specific analysis', path='/lineage_specific')
 
@@ -151,36 +153,50 @@ class FieldList(Resource):
         """
         exec_start = time.time()
         args = request.args
-        location = args.get('location')
+        location = args.get('location', type=int)
         if location is None:
             location_name = args.get('locationName')
             location = extract_location_id(location_name)
-        lineages = args.getlist('lineages')
-        date = args.get('date')
-
-        w = compute_weeks_from_date(date)
-
-        # parse lineages data
-        items, groups, lineages = parse_lineages(location, w['w4_end'], lineages)
-
-        week_sequence_counts = extract_week_seq_counts(location, lineages, w)
-
-        min_sequences = int(week_sequence_counts[-1] * 0.005 + 1)
-        mutation_data = extract_mutation_data(location, lineages, w, min_sequences)
-
-        statistics = produce_statistics(week_sequence_counts, mutation_data)
-        # Compute char muts only if one lineage has been selected, otherwise disable feature.
-        characterizing_muts = extract_lineage_characterization(lineages) if len(lineages) == 1 else []
+        lineages = sorted(set(args.getlist('lineages')))
+        date = normalize_date(args.get('date'))
+
+        def compute_statistics():
+            w = compute_weeks_from_date(date)
+
+            # parse lineages data
+            items, groups, all_lineages = parse_lineages(location, w['w4_end'], lineages)
+
+            lineage_ids = extract_lineage_ids(all_lineages)  # resolved once for all the queries
+            if has_coverage(location, w['w1_begin'], w['w4_end']) and has_lineage_sequences(lineage_ids):
+                week_sequence_counts = extract_week_seq_counts(location, lineage_ids, w)
+
+                # the groups are read from the pre-summed lineage families, when available
+                family_ids, other_ids, excluded_ids = extract_family_selection(location, w, groups, lineage_ids)
+
+                min_sequences = int(week_sequence_counts[-1] * 0.005 + 1)
+                mutation_data, mutation_names = extract_mutation_data(location, other_ids, w, min_sequences,
+                                                                      family_ids, excluded_ids)
+
+                statistics = produce_statistics(week_sequence_counts, mutation_data, mutation_names)
+            else:
+                # No sequences in the period, according to the manifest: nothing to be queried
+                week_sequence_counts, statistics = [0, 0, 0, 0], []
+            # Compute char muts only if one lineage has been selected, otherwise disable feature.
+            characterizing_muts = extract_lineage_characterization(all_lineages) if len(all_lineages) == 1 else []
+
+            metadata = {
+                'date': date,
+                'location': extract_location_data(location),
+                'lineage': {'items': items, 'groups': groups},
+                'dataset_info': extract_dataset_info()
+            }
+            return {'rows': statistics,
+                    'tot_seq': week_sequence_counts,
+                    'characterizing_muts': characterizing_muts,
+                    'metadata': metadata}
 
-        metadata = {
-            'date': date,
-            'location': extract_location_data(location),
-            'lineage': {'items': items, 'groups': groups},
-            'dataset_info': extract_dataset_info()
-        }
+        result = get_cached_result('/lineage_specific/getStatistics',
+                                   {'location': location, 'lineages': lineages, 'date': date}, compute_statistics)
 
         print(f'\t[GET] /getStatistics: processed in {time.time() - exec_start:.5f} seconds.')
-        return {'rows': statistics,
-                'tot_seq': week_sequence_counts,
-                'characterizing_muts': characterizing_muts,
-                'metadata': metadata}
+        return result
@@ -30,6 +30,7 @@ class FieldList(Resource):
 
         Query params:
         - string (string):  Name of location. Possibly partial for autocompletion.
+        - limit (int):      Max number of locations to be returned, the best matching first (optional)
 
         Success response (code 200):
             List of dictionaries representing possible locations.
@@ -51,6 +52,7 @@ class FieldList(Resource):
             ]
 
         Error responses
+        # code 400: Bad request: limit is not a positive integer
         # code 423: Resource unavailable: dataset update in progress
         # code 500: Generic server error
 
@@ -59,6 +61,10 @@ class FieldList(Resource):
         args = request.args
         args.to_dict()
 
-        locations = extract_locations(args.get('string'))
+        limit = args.get('limit', type=int)
+        if 'limit' in args and (limit is None or limit <= 0):
+            api.abort(400, 'Bad request: limit must be a positive integer')
+
+        locations = extract_locations(args.get('string'), limit)
         print(f'\t[GET] /getLocations: processed in {time.time() - exec_start:.5f} seconds.')
         return locations
@@ -0,0 +1,116 @@
+import queue
+from threading import Thread
+from time import time
+
+
+class BatchWriter:
+    """
+    Writer stage of the parsing pipeline
+    This class stages the batches of parsed rows in a dedicated thread, so that the parsing continues while the
+    previous batches are written. Batches are passed through a bounded queue, whose usage is tracked by counters.
+    """
+
+    def __init__(self, queue_size):
+        """
+        Initializes the writer and starts its thread
+        Args:
+            queue_size: Max number of batches waiting to be written
+        """
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.stats = empty_stats(queue_size)
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, function, batch):
+        """
+        Queues a batch to be written, waiting for a free slot if the queue is full
+        Args:
+            function:   The function writing the batch (e.g., the add_sequences method of the aggregator)
+            batch:      The batch to be written. It must not be modified after the submission
+        """
+        self.check()
+        depth = self.queue.qsize()
+        self.stats['batches'] += 1
+        self.stats['depth_sum'] += depth
+        self.stats['max_depth'] = max(self.stats['max_depth'], depth)
+        if self.queue.full():
+            # The parser is faster than the writer: it stalls until a slot is free
+            self.stats['parser_stalls'] += 1
+            stall_start = time()
+            self.queue.put((function, batch))
+            self.stats['parser_stall_time'] += time() - stall_start
+        else:
+            self.queue.put((function, batch))
+
+    def run(self):
+        """
+        Writer thread entry point: writes the queued batches until a None item is found
+        """
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                # The writer is faster than the parser: it waits for the next batch
+                self.stats['writer_stalls'] += 1
+                idle_start = time()
+                item = self.queue.get()
+                self.stats['writer_idle_time'] += time() - idle_start
+
+            if item is None:
+                self.queue.task_done()
+                break
+            function, batch = item
+            try:
+                if self.error is None:
+                    function(batch)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def check(self):
+        """
+        Raises the error of the writer thread, if any
+        """
+        if self.error is not None:
+            raise RuntimeError('The writer thread failed to stage a batch') from self.error
+
+    def close(self):
+        """
+        Waits for all the queued batches to be written and stops the writer thread
+
+        Returns:    Dictionary with the counters of the writer
+
+        """
+        self.queue.put(None)
+        self.thread.join()
+        self.check()
+        return self.stats
+
+
+def empty_stats(queue_size=0):
+    """
+    Creates the counters of a writer
+    Args:
+        queue_size: Max number of batches waiting to be written
+
+    Returns:    Dictionary with the counters set to zero
+
+    """
+    return {'queue_size': queue_size, 'batches': 0, 'depth_sum': 0, 'max_depth': 0,
+            'parser_stalls': 0, 'parser_stall_time': 0., 'writer_stalls': 0, 'writer_idle_time': 0.}
+
+
+def merge_stats(stats, other):
+    """
+    Merges the counters of two writers
+    Args:
+        stats:  Dictionary with the counters of the first writer
+        other:  Dictionary with the counters of the second writer
+
+    Returns:    Dictionary with the merged counters
+
+    """
+    return {key: max(stats[key], other[key]) if key in ('queue_size', 'max_depth') else stats[key] + other[key]
+            for key in stats}
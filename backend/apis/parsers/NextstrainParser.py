@@ -1,7 +1,5 @@
 from datetime import datetime
 
-from tqdm import tqdm
-
 from .Parser import Parser
 from ..utils.utils import start_date
 
@@ -21,17 +19,22 @@ class NextstrainParser(Parser):
     length_col = 'length'  # name for length column
     missing_data_col = 'missing_data'  # name for missing data column
     aa_subs_col = 'aaSubstitutions'  # name for aa substitutions column
+    submission_date_col = 'date_submitted'  # name for submission date column
+    accession_col = 'strain'  # name for the column with the unique identifier of the sequence
 
     # ############################################################ #
 
-    def parse(self, selected_countries):
-        # Read first line and extract cols positions
-        self.auto_extract_cols(
-            expected_cols=[self.continent_col, self.country_col, self.region_col, self.date_col, self.lineage_col,
-                           self.length_col, self.missing_data_col, self.aa_subs_col])
+    def get_expected_cols(self):
+        return [self.continent_col, self.country_col, self.region_col, self.date_col, self.lineage_col,
+                self.length_col, self.missing_data_col, self.aa_subs_col]
+
+    def parse_lines(self, lines, selected_countries):
+        for line in lines:
+            s = line.rstrip('\n').split("\t")
 
-        for line in tqdm(self.f, desc='\t\t'):
-            s = line.split("\t")
+            # Skip the rows already imported in the database
+            if self.track_watermark and self.is_imported(s):
+                continue
 
             # Parse and filtering of location data
             country_name = s[self.cols[self.country_col]].strip()
@@ -77,22 +80,22 @@ class NextstrainParser(Parser):
                 sequence_id = self.get_sequence_id()
 
                 self.batch_seqs.append((sequence_id, date, lineage_id, continent_id, country_id, region_id))
+                self.lineage_counts[lineage_id] += 1
+                mut_counts = self.lineage_mut_counts[lineage_id]
 
                 # Parse aa substitutions
                 for aa in s[self.cols[self.aa_subs_col]].split(","):
                     if aa != '':
                         protein_name, mutation_name = aa.split(":")
                         protein_id = self.get_protein_id(protein_name)
-                        self.batch_subs.append((sequence_id, protein_id, mutation_name))
+                        mut_id = self.get_mutation_id(protein_id, mutation_name)
+                        self.batch_subs.append((sequence_id, mut_id))
+                        mut_counts[mut_id] += 1
 
-            if len(self.batch_subs) > 50000:
+            if len(self.batch_subs) > self.batch_size:
                 self.batch_to_subs()
 
-            if len(self.batch_seqs) > 50000:
+            if len(self.batch_seqs) > self.batch_size:
                 self.batch_to_seqs()
 
             del line
-
-        self.batch_to_subs()
-        self.batch_to_seqs()
-        self.dict_to_tables()
@@ -1,5 +1,14 @@
+import locale
+import multiprocessing
+import os
+import queue
+import traceback
+from collections import Counter, defaultdict
 from datetime import datetime
 
+from tqdm import tqdm
+
+from .BatchWriter import BatchWriter, empty_stats, merge_stats
 from apis.utils.utils import start_date
 
 
@@ -9,15 +18,23 @@ class Parser:
     In its implementations, this class allows the extraction of sequence data from the metadata tsv file
     """
 
-    def __init__(self, con, f):
+    # ############    Parser static configuration     ############ #
+    submission_date_col = None  # name for submission date column, used to track the watermark
+    accession_col = None  # name for the column with the unique identifier of the sequence
+
+    # ############################################################ #
+
+    def __init__(self, con, f, aggregator):
         """
         Initializes the parser object
         Args:
-            con:    The connection to the db
-            f:      The file stream to be parsed
+            con:        The connection to the db
+            f:          The file stream to be parsed
+            aggregator: The aggregator used to stage the parsed sequences and aa substitutions
         """
         self.con = con
         self.f = f
+        self.aggregator = aggregator
         self.cols = {}
         self.filter_by_data_flag = False
         self.beginning_date_flag = False
@@ -29,14 +46,38 @@ class Parser:
         self.lineages_count = 0
         self.locations_count = 0
         self.proteins_count = 0
+        self.mutations_count = 0
 
         self.lineages_dict = {}
         self.proteins_dict = {}
+        self.mutations_dict = {}
         self.locations_dict = {}
 
         self.batch_subs = []
         self.batch_seqs = []
 
+        # Batching of the parsed rows: if queue_size > 0, batches are staged by a writer thread
+        self.batch_size = 50000
+        self.queue_size = 0
+        self.writer = None
+        self.pipeline_stats = empty_stats()
+
+        # Counters of the parsed sequences of each lineage, and of the ones affected by each mutation
+        self.lineage_counts = Counter()
+        self.lineage_mut_counts = defaultdict(Counter)
+
+        # Watermark of the parsed rows: max submission date and the accessions submitted on that date
+        self.track_watermark = False
+        self.watermark_date = ''
+        self.watermark_accessions = set()
+
+        # Watermark of the rows already imported in the database (None if every row has to be parsed)
+        self.imported_date = None
+        self.imported_accessions = set()
+
+        # Number of entries of each dictionary already stored in the database
+        self.stored_counts = {'lineages': 0, 'proteins': 0, 'mutations': 0, 'locations': 0}
+
     def set_date_range(self, beginning_date, end_date):
         """
         Sets the date range for the parsing. Only the rows that refers to this period will be considered.
@@ -61,7 +102,7 @@ class Parser:
             expected_cols: List of string representing the names of the expected columns
         """
         line = self.f.readline()
-        s = line.split("\t")
+        s = line.rstrip('\n').split("\t")
         # Generate a dictionary of the form {col_name: position_idx , ...}
         self.cols = {name: idx for idx, name in enumerate(s)}
 
@@ -77,6 +118,97 @@ class Parser:
                 "github.com/DEIB-GECO/VariantHunter/issues \033[0m")
             exit(-1)
 
+    def set_pipeline(self, batch_size, queue_size):
+        """
+        Sets the batching of the parsed rows
+        Args:
+            batch_size: Number of rows of each batch of sequences or aa substitutions
+            queue_size: Max number of batches waiting to be staged by the writer thread.
+                        If 0, the batches are staged directly by the parsing thread.
+        """
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+
+    def set_imported_watermark(self, imported_date, imported_accessions):
+        """
+        Sets the watermark of the rows already imported in the database. Only the rows submitted after it will be
+        considered: the ones submitted before the date or on the same date with an already seen accession are skipped.
+        Args:
+            imported_date:          String representing the max submission date already imported (YYYY-mm-dd)
+            imported_accessions:    Set of the accessions already imported having the max submission date
+        """
+        self.imported_date = imported_date
+        self.imported_accessions = imported_accessions
+        self.watermark_date = imported_date
+        self.watermark_accessions = set(imported_accessions)
+
+    def load_dicts(self):
+        """
+        Loads the dictionaries of lineages, proteins, mutations and locations from the database, so that the existing
+        entries keep their ids and only the new ones are later inserted by dict_to_tables
+        """
+        cur = self.con.cursor()
+        self.lineages_dict = dict(cur.execute('''SELECT lineage, lineage_id FROM lineages ORDER BY lineage_id'''))
+        self.proteins_dict = dict(cur.execute('''SELECT protein, protein_id FROM proteins ORDER BY protein_id'''))
+        self.mutations_dict = {(protein_id, mut): mut_id for mut_id, protein_id, mut
+                               in cur.execute('''SELECT mut_id, protein_id, mut FROM mutations ORDER BY mut_id''')}
+
+        names = dict(cur.execute('''SELECT location_id, location FROM locations'''))
+        nodes = {}
+        self.locations_dict = {}
+        for continent_id, in cur.execute('''SELECT continent_id FROM continents ORDER BY continent_id'''):
+            nodes[continent_id] = self.locations_dict[names[continent_id]] = {'id': continent_id, 'countries': {}}
+        for country_id, continent_id in cur.execute('''SELECT country_id, continent_id FROM countries 
+                                                        ORDER BY country_id'''):
+            nodes[country_id] = nodes[continent_id]['countries'][names[country_id]] = {'id': country_id, 'regions': {}}
+        for region_id, country_id in cur.execute('''SELECT region_id, country_id FROM regions ORDER BY region_id'''):
+            nodes[country_id]['regions'][names[region_id]] = {'id': region_id}
+
+        self.lineages_count = len(self.lineages_dict)
+        self.proteins_count = len(self.proteins_dict)
+        self.mutations_count = len(self.mutations_dict)
+        self.locations_count = len(names)
+        self.stored_counts = {'lineages': self.lineages_count, 'proteins': self.proteins_count,
+                              'mutations': self.mutations_count, 'locations': self.locations_count}
+
+    def is_imported(self, s):
+        """
+        Updates the watermark with the given row and checks whether the row was already imported in the database
+        Args:
+            s: List of strings representing the values of the row
+
+        Returns: True iff the row has to be skipped since already imported
+
+        """
+        submission_date = s[self.cols[self.submission_date_col]].strip()
+        if len(submission_date) != 10:
+            # Missing or partial submission date: the row can be only imported by a full parsing
+            return self.imported_date is not None
+
+        accession = s[self.cols[self.accession_col]].strip()
+        if submission_date > self.watermark_date:
+            self.watermark_date = submission_date
+            self.watermark_accessions = {accession}
+        elif submission_date == self.watermark_date:
+            self.watermark_accessions.add(accession)
+
+        return self.imported_date is not None and (
+                submission_date < self.imported_date or
+                (submission_date == self.imported_date and accession in self.imported_accessions))
+
+    def update_watermark(self, watermark_date, watermark_accessions):
+        """
+        Updates the watermark with the one of a parsed shard
+        Args:
+            watermark_date:         String representing the max submission date of the shard (YYYY-mm-dd)
+            watermark_accessions:   Set of the accessions of the shard having the max submission date
+        """
+        if watermark_date > self.watermark_date:
+            self.watermark_date = watermark_date
+            self.watermark_accessions = set(watermark_accessions)
+        elif watermark_date == self.watermark_date:
+            self.watermark_accessions.update(watermark_accessions)
+
     def is_out_of_range(self, date):
         """
         Checks whether a date is in the date range of interest or not
@@ -91,23 +223,23 @@ class Parser:
 
     def batch_to_subs(self):
         """
-        Inserts data from batch_subs into the aa_substitutions table
+        Stages data from batch_subs through the aggregator (possibly by means of the writer thread)
         """
-        query = ''' INSERT INTO temp_table2.aa_substitutions(sequence_id, protein_id, mut) 
-                    VALUES (?,?,?)'''
-        self.con.executemany(query, self.batch_subs)
-        self.con.commit()
+        if self.writer is not None:
+            self.writer.submit(self.aggregator.add_substitutions, self.batch_subs)
+        else:
+            self.aggregator.add_substitutions(self.batch_subs)
         del self.batch_subs
         self.batch_subs = []
 
     def batch_to_seqs(self):
         """
-        Inserts data from batch_seqs into the sequences table
+        Stages data from batch_seqs through the aggregator (possibly by means of the writer thread)
         """
-        query = ''' INSERT INTO temp_table1.sequences(sequence_id, date, lineage_id, continent_id, country_id, region_id) 
-                    VALUES (?,?,?,?,?,?)'''
-        self.con.executemany(query, self.batch_seqs)
-        self.con.commit()
+        if self.writer is not None:
+            self.writer.submit(self.aggregator.add_sequences, self.batch_seqs)
+        else:
+            self.aggregator.add_sequences(self.batch_seqs)
         del self.batch_seqs
         self.batch_seqs = []
 
@@ -118,27 +250,40 @@ class Parser:
         print(f"\t\t Loading proteins info ... ")
 
         query = ''' INSERT INTO proteins (protein, protein_id) VALUES (?,?)'''
-        self.con.executemany(query, self.proteins_dict.items())
+        self.con.executemany(query, [(protein_name, protein_id) for protein_name, protein_id in self.proteins_dict.items()
+                                     if protein_id >= self.stored_counts['proteins']])
+        self.con.commit()
+
+        print(f"\t\t Loading mutations info ... ")
+
+        query = ''' INSERT INTO mutations (mut_id, protein_id, mut) VALUES (?,?,?)'''
+        self.con.executemany(query, [(mut_id, protein_id, mut) for (protein_id, mut), mut_id
+                                     in self.mutations_dict.items() if mut_id >= self.stored_counts['mutations']])
         self.con.commit()
 
         print(f"\t\t Loading locations info ... ")
 
+        # Only the locations not yet stored in the database are inserted
+        is_new = lambda loc_data: loc_data['id'] >= self.stored_counts['locations']
+
         query = ''' INSERT INTO continents (continent_id) VALUES (?)'''
         data = self.locations_dict.items()
-        continents = [(cont_name, cont_data['id']) for (cont_name, cont_data) in data]
-        self.con.executemany(query, [(cont_data['id'],) for (cont_name, cont_data) in data])
+        continents = [(cont_name, cont_data['id']) for (cont_name, cont_data) in data if is_new(cont_data)]
+        self.con.executemany(query, [(cont_data['id'],) for (cont_name, cont_data) in data if is_new(cont_data)])
 
         query = ''' INSERT INTO countries (country_id, continent_id) VALUES (?,?)'''
         data = [(cont_data['id'], cou_name, cou_data) for (cont_name, cont_data) in data
                 for cou_name, cou_data in cont_data['countries'].items()]
-        countries = [(cou_name, cou_data['id']) for (cont_id, cou_name, cou_data) in data]
-        self.con.executemany(query, [(cou_data['id'], cont_id) for (cont_id, cou_name, cou_data) in data])
+        countries = [(cou_name, cou_data['id']) for (cont_id, cou_name, cou_data) in data if is_new(cou_data)]
+        self.con.executemany(query, [(cou_data['id'], cont_id) for (cont_id, cou_name, cou_data) in data
+                                     if is_new(cou_data)])
 
         query = ''' INSERT INTO regions (region_id, country_id) VALUES (?,?)'''
         data = [(cou_data['id'], reg_name, reg_data) for (cont_id, cou_name, cou_data) in data
                 for reg_name, reg_data in cou_data['regions'].items()]
-        regions = [(reg_name, reg_data['id']) for (cou_id, reg_name, reg_data) in data]
-        self.con.executemany(query, [(reg_data['id'], cou_id) for (cou_id, reg_name, reg_data) in data])
+        regions = [(reg_name, reg_data['id']) for (cou_id, reg_name, reg_data) in data if is_new(reg_data)]
+        self.con.executemany(query, [(reg_data['id'], cou_id) for (cou_id, reg_name, reg_data) in data
+                                     if is_new(reg_data)])
 
         query = ''' INSERT INTO locations (location, location_id) VALUES (?,?)'''
         self.con.executemany(query, regions + countries + continents)
@@ -148,43 +293,174 @@ class Parser:
 
         query = ''' INSERT INTO lineages (lineage, lineage_id)
                             VALUES (?,?)'''
-        self.con.executemany(query, self.lineages_dict.items())
+        self.con.executemany(query, [(lineage_name, lineage_id) for lineage_name, lineage_id in self.lineages_dict.items()
+                                     if lineage_id >= self.stored_counts['lineages']])
         self.con.commit()
 
-        print(f"\t\t Analyzing lineages info ... ")
+        if self.imported_date is None:
+            print(f"\t\t Analyzing lineages info ... ")
 
-        cur = self.con.cursor()
-        # Compute the number of lineages sequences affected by a given mutation
-        cur.execute('''   CREATE VIEW temp.lin_mut_counts AS
-                            SELECT lineage_id, protein_id, mut, count(*) AS count
-                            FROM aa_substitutions NATURAL JOIN sequences
-                            GROUP BY lineage_id, protein_id, mut;''')
-
-        # Compute the total number of lineages sequences
-        cur.execute('''   CREATE VIEW temp.lin_counts AS
-                            SELECT lineage_id, count(*) as count
-                            FROM sequences
-                            GROUP BY lineage_id;''')
-
-        # Compute lineages characteristics as the mutations affecting at least 50% of lineage's sequences
-        cur.execute('''   INSERT INTO lineages_characteristics
-                            SELECT lineage_id, protein_id, mut
-                            FROM lin_mut_counts AS LM
-                            WHERE LM.count >= (
-                                SELECT count*0.5
-                                FROM lin_counts
-                                WHERE lineage_id=LM.lineage_id
-                                );''')
+            self.characterize()
+
+    def characterize(self):
+        """
+        Computes lineages characteristics as the mutations affecting at least 50% of lineage's sequences,
+        based on the counters updated during the parsing
+        """
+        query = ''' INSERT INTO lineages_characteristics (lineage_id, mut_id) VALUES (?,?)'''
+        self.con.executemany(query, [(lineage_id, mut_id)
+                                     for lineage_id, mut_counts in self.lineage_mut_counts.items()
+                                     for mut_id, count in mut_counts.items()
+                                     if count >= self.lineage_counts[lineage_id] * 0.5])
         self.con.commit()
 
-    def parse(self, selected_countries):
+    def get_expected_cols(self):
+        """
+        Gets the names of the columns required by the parser
+        Returns: List of string representing the names of the expected columns
+
+        """
+        return []
+
+    def parse(self, selected_countries, workers=1):
         """
         Performs the parsing of the file, loading the data into the database.
         Args:
             selected_countries: List of strings representing the names of the countries to be loaded
+            workers:            Number of worker processes to be used. If greater than 1, the file is split into
+                                newline-aligned byte ranges that are parsed in parallel and then merged.
+        """
+        # Read first line and extract cols positions
+        self.auto_extract_cols(expected_cols=self.get_expected_cols())
+        self.track_watermark = self.submission_date_col in self.cols and self.accession_col in self.cols
+        if self.imported_date is not None and not self.track_watermark:
+            print(
+                "\n\033[91m* FATAL ERROR: \tThe metadata file does not contain the submission date and accession " +
+                "columns required by the incremental update.\n*\n*\t\t" +
+                "Run again with the --regenerate option to rebuild the database from scratch. \033[0m")
+            exit(-1)
+
+        if workers > 1:
+            self.parse_shards(selected_countries, workers)
+        else:
+            self.stage_lines(tqdm(self.f, desc='\t\t'), selected_countries)
+
+        if self.pipeline_stats['batches'] > 0:
+            stats = self.pipeline_stats
+            print(f"\t\t Pipeline: {stats['batches']} batches, "
+                  f"queue depth avg {stats['depth_sum'] / stats['batches']:.2f} max {stats['max_depth']}"
+                  f"/{stats['queue_size']}, parser stalls {stats['parser_stalls']} "
+                  f"({stats['parser_stall_time']:.2f}s), writer stalls {stats['writer_stalls']} "
+                  f"({stats['writer_idle_time']:.2f}s)")
+
+        self.dict_to_tables()
+
+    def stage_lines(self, lines, selected_countries):
+        """
+        Parses the given lines of the file and stages all their data, by means of the writer thread if enabled
+        Args:
+            lines:              Iterable over the lines to be parsed (header excluded)
+            selected_countries: List of strings representing the names of the countries to be loaded
+        """
+        if self.queue_size > 0:
+            self.writer = BatchWriter(self.queue_size)
+        try:
+            self.parse_lines(lines, selected_countries)
+            self.batch_to_subs()
+            self.batch_to_seqs()
+        finally:
+            if self.writer is not None:
+                writer, self.writer = self.writer, None
+                self.pipeline_stats = merge_stats(self.pipeline_stats, writer.close())
+
+    def parse_lines(self, lines, selected_countries):
+        """
+        Parses the given lines of the file, staging the data through the aggregator.
+        Args:
+            lines:              Iterable over the lines to be parsed (header excluded)
+            selected_countries: List of strings representing the names of the countries to be loaded
         """
         pass
 
+    def parse_shards(self, selected_countries, workers):
+        """
+        Parses the file in parallel. The file is split into newline-aligned byte ranges (shards), each one parsed
+        by a worker process into its own aggregator using local identifiers. The shards are then merged
+        in file order, so that the resulting identifiers are the same as the ones of a serial parsing.
+        Args:
+            selected_countries: List of strings representing the names of the countries to be loaded
+            workers:            Number of worker processes to be used
+        """
+        file_path = self.f.name
+        shards = compute_shards(file_path, workers * 4)
+        settings = {attr: getattr(self, attr) for attr in ('filter_by_data_flag', 'beginning_date_flag',
+                                                            'end_data_flag', 'beginning_date', 'end_date',
+                                                            'track_watermark', 'imported_date', 'imported_accessions',
+                                                            'batch_size', 'queue_size')}
+
+        # Workers are forked and receive only primitive values through the queues: this way they never import
+        # modules, which may be still initializing in the parent process (e.g., the apis package during startup)
+        context = multiprocessing.get_context('fork')
+        task_queue, result_queue = context.Queue(), context.Queue()
+        for idx, (begin, end) in enumerate(shards):
+            task_queue.put((idx, begin, end))
+        processes = [context.Process(target=shard_worker, daemon=True,
+                                     args=(type(self), type(self.aggregator), file_path, self.cols, settings, selected_countries,
+                                           task_queue, result_queue))
+                     for _ in range(min(workers, len(shards)))]
+        for process in processes:
+            task_queue.put(None)
+            process.start()
+
+        # Merge the shards following the file order, as soon as they are available
+        completed = {}
+        for idx in tqdm(range(len(shards)), desc='\t\t'):
+            while idx not in completed:
+                try:
+                    shard = result_queue.get(timeout=1)
+                except queue.Empty:
+                    if any(process.exitcode not in (None, 0) for process in processes):
+                        raise RuntimeError('A parsing worker terminated unexpectedly')
+                    continue
+                if 'error' in shard:
+                    raise RuntimeError(f"Parsing of shard {shard['idx']} failed:\n{shard['error']}")
+                completed[shard['idx']] = shard
+            self.merge_shard(completed.pop(idx))
+
+        for process in processes:
+            process.join()
+
+    def merge_shard(self, shard):
+        """
+        Merges the data parsed by a worker into the aggregator, by translating the local identifiers
+        of the shard into the global ones
+        Args:
+            shard: Dictionary describing the shard, as returned by parse_shard
+        """
+        # Translate the local dictionaries, following the order in which the worker created the entries
+        lineage_map = {local_id: self.get_lineage_id(name) for name, local_id in shard['lineages'].items()}
+        protein_map = {local_id: self.get_protein_id(name) for name, local_id in shard['proteins'].items()}
+        mutation_map = {local_id: self.get_mutation_id(protein_map[protein_id], mut)
+                        for (protein_id, mut), local_id in shard['mutations'].items()}
+        location_map = []
+        for local_id, continent_name, country_name, region_name in shard['locations']:
+            ids = self.get_location_ids(continent_name, country_name, region_name)
+            location_map.append((local_id, [loc_id for loc_id in ids if loc_id is not None][-1]))
+
+        self.aggregator.merge_shard(shard['data'], list(lineage_map.items()), list(mutation_map.items()), location_map,
+                                    self.sequences_count)
+        self.sequences_count += shard['sequences_count']
+        self.update_watermark(*shard['watermark'])
+        self.pipeline_stats = merge_stats(self.pipeline_stats, shard['pipeline_stats'])
+
+        # Merge the characterization counters
+        for lineage_id, count in shard['lineage_counts'].items():
+            self.lineage_counts[lineage_map[lineage_id]] += count
+        for lineage_id, mut_counts in shard['lineage_mut_counts'].items():
+            global_mut_counts = self.lineage_mut_counts[lineage_map[lineage_id]]
+            for mut_id, count in mut_counts.items():
+                global_mut_counts[mutation_map[mut_id]] += count
+
     def get_sequence_id(self):
         """
         Gets the sequence id
@@ -278,3 +554,142 @@ class Parser:
             self.proteins_count += 1
             self.proteins_dict[protein_name] = protein_id
         return protein_id
+
+    def get_mutation_id(self, protein_id, mutation_name):
+        """
+        Gets the mutation id from the protein id and the mutation name by updating the dictionary
+        Args:
+            protein_id:     The id of the protein affected by the mutation
+            mutation_name:  The name of the mutation to be considered
+
+        Returns: The id of the mutation
+
+        """
+        mut_id = self.mutations_dict.get((protein_id, mutation_name))
+        if mut_id is None:
+            mut_id = self.mutations_count
+            self.mutations_count += 1
+            self.mutations_dict[(protein_id, mutation_name)] = mut_id
+        return mut_id
+
+
+def compute_shards(file_path, shards_num):
+    """
+    Splits the file into newline-aligned byte ranges, excluding the header line
+    Args:
+        file_path:  The path to the file to be split
+        shards_num: The number of desired shards
+
+    Returns: List of (begin, end) byte offsets, one for each non-empty shard
+
+    """
+    with open(file_path, 'rb') as f:
+        f.readline()  # skip header
+        data_begin = f.tell()
+        file_size = os.fstat(f.fileno()).st_size
+
+        boundaries = [data_begin]
+        for idx in range(1, shards_num):
+            f.seek(data_begin + (file_size - data_begin) * idx // shards_num)
+            f.readline()  # move to the beginning of the next line
+            boundaries.append(max(f.tell(), boundaries[-1]))
+        boundaries.append(file_size)
+
+    return [(begin, end) for begin, end in zip(boundaries[:-1], boundaries[1:]) if begin < end]
+
+
+def read_lines(file_path, begin, end):
+    """
+    Reads the lines of a file included in the given byte range, decoding them as a text-mode stream would do
+    Args:
+        file_path:  The path to the file to be read
+        begin:      The offset of the first byte to be read. Must be the beginning of a line
+        end:        The offset of the byte after the last one to be read. Must be the beginning of a line
+
+    Returns: Generator over the lines of the range
+
+    """
+    encoding = locale.getpreferredencoding(False)
+    with open(file_path, 'rb') as f:
+        f.seek(begin)
+        position = begin
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            if line.endswith(b'\r\n'):
+                line = line[:-2] + b'\n'
+            yield line.decode(encoding)
+
+
+def shard_worker(parser_class, aggregator_class, file_path, cols, settings, selected_countries, task_queue,
+                 result_queue):
+    """
+    Worker process entry point: parses the shards received from the task queue until a None task is found
+    Args:
+        parser_class:       The class of the parser to be used
+        aggregator_class:   The class of the aggregator to be used
+        file_path:          The path to the file to be parsed
+        cols:               Dictionary of the form {col_name: position_idx , ...}
+        settings:           Dictionary with the date range, watermark and batching attributes of the parser
+        selected_countries: List of strings representing the names of the countries to be loaded
+        task_queue:         Queue of (idx, begin, end) tuples describing the shards to be parsed
+        result_queue:       Queue where the descriptions of the parsed shards are put
+    """
+    for idx, begin, end in iter(task_queue.get, None):
+        try:
+            result_queue.put(parse_shard(parser_class, aggregator_class, file_path, idx, begin, end, cols,
+                                         settings, selected_countries))
+        except Exception:
+            result_queue.put({'idx': idx, 'error': traceback.format_exc()})
+
+
+def parse_shard(parser_class, aggregator_class, file_path, idx, begin, end, cols, settings, selected_countries):
+    """
+    Parses a byte range of the file into the aggregator of the shard, using local identifiers
+    Args:
+        parser_class:       The class of the parser to be used
+        aggregator_class:   The class of the aggregator to be used
+        file_path:          The path to the file to be parsed
+        idx:                The index of the shard
+        begin:              The offset of the first byte of the shard
+        end:                The offset of the byte after the last one of the shard
+        cols:               Dictionary of the form {col_name: position_idx , ...}
+        settings:           Dictionary with the date range, watermark and batching attributes of the parser
+        selected_countries: List of strings representing the names of the countries to be loaded
+
+    Returns:    Dictionary describing the shard, containing the data exported by its aggregator, the number
+                of sequences, the watermark, the characterization counters and the local dictionaries of lineages,
+                proteins, mutations and locations. Locations are returned as a list of
+                (local_id, continent_name, country_name, region_name) in creation order.
+
+    """
+    parser = parser_class(None, None, aggregator_class.create_shard(idx))
+    parser.cols = cols
+    parser.__dict__.update(settings)
+    parser.stage_lines(read_lines(file_path, begin, end), selected_countries)
+
+    locations = []
+    for continent_name, continent_data in parser.locations_dict.items():
+        locations.append((continent_data['id'], continent_name, None, None))
+        for country_name, country_data in continent_data['countries'].items():
+            locations.append((country_data['id'], continent_name, country_name, None))
+            for region_name, region_data in country_data['regions'].items():
+                locations.append((region_data['id'], continent_name, country_name, region_name))
+    locations.sort()
+
+    return {
+        'idx': idx,
+        'data': parser.aggregator.export_shard(),
+        'sequences_count': parser.sequences_count,
+        'watermark': (parser.watermark_date, parser.watermark_accessions),
+        'pipeline_stats': parser.pipeline_stats,
+        'lineage_counts': dict(parser.lineage_counts),
+        'lineage_mut_counts': {lineage_id: dict(mut_counts) for lineage_id, mut_counts
+                               in parser.lineage_mut_counts.items()},
+        'lineages': parser.lineages_dict,
+        'proteins': parser.proteins_dict,
+        'mutations': parser.mutations_dict,
+        'locations': locations
+    }
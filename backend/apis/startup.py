@@ -5,20 +5,28 @@
 
 """
 
+import json
 import os
+import signal
 from datetime import datetime
-from shutil import rmtree
+from shutil import copyfile, rmtree
 from sqlite3 import connect
 from threading import Thread
 from time import time
 
 from flask_restplus import Namespace
 
+from .aggregators.ColumnarAggregator import ColumnarAggregator
+from .aggregators.SqliteAggregator import SqliteAggregator
 from .parsers.GisaidParser import GisaidParser
 from .parsers.NextstrainParser import NextstrainParser
 from .utils.arg_manager import get_cmd_arguments
-from .utils.db_manager import connection_preset, clear_db
-from .utils.path_manager import db_paths as paths
+from .utils.cache_manager import configure_cache
+from .utils.db_manager import connection_preset
+from .utils.input_manager import is_compressed, open_metadata
+from .utils.lineage_manager import load_aliases, get_lineage_ancestors
+from .utils.path_manager import db_paths as paths, get_db_path, new_db_path, switch_db_path, reload_db_path, \
+    remove_old_db_versions
 
 api = Namespace('startup', description='startup')
 args = get_cmd_arguments()
@@ -29,6 +37,11 @@ version = "2.0.1"  # Keep consistent wrt package.json file
 def on_done():
     # clean temporary files
     rmtree(paths.temp_tree, ignore_errors=True)
+    if args.ingest_only:
+        print("\n\n\033[01m\033[32m> * STARTUP COMPLETED:\033[0m\033[32m Database ready (ingest only)\033[0m\n")
+        return
+    # the versions replaced before (possibly by separate ingest processes) are not served by this server anymore
+    remove_old_db_versions()
     port = os.getenv('PORT', 5000)
     print(
         "\n\n\033[01m\033[32m> * STARTUP COMPLETED:\033[0m\033[32m The application is now accessible from your browser at http://localhost:"
@@ -57,22 +70,401 @@ def startup():
         if is_public:
             print(f'''\t{prepend} Additional public-endpoint features: enabled''')
 
+    def create_aggregator():
+        return ColumnarAggregator(con) if args.engine == 'columnar' else SqliteAggregator(con)
+
+    def create_parser(file_type, f, aggregator):
+        return GisaidParser(con, f, aggregator) if file_type != 'nextstrain' else NextstrainParser(con, f, aggregator)
+
+    def is_outdated():
+        tables = [table for table, in cur.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+        return 'mutations' not in tables
+
+    def has_watermark():
+        cols = [col_info[1] for col_info in cur.execute('''PRAGMA table_info(info)''')]
+        return ('watermark_date' in cols and
+                cur.execute('''SELECT watermark_date FROM info''').fetchone()[0] is not None)
+
+    def store_report(parser):
+        report['sequences'] = parser.sequences_count
+        report['lineages'] = parser.lineages_count
+        report['locations'] = parser.locations_count
+        report['mutations'] = parser.mutations_count
+        report['pipeline'] = parser.pipeline_stats
+
+    def write_report():
+        report['total'] = time() - exec_start
+        if args.report_path is not None:
+            with open(args.report_path, 'w') as report_file:
+                json.dump(report, report_file, indent=2)
+
+    def store_watermark(parser):
+        run_query('''   UPDATE info SET watermark_date = ?''', (parser.watermark_date or None,))
+        run_query('''   DELETE FROM watermark_accessions''')
+        cur.executemany('''INSERT INTO watermark_accessions (accession) VALUES (?)''',
+                        [(accession,) for accession in parser.watermark_accessions])
+        con.commit()
+
+    def store_aliases():
+        # Replace the stored Pango aliases with the ones of the alias key file, if given
+        run_query('''   CREATE TABLE IF NOT EXISTS lineage_aliases
+                        (alias text primary key, lineage text)''')
+        if args.alias_path is not None:
+            run_query('''   DELETE FROM lineage_aliases''')
+            cur.executemany('''INSERT INTO lineage_aliases (alias, lineage) VALUES (?,?)''',
+                            load_aliases(args.alias_path).items())
+            con.commit()
+
+    def create_lineages_hierarchy():
+        """
+        Creates the closure table of the lineages hierarchy, pairing each lineage with the names of all its
+        ancestors (itself included), both unaliased and aliased. Groups in star notation (e.g., BA.2.*) are
+        expanded by looking up their name among the ancestors
+
+        """
+        aliases = {alias: lineage for alias, lineage in cur.execute('''SELECT alias, lineage FROM lineage_aliases''')}
+        unaliased_aliases = {}
+        for alias, lineage in aliases.items():
+            unaliased_aliases.setdefault(lineage, []).append(alias)
+
+        run_query('''   DROP TABLE IF EXISTS lineages_hierarchy''')
+        run_query('''   CREATE TABLE lineages_hierarchy
+                        (ancestor text, lineage_id int, PRIMARY KEY (ancestor, lineage_id)) WITHOUT ROWID''')
+        lineages = cur.execute('''SELECT lineage_id, lineage FROM lineages''').fetchall()
+        cur.executemany('''INSERT INTO lineages_hierarchy (ancestor, lineage_id) VALUES (?,?)''',
+                        [(ancestor, lineage_id) for lineage_id, lineage in lineages
+                         for ancestor in get_lineage_ancestors(lineage, aliases, unaliased_aliases)])
+        con.commit()
+
+    def create_locations_search():
+        """
+        Creates the full-text index of the location names, used by the location autocomplete, and the table pairing
+        each location with its type, name, country and continent (a continent or country is paired with itself)
+
+        """
+        for table in ['locations_search', 'locations_tree']:
+            run_query(f'''   DROP TABLE IF EXISTS {table}''')
+
+        run_query('''   CREATE VIRTUAL TABLE locations_search
+                        USING fts5(location, content='locations', content_rowid='location_id')''')
+        run_query('''   INSERT INTO locations_search(locations_search) VALUES ('rebuild')''')
+
+        run_query('''   CREATE TABLE locations_tree
+                        (location_id int primary key, type text, location text, country_id int, continent_id int)''')
+        run_query('''   INSERT INTO locations_tree
+                        SELECT location_id, type, location, country_id, continent_id
+                        FROM (  SELECT continent_id AS location_id, 'continent' AS type,
+                                       NULL AS country_id, continent_id
+                                FROM continents
+                                UNION ALL
+                                SELECT country_id, 'country', country_id, continent_id
+                                FROM countries
+                                UNION ALL
+                                SELECT region_id, 'region', RE.country_id, continent_id
+                                FROM regions RE JOIN countries CC ON RE.country_id = CC.country_id) TR
+                            JOIN locations LO USING (location_id)''')
+        run_query('''   CREATE INDEX locations_tree_idx1
+                        ON  locations_tree(country_id, type, location)''')
+        run_query('''   CREATE INDEX locations_tree_idx2
+                        ON  locations_tree(continent_id, type, location)''')
+        con.commit()
+
+    def create_dataset_manifest():
+        """
+        Creates the tables of the dataset manifest, loaded in memory by the server: the first and last date and
+        the number of sequences of each location, and the number of sequences of each lineage
+
+        """
+        for table in ['manifest_locations', 'manifest_lineages']:
+            run_query(f'''   DROP TABLE IF EXISTS {table}''')
+
+        run_query('''   CREATE TABLE manifest_locations
+                        (location_id int primary key, first_date int, last_date int, count int)''')
+        run_query('''   INSERT INTO manifest_locations
+                        SELECT location_id, min(date), max(date), sum(count)
+                        FROM aggr_sequences
+                        GROUP BY location_id''')
+
+        run_query('''   CREATE TABLE manifest_lineages
+                        (lineage_id int primary key, count int)''')
+        run_query('''   INSERT INTO manifest_lineages
+                        SELECT lineage_id, sum(count)
+                        FROM aggr_sequences SQ JOIN continents CO ON SQ.location_id = CO.continent_id
+                        GROUP BY lineage_id''')
+
+    def has_cumulative_tables():
+        tables = [table for table, in cur.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+        return 'cumul_sequences' in tables
+
+    def create_cumulative_tables():
+        """
+        Creates the tables of the cumulative daily counts (i.e., the running sums over the dates) of the
+        sequences per location and lineage, of the sequences per location and of the mutations per location.
+        The count of any period is the difference of the cumulative counts at its ends
+
+        """
+        for table in ['cumul_sequences', 'cumul_location_sequences', 'cumul_aa_substitutions']:
+            run_query(f'''   DROP TABLE IF EXISTS {table}''')
+
+        run_query('''   CREATE TABLE cumul_sequences
+                        (location_id int, lineage_id int, date int, count int,
+                        PRIMARY KEY (location_id, lineage_id, date)) WITHOUT ROWID''')
+
+        run_query('''   CREATE TABLE cumul_location_sequences
+                        (location_id int, date int, count int,
+                        PRIMARY KEY (location_id, date)) WITHOUT ROWID''')
+
+        run_query('''   CREATE TABLE cumul_aa_substitutions
+                        (location_id int, mut_id int, date int, count int,
+                        PRIMARY KEY (location_id, mut_id, date)) WITHOUT ROWID''')
+
+        run_query('''   INSERT INTO cumul_sequences
+                        SELECT location_id, lineage_id, date,
+                               sum(count) OVER (PARTITION BY location_id, lineage_id ORDER BY date)
+                        FROM (  SELECT location_id, lineage_id, date, sum(count) AS count
+                                FROM aggr_sequences
+                                GROUP BY location_id, lineage_id, date)''')
+
+        run_query('''   INSERT INTO cumul_location_sequences
+                        SELECT location_id, date, sum(count) OVER (PARTITION BY location_id ORDER BY date)
+                        FROM (  SELECT location_id, date, sum(count) AS count
+                                FROM aggr_sequences
+                                GROUP BY location_id, date)''')
+
+        run_query('''   INSERT INTO cumul_aa_substitutions
+                        SELECT location_id, mut_id, date,
+                               sum(count) OVER (PARTITION BY location_id, mut_id ORDER BY date)
+                        FROM (  SELECT location_id, mut_id, date, sum(count) AS count
+                                FROM aggr_aa_substitutions
+                                GROUP BY location_id, mut_id, date)''')
+
+        run_query('''   CREATE INDEX cumul_aa_substitutions_idx
+                        ON  cumul_aa_substitutions(location_id, date, mut_id)''')
+
+    def has_family_tables():
+        tables = [table for table, in cur.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+        return 'family_aa_substitutions' in tables
+
+    def load_family_min_size():
+        # Databases created by previous versions do not store it: the column is added with no value
+        cols = [col_info[1] for col_info in cur.execute('''PRAGMA table_info(info)''')]
+        if 'family_min_size' not in cols:
+            run_query('''   ALTER TABLE info ADD COLUMN family_min_size int''')
+            return None
+        return cur.execute('''SELECT family_min_size FROM info''').fetchone()[0]
+
+    def drop_family_tables():
+        for table in ['lineage_families', 'family_sequences', 'family_aa_substitutions']:
+            run_query(f'''   DROP TABLE IF EXISTS {table}''')
+
+    def create_family_tables(min_size):
+        """
+        Creates the tables of the counts of the lineage families, i.e., the counts summed over all the descendants
+        of the ancestors (in the lineages hierarchy) having at least min_size lineages. Ancestors with the same
+        descendants (e.g., an alias and its unaliased name) share the same family
+        Args:
+            min_size:   Min number of lineages of the stored families
+
+        """
+        drop_family_tables()
+
+        run_query('''   CREATE TABLE lineage_families
+                        (family text primary key, family_id int)''')
+
+        run_query('''   CREATE TABLE family_sequences
+                        (location_id int, family_id int, date int, count int,
+                        PRIMARY KEY (location_id, family_id, date)) WITHOUT ROWID''')
+
+        run_query('''   CREATE TABLE family_aa_substitutions
+                        (location_id int, family_id int, date int, mut_id int, count int,
+                        PRIMARY KEY (location_id, family_id, date, mut_id)) WITHOUT ROWID''')
+
+        descendants = {}
+        for ancestor, lineage_id in cur.execute('''SELECT ancestor, lineage_id FROM lineages_hierarchy'''):
+            descendants.setdefault(ancestor, set()).add(lineage_id)
+        family_ids = {}  # {frozenset of lineage ids: family id}
+        families = []
+        for ancestor, lineage_ids in sorted(descendants.items()):
+            if len(lineage_ids) >= max(min_size, 2):
+                families.append((ancestor, family_ids.setdefault(frozenset(lineage_ids), len(family_ids))))
+        cur.executemany('''INSERT INTO lineage_families (family, family_id) VALUES (?,?)''', families)
+
+        run_query('''   CREATE TEMP TABLE family_members
+                        (family_id int, lineage_id int)''')
+        cur.executemany('''INSERT INTO temp.family_members (family_id, lineage_id) VALUES (?,?)''',
+                        [(family_id, lineage_id) for lineage_ids, family_id in family_ids.items()
+                         for lineage_id in lineage_ids])
+
+        run_query('''   INSERT INTO family_sequences
+                        SELECT location_id, family_id, date, sum(count)
+                        FROM aggr_sequences SQ JOIN temp.family_members FM ON SQ.lineage_id = FM.lineage_id
+                        GROUP BY location_id, family_id, date''')
+
+        run_query('''   INSERT INTO family_aa_substitutions
+                        SELECT location_id, family_id, date, mut_id, sum(count)
+                        FROM aggr_aa_substitutions SB JOIN temp.family_members FM ON SB.lineage_id = FM.lineage_id
+                        GROUP BY location_id, family_id, date, mut_id''')
+
+        run_query('''   DROP TABLE temp.family_members''')
+
+    def incremental_update():
+        """
+        Updates the existing database by importing only the sequences submitted after its watermark,
+        using the same parameters of the existing database
+
+        """
+        curr_step, tot_steps = 1, 4
+        step_start = time()
+        info_q = '''   SELECT file_type, filtered_countries, beginning_date, end_date, watermark_date
+                        FROM  info;'''
+        file_type, filtered_countries, beginning_date, end_date, watermark_date = cur.execute(info_q).fetchone()
+        filtered_countries = set(filtered_countries.split('; ')) if len(filtered_countries) > 0 else set()
+        watermark_accessions = {accession for accession, in cur.execute('''SELECT accession FROM watermark_accessions''')}
+
+        with open_metadata(args.file_path) as f:
+            aggregator = create_aggregator()
+
+            ###############################################################
+            # Load the dictionaries and create the delta tables
+            print(f"\t STEP {curr_step}/{tot_steps}: Tables preparation ... ", end="")
+
+            aggregator.create_staging()
+
+            run_query('''   CREATE TEMP TABLE delta_sequences
+                            (date int, lineage_id int, location_id int, count int )''')
+
+            run_query('''   CREATE TEMP TABLE delta_aa_substitutions
+                            (date int, lineage_id int, location_id int, mut_id int, count int)''')
+
+            parser = create_parser(file_type, f, aggregator)
+            parser.load_dicts()
+            parser.set_imported_watermark(watermark_date, watermark_accessions)
+
+            report['steps']['preparation'] = time() - step_start
+            print(f'done in {time() - step_start:.5f} seconds.')
+            step_start = time()
+
+            ###############################################################
+            # Parse the rows submitted after the watermark
+            curr_step += 1
+            print(f"\t STEP {curr_step}/{tot_steps}: Data extraction (submitted after {watermark_date}) ...")
+            print_parsing_info(prepend='\t   *', params_only=True)
+            parser.set_date_range(beginning_date, end_date)
+            parser.set_pipeline(args.batch_size, args.queue_size)
+            parser.parse(filtered_countries, workers)
+            store_watermark(parser)
+            store_report(parser)
+            del parser
+
+            report['steps']['extraction'] = time() - step_start
+            print(f'\t\tdone in {time() - step_start:.5f} seconds.')
+            step_start = time()
+
+            ###############################################################
+            # Aggregate the new data
+            curr_step += 1
+            print(f"\t STEP {curr_step}/{tot_steps}: Data aggregation ... ")
+
+            aggregator.aggregate('temp.delta_sequences', 'temp.delta_aa_substitutions')
+
+            report['steps']['aggregation'] = time() - step_start
+            print(f'\t\tdone in {time() - step_start:.5f} seconds.')
+            step_start = time()
+
+            ###############################################################
+            # Merge the new counts into the existing tables
+            curr_step += 1
+            print(f"\t STEP {curr_step}/{tot_steps}: Data merging ... ")
+
+            aggregator.merge_delta('temp.delta_sequences', 'temp.delta_aa_substitutions')
+
+            print(f"\t\t Analyzing updated lineages info ... ")
+            aggregator.recharacterize('temp.delta_sequences')
+            del aggregator
+
+            run_query('''   DROP TABLE temp.delta_sequences''')
+            run_query('''   DROP TABLE temp.delta_aa_substitutions''')
+
+            # The families are stored with the min size of the existing tables, unless a new one is given
+            family_min_size = args.family_min_size or load_family_min_size()
+            if has_family_tables() and not family_min_size:
+                print(f"\t\t \033[34mINFO: Unknown min size of the lineage families, family counts dropped "
+                      f"(rebuild them with --family-aggregates)\033[0m")
+                drop_family_tables()
+
+            print(f"\t\t Computing lineages hierarchy ... ")
+            store_aliases()
+            create_lineages_hierarchy()
+
+            print(f"\t\t Indexing locations ... ")
+            create_locations_search()
+
+            print(f"\t\t Computing dataset manifest ... ")
+            create_dataset_manifest()
+
+            if args.cumulative_tables or has_cumulative_tables():
+                print(f"\t\t Computing cumulative counts ... ")
+                create_cumulative_tables()
+            if family_min_size:
+                print(f"\t\t Computing lineage family counts ... ")
+                create_family_tables(family_min_size)
+            run_query('''   UPDATE info SET parse_date = DATE('now'), version = ?, family_min_size = ?''',
+                      (version, family_min_size or 0))
+
+            report['steps']['merging'] = time() - step_start
+            print(f'\t\tdone in {time() - step_start:.5f} seconds.')
+
     exec_start = time()
     print("\033[01m\033[33m> Starting initial setup ... \033[0m")
+
+    workers = args.workers
+    if workers > 1 and args.file_path is not None and is_compressed(args.file_path):
+        # Shards are byte ranges of the file: they cannot be computed on compressed data
+        print('   \033[34mINFO: Compressed metadata file, parallel parsing disabled\033[0m')
+        workers = 1
     curr_step, tot_steps = 1, 4
+    report = {'mode': 'full', 'steps': {}}  # timings and counters of the ingest, dumped to args.report_path
 
-    con = connect(paths.db_path)
-    connection_preset(con)
+    # The database in use is never modified: the new data is written into a new version of the database,
+    # which replaces the current one only when completed. Meanwhile, the current version is still served.
+    current_db_path = get_db_path()
+    con = connect(current_db_path) if os.path.exists(current_db_path) else connect(':memory:')
     cur = con.cursor()
 
     # Check if tables already exists
     cur.execute(" SELECT count(name) FROM sqlite_master WHERE type='table'")
     if cur.fetchone()[0] > 1:
         print('   \033[34mINFO: Database already exists ', end='')
-        if args.regenerate:
-            # Clear current database
-            print('[database overwrite started]... \033[0m')
-            clear_db(db_con=con, db_cur=cur)
+        if is_outdated():
+            # Database created by a previous version, not compatible with the current one
+            print('[outdated database structure, new database creation started]... \033[0m')
+
+        elif args.regenerate:
+            # Replace current database
+            print('[new database creation started]... \033[0m')
+
+        elif args.incremental and has_watermark():
+            # Import only the new sequences into a copy of the current database
+            print('[incremental update started]... \033[0m')
+            con.close()
+            db_path = new_db_path()
+            copyfile(current_db_path, db_path)
+            con = connect(db_path, check_same_thread=False)  # staging may run in the writer thread
+            connection_preset(con)
+            cur = con.cursor()
+
+            report['mode'] = 'incremental'
+            incremental_update()
+            con.close()
+            switch_db_path(db_path)
+            write_report()
+            print(f'\t>> Setup overall time: {time() - exec_start:.5f} seconds.\n')
+            on_done()
+            return
+
+        elif args.incremental:
+            # Incremental update not possible: replace current database
+            print('[no import watermark found, new database creation started]... \033[0m')
 
         else:
             # Start the app directly
@@ -81,35 +473,33 @@ def startup():
             con.close()
             on_done()
             return
+    con.close()
 
-    with open(args.file_path) as f:
-        clear_db(db_name=paths.temp_db1_path)
-        clear_db(db_name=paths.temp_db2_path)
-        cur.execute(f''' ATTACH DATABASE '{paths.temp_db1_path}' AS temp_table1; ''')
-        cur.execute(f''' ATTACH DATABASE '{paths.temp_db2_path}' AS temp_table2;''')
-        connection_preset(con)
+    db_path = new_db_path()
+    con = connect(db_path, check_same_thread=False)  # staging may run in the writer thread
+    connection_preset(con)
+    cur = con.cursor()
+
+    with open_metadata(args.file_path) as f:
+        aggregator = create_aggregator()
 
         ###############################################################
         # Create all the tables
         print(f"\t STEP {curr_step}/{tot_steps}: Tables creation ... ", end="")
 
-        run_query('''   CREATE TABLE temp_table1.sequences
-                        (sequence_id int, date int, lineage_id int, continent_id int, country_id int, region_id int )''')
+        aggregator.create_staging()
 
         run_query('''   CREATE TABLE aggr_sequences
                         (date int, lineage_id int, location_id int, count int )''')
 
-        run_query('''   CREATE TABLE temp_table2.aa_substitutions
-                        (sequence_id int, protein_id int, mut text)''')
-
         run_query('''   CREATE TABLE aggr_aa_substitutions
-                        (date int, lineage_id int, location_id int, protein_id int, mut text, count int)''')
+                        (date int, lineage_id int, location_id int, mut_id int, count int)''')
 
         run_query('''   CREATE TABLE lineages
                         (lineage_id int primary key , lineage text)''')
 
         run_query('''   CREATE TABLE lineages_characteristics
-                        (lineage_id int , protein_id int, mut text)''')
+                        (lineage_id int , mut_id int)''')
 
         run_query('''   CREATE TABLE locations
                         (location_id int primary key , location text)''')
@@ -126,15 +516,26 @@ def startup():
         run_query('''   CREATE TABLE proteins
                         (protein_id int primary key , protein text)''')
 
+        run_query('''   CREATE TABLE mutations
+                        (mut_id int primary key , protein_id int, mut text)''')
+
         run_query('''   CREATE TABLE info
-                        (file_type text, filtered_countries text, beginning_date text, end_date text, parse_date text, version text)''')
+                        (file_type text, filtered_countries text, beginning_date text, end_date text, parse_date text, version text,
+                        watermark_date text, family_min_size int)''')
+
+        run_query('''   CREATE TABLE watermark_accessions
+                        (accession text)''')
 
-        params = vars(args)
+        store_aliases()
+
+        params = dict(vars(args))
         params['filtered_countries'] = '; '.join(params['filtered_countries'])
         params['version'] = version
         run_query('''   INSERT INTO info VALUES 
-                        (:file_type,:filtered_countries,:beginning_date, :end_date, DATE('now'), :version);''', params)
+                        (:file_type,:filtered_countries,:beginning_date, :end_date, DATE('now'), :version, NULL,
+                        :family_min_size);''', params)
 
+        report['steps']['creation'] = time() - exec_start
         print(f'done in {time() - exec_start:.5f} seconds.')
         step_start = time()
 
@@ -143,14 +544,15 @@ def startup():
         curr_step += 1
         print(f"\t STEP {curr_step}/{tot_steps}: Data extraction ...")
         print_parsing_info(prepend='\t   *', params_only=True)
-        if args.file_type != 'nextstrain':
-            parser = GisaidParser(con, f)
-        else:
-            parser = NextstrainParser(con, f)
+        parser = create_parser(args.file_type, f, aggregator)
         parser.set_date_range(args.beginning_date, args.end_date)
-        parser.parse(args.filtered_countries)
+        parser.set_pipeline(args.batch_size, args.queue_size)
+        parser.parse(args.filtered_countries, workers)
+        store_watermark(parser)
+        store_report(parser)
         del parser
 
+        report['steps']['extraction'] = time() - step_start
         print(f'\t\tdone in {time() - step_start:.5f} seconds.')
         step_start = time()
 
@@ -159,54 +561,10 @@ def startup():
         curr_step += 1
         print(f"\t STEP {curr_step}/{tot_steps}: Data aggregation ... ")
 
-        print("\t\tProcessing aa substitutions by continent ...")
-        run_query('''   INSERT INTO aggr_aa_substitutions 
-                            SELECT date, lineage_id, continent_id AS location_id, protein_id, mut, count(*) AS count 
-                            FROM temp_table1.sequences SQ JOIN temp_table2.aa_substitutions SB ON SQ.sequence_id=SB.sequence_id
-                            WHERE continent_id IS NOT NULL AND mut IS NOT NULL
-                            GROUP BY date, lineage_id, continent_id, protein_id, mut;''')
-
-        print("\t\tProcessing aa substitutions by country ...")
-        run_query('''   INSERT INTO aggr_aa_substitutions 
-                            SELECT date, lineage_id, country_id AS location_id, protein_id, mut, count(*) AS count 
-                            FROM temp_table1.sequences SQ JOIN temp_table2.aa_substitutions SB ON SQ.sequence_id=SB.sequence_id
-                            WHERE country_id IS NOT NULL AND mut IS NOT NULL
-                            GROUP BY date, lineage_id, country_id, protein_id, mut;''')
-
-        print("\t\tProcessing aa substitutions by region ...")
-        run_query('''   INSERT INTO aggr_aa_substitutions 
-                            SELECT date, lineage_id, region_id AS location_id, protein_id, mut, count(*) AS count 
-                            FROM temp_table1.sequences SQ JOIN temp_table2.aa_substitutions SB ON SQ.sequence_id=SB.sequence_id
-                            WHERE region_id IS NOT NULL AND mut IS NOT NULL
-                            GROUP BY date, lineage_id, region_id, protein_id, mut;''')
-
-        run_query('''   DETACH DATABASE 'temp_table2';''')
-        clear_db(db_name=paths.temp_db2_path)
-
-        print("\t\tProcessing sequences by continent ...")
-        run_query('''   INSERT INTO aggr_sequences 
-                            SELECT date, lineage_id, continent_id AS location_id, count(*) AS count 
-                            FROM temp_table1.sequences 
-                            WHERE continent_id IS NOT NULL 
-                            GROUP BY date, lineage_id, continent_id;''')
-
-        print("\t\tProcessing sequences by country ...")
-        run_query('''   INSERT INTO aggr_sequences 
-                            SELECT date, lineage_id, country_id AS location_id, count(*) AS count 
-                            FROM temp_table1.sequences 
-                            WHERE country_id IS NOT NULL 
-                            GROUP BY date, lineage_id, country_id;''')
-
-        print("\t\tProcessing sequences by region ...")
-        run_query('''   INSERT INTO aggr_sequences 
-                            SELECT date, lineage_id, region_id AS location_id, count(*) AS count 
-                            FROM temp_table1.sequences 
-                            WHERE region_id IS NOT NULL 
-                            GROUP BY date, lineage_id, region_id;''')
-
-        run_query('''   DETACH DATABASE 'temp_table1';''')
-        clear_db(db_name=paths.temp_db1_path)
+        aggregator.aggregate()
+        del aggregator
 
+        report['steps']['aggregation'] = time() - step_start
         print(f'\t\tdone in {time() - step_start:.5f} seconds.')
         step_start = time()
 
@@ -226,14 +584,50 @@ def startup():
 
         run_query('''   CREATE INDEX aggr_sequences_idx2
                                 ON  aggr_sequences(location_id, lineage_id)''')
+
+        run_query('''   CREATE INDEX mutations_idx
+                        ON  mutations(protein_id, mut)''')
+
+        print(f"\t\t Computing lineages hierarchy ... ")
+        create_lineages_hierarchy()
+
+        print(f"\t\t Indexing locations ... ")
+        create_locations_search()
+
+        print(f"\t\t Computing dataset manifest ... ")
+        create_dataset_manifest()
+
+        if args.cumulative_tables:
+            print(f"\t\t Computing cumulative counts ... ")
+            create_cumulative_tables()
+        if args.family_min_size > 0:
+            print(f"\t\t Computing lineage family counts ... ")
+            create_family_tables(args.family_min_size)
         con.close()
+        report['steps']['indexing'] = time() - step_start
         print(f'\t\tdone in {time() - step_start:.5f} seconds.')
 
+    switch_db_path(db_path)
+    write_report()
     print(f'\t>> Setup overall time: {time() - exec_start:.5f} seconds.\n')
 
     on_done()
 
 
+def on_reload_signal(signum, frame):
+    """
+    Switches to the database version built by a separate ingest process when SIGHUP is received
+    """
+    print(f'...\tDatabase reloaded: {os.path.basename(reload_db_path())}')
+    remove_old_db_versions()
+
+
+if hasattr(signal, 'SIGHUP'):
+    signal.signal(signal.SIGHUP, on_reload_signal)
+
+if not args.ingest_only:
+    configure_cache(args.cache_size, args.disk_cache_size, version)
+
 print("...\n...\tServer started on " + str(datetime.now()))
 print("...\tVersion " + version + "\n...")
 print("\n\n\033[01m⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯    V A R I A N T    H U N T E R    ⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯\033[0m\n")
@@ -17,7 +17,8 @@ def get_cmd_arguments():
 
     parser.add_argument('--filepath', '-fp',
                         type=str, dest='file_path',
-                        help="path to the .tsv metadata file")
+                        help='''path to the .tsv metadata file. It can be compressed (.gz, .xz or .zst, the latter requiring 
+                                the zstandard package), possibly as a tar archive containing the .tsv file''')
 
     parser.add_argument('--filetype', '-ft',
                         type=str.lower, default="gisaid", choices=['gisaid', 'nextstrain'], dest='file_type',
@@ -36,6 +37,11 @@ def get_cmd_arguments():
                         type=str.lower, default="end", dest='end_date',
                         help="end date to be considered when importing data. Use the format YYYY-mm-dd")
 
+    parser.add_argument('--aliases', '-al',
+                        type=str, default=None, dest='alias_path',
+                        help='''path to the Pango alias key file (alias_key.json of pango-designation), used to include 
+                                the aliased sub-lineages in the star notation groups (e.g., BA.* in B.1.1.529.*)''')
+
     parser.add_argument('--public', '-p',
                         default=False, action='store_true', dest='public',
                         help="boolean flag to set when deploying the public version of the tool")
@@ -44,6 +50,57 @@ def get_cmd_arguments():
                         default=False, action='store_true', dest='regenerate',
                         help="boolean flag to overwrite the current database, if present")
 
+    parser.add_argument('--incremental', '-i',
+                        default=False, action='store_true', dest='incremental',
+                        help='''boolean flag to update the current database, if present, by importing only the sequences 
+                                submitted after the last import. The parameters of the existing database are kept''')
+
+    parser.add_argument('--workers', '-w',
+                        type=int, default=1, dest='workers',
+                        help="number of worker processes used to parse the .tsv metadata file. Use 1 for serial parsing")
+
+    parser.add_argument('--engine', '-en',
+                        type=str.lower, default="sqlite", choices=['sqlite', 'columnar'], dest='engine',
+                        help='''aggregation engine used when importing data: sqlite stages the parsed rows into temporary 
+                                databases, columnar keeps them in memory as packed arrays (faster, but memory intensive)''')
+
+    parser.add_argument('--batch-size', '-bs',
+                        type=int, default=50000, dest='batch_size',
+                        help="number of parsed rows staged at once by the aggregation engine")
+
+    parser.add_argument('--queue-size', '-qs',
+                        type=int, default=4, dest='queue_size',
+                        help='''max number of parsed batches waiting to be staged by the writer thread, which overlaps 
+                                the staging with the parsing. Use 0 to stage the batches in the parsing thread''')
+
+    parser.add_argument('--ingest-only', '-io',
+                        default=False, action='store_true', dest='ingest_only',
+                        help="boolean flag to exit after the database setup, without starting the web server")
+
+    parser.add_argument('--report', '-rep',
+                        type=str, default=None, dest='report_path',
+                        help="path of a JSON file where the timings and counters of the database setup are written")
+
+    parser.add_argument('--cumulative-tables', '-ct',
+                        default=False, action='store_true', dest='cumulative_tables',
+                        help='''boolean flag to build the tables of the cumulative daily counts, which make the week 
+                                counts of the analyses independent of the length of the period (larger database)''')
+
+    parser.add_argument('--family-aggregates', '-fa',
+                        type=int, default=0, dest='family_min_size',
+                        help='''min number of lineages of the lineage families (e.g., BA.2.*) whose counts are stored 
+                                pre-summed, so that the analyses of their groups do not scan all the descendants 
+                                (larger database). Use 0 to disable the family aggregates''')
+
+    parser.add_argument('--cache-size', '-cs',
+                        type=int, default=64, dest='cache_size',
+                        help="max size in MB of the analysis results cached in memory. Use 0 to disable the cache")
+
+    parser.add_argument('--disk-cache-size', '-dcs',
+                        type=int, default=0, dest='disk_cache_size',
+                        help='''max size in MB of the analysis results cached on disk, which survive restarts. 
+                                Use 0 to disable the disk cache''')
+
     args = parser.parse_args()
     return args
 
@@ -0,0 +1,218 @@
+"""
+
+    RESULT CACHE MANAGER UTILITY.
+    Utilities for caching the results of the analyses. Results are kept in memory with LRU eviction
+    and, optionally, on disk so that they survive restarts. They are keyed by the dataset version,
+    hence they are invalidated automatically when the database is updated.
+
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+from sqlite3 import connect
+from time import time
+
+from . import path_manager
+from .db_manager import get_connection, release_connection
+from .path_manager import get_db_path
+
+max_memory_bytes = 64 << 20  # max size of the results kept in memory (0 disables the cache)
+max_disk_bytes = 0  # max size of the results kept on disk (0 disables the disk tier)
+app_version = ''  # version of the application, included in the dataset version of the results
+
+memory_entries = OrderedDict()  # {(dataset version, key): (result, size)} from the least to the most recently used
+memory_bytes = 0  # current size of the results kept in memory
+cache_version = None  # dataset version of the cached results
+dataset_versions = {}  # {database path: dataset version}
+disk_con = None  # connection to the disk tier, if enabled
+cache_lock = threading.Lock()
+
+stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+
+def configure_cache(memory_size, disk_size, version):
+    """
+    Sets the limits of the cache and opens the disk tier, if enabled
+    Args:
+        memory_size:    Max size in MB of the results kept in memory (0 disables the cache)
+        disk_size:      Max size in MB of the results kept on disk (0 disables the disk tier)
+        version:        Version of the application, so that results computed by other versions are not reused
+
+    """
+    global max_memory_bytes, max_disk_bytes, app_version, disk_con
+    max_memory_bytes = memory_size << 20
+    max_disk_bytes = disk_size << 20 if memory_size > 0 else 0
+    app_version = version
+
+    if max_disk_bytes > 0 and disk_con is None:
+        disk_con = connect(path_manager.db_paths.cache_db_path, check_same_thread=False)
+        disk_con.execute("pragma journal_mode=WAL;")
+        disk_con.execute("pragma synchronous=NORMAL;")
+        disk_con.execute('''CREATE TABLE IF NOT EXISTS results
+                            (version text, key text, value text, size int, last_access real,
+                            PRIMARY KEY (version, key))''')
+        disk_con.commit()
+
+
+def get_dataset_version(db_path=None):
+    """
+    Gets the version of the given database, computed from its file name and from the info table
+    Args:
+        db_path:    The path to the database (by default, the one pinned for the current request)
+
+    Returns:    A string identifying the dataset version
+
+    """
+    db_path = db_path or get_db_path()
+    if db_path not in dataset_versions:
+        con = get_connection(db_path)
+        query = ''' SELECT file_type, filtered_countries, beginning_date, end_date, parse_date, watermark_date
+                    FROM  info;'''
+        info = con.execute(query).fetchone()
+        release_connection(con)
+        dataset_versions[db_path] = '/'.join([os.path.basename(db_path), app_version] + [str(x) for x in info])
+    return dataset_versions[db_path]
+
+
+def get_cached_result(name, params, compute):
+    """
+    Gets the result of an analysis from the cache, computing and storing it in case of a miss
+    Args:
+        name:       Name of the analysis (e.g., the API path)
+        params:     Dictionary with the normalized parameters of the analysis
+        compute:    Function without arguments computing the result
+
+    Returns:    The result of the analysis
+
+    """
+    if max_memory_bytes <= 0:
+        return compute()
+
+    version = get_dataset_version()
+    key = name + '?' + json.dumps(params, sort_keys=True)
+
+    with cache_lock:
+        if (version, key) in memory_entries:
+            stats['hits'] += 1
+            memory_entries.move_to_end((version, key))
+            return memory_entries[(version, key)][0]
+
+        if disk_con is not None:
+            row = disk_con.execute('''SELECT value FROM results WHERE version = ? AND key = ?''',
+                                   (version, key)).fetchone()
+            if row is not None:
+                stats['disk_hits'] += 1
+                disk_con.execute('''UPDATE results SET last_access = ? WHERE version = ? AND key = ?''',
+                                 (time(), version, key))
+                disk_con.commit()
+                result = json.loads(row[0])
+                store_in_memory(version, key, result, len(row[0]))
+                return result
+        stats['misses'] += 1
+
+    result = compute()
+
+    # Results of a previous version (i.e., requests in progress during a database switch) are not stored
+    if version == get_dataset_version(path_manager.current_db_path):
+        value = json.dumps(result)
+        with cache_lock:
+            if version != cache_version:
+                invalidate(version)
+            store_in_memory(version, key, result, len(value))
+            if disk_con is not None and len(value) <= max_disk_bytes:
+                store_on_disk(version, key, value)
+    return result
+
+
+def store_in_memory(version, key, result, size):
+    """
+    Stores a result in memory, evicting the least recently used ones if needed (to be called holding the lock)
+    Args:
+        version:    Dataset version of the result
+        key:        Key of the result
+        result:     The result to be stored
+        size:       Size of the result in bytes (as JSON)
+
+    """
+    global memory_bytes
+    if size > max_memory_bytes or (version, key) in memory_entries:
+        return
+    memory_entries[(version, key)] = (result, size)
+    memory_bytes += size
+    while memory_bytes > max_memory_bytes:
+        _, (_, evicted_size) = memory_entries.popitem(last=False)
+        memory_bytes -= evicted_size
+        stats['evictions'] += 1
+
+
+def store_on_disk(version, key, value):
+    """
+    Stores a result on disk, evicting the least recently used ones if needed (to be called holding the lock)
+    Args:
+        version:    Dataset version of the result
+        key:        Key of the result
+        value:      The result to be stored, as JSON string
+
+    """
+    disk_con.execute('''INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)''',
+                     (version, key, value, len(value), time()))
+    disk_bytes = disk_con.execute('''SELECT total(size) FROM results''').fetchone()[0]
+    if disk_bytes > max_disk_bytes:
+        # Remove the least recently used results, freeing up to a quarter of the space
+        disk_con.execute('''DELETE FROM results WHERE rowid IN (
+                                SELECT rowid FROM (
+                                    SELECT rowid, size, sum(size) OVER (ORDER BY last_access) AS freed FROM results)
+                                WHERE freed - size < ?)''', (disk_bytes - max_disk_bytes * 3 / 4,))
+    disk_con.commit()
+
+
+def invalidate(version=None):
+    """
+    Removes the results of the dataset versions other than the given one (to be called holding the lock)
+    Args:
+        version:    Dataset version whose results are kept (None to remove all the results)
+
+    """
+    global cache_version, memory_bytes
+    for entry_key in [k for k in memory_entries if k[0] != version]:
+        memory_bytes -= memory_entries.pop(entry_key)[1]
+    if disk_con is not None:
+        disk_con.execute('''DELETE FROM results WHERE version IS NOT ?''', (version,))
+        disk_con.commit()
+    cache_version = version
+    stats['invalidations'] += 1
+
+
+def clear_cache():
+    """
+    Removes all the cached results, both from memory and from disk
+    """
+    with cache_lock:
+        invalidate()
+
+
+def get_cache_stats():
+    """
+    Gets the counters of the cache
+
+    Returns:    Dictionary with the counters of hits and misses, the entries and the size of the cache
+
+    """
+    with cache_lock:
+        lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+        cache_stats = {
+            **stats,
+            'hit_ratio': (stats['hits'] + stats['disk_hits']) / lookups if lookups > 0 else 0,
+            'version': cache_version,
+            'memory_entries': len(memory_entries),
+            'memory_bytes': memory_bytes,
+            'max_memory_bytes': max_memory_bytes,
+            'disk_entries': 0,
+            'disk_bytes': 0,
+            'max_disk_bytes': max_disk_bytes
+        }
+        if disk_con is not None:
+            disk_entries, disk_bytes = disk_con.execute('''SELECT count(*), total(size) FROM results''').fetchone()
+            cache_stats['disk_entries'], cache_stats['disk_bytes'] = disk_entries, int(disk_bytes)
+    return cache_stats
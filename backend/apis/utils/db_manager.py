@@ -4,7 +4,23 @@
     Utilities for managing connections to db.
 
 """
-from sqlite3 import connect
+import os
+import threading
+from sqlite3 import connect, Connection
+
+from . import path_manager
+from .path_manager import get_db_path
+
+pool_size = 32  # max number of idle connections kept open
+mmap_size = 1 << 30  # max bytes of the database file memory-mapped by each connection
+cache_size = -64 * 1024  # page cache size of each connection (negative values are in KiB)
+cached_statements = 256  # number of prepared statements cached by each connection
+
+idle_connections = []  # idle read-only connections (PooledConnection)
+pool_lock = threading.Lock()
+
+table_names = {}  # {database path: names of its tables}
+db_served = False  # True once a database version has been opened (i.e., the first import is completed)
 
 
 def connection_preset(db_con):
@@ -53,3 +69,89 @@ def clear_db(db_name=None, db_con=None, db_cur=None):
     db_con.execute("vacuum")
     if close_flag:
         db_con.close()
+
+
+class PooledConnection(Connection):
+    """
+    Read-only connection handed out by get_connection, recording the database version it refers to
+    """
+
+    def __init__(self, db_path, **kwargs):
+        super().__init__(f'file:{os.path.abspath(db_path)}?mode=ro', uri=True, **kwargs)
+        self.db_path = db_path
+
+
+def read_only_preset(db_con):
+    """
+    Preset a read-only connection by enabling memory-mapped I/O, enlarging the page cache, keeping temporary
+    data in memory and forbidding any change to the database.
+    Args:
+        db_con: The database connection to preset
+
+    """
+    db_con.execute(f"pragma mmap_size={mmap_size};")  # reads pages by memory mapping the file
+    db_con.execute(f"pragma cache_size={cache_size};")  # keeps more pages in memory
+    db_con.execute("pragma temp_store=MEMORY;")  # keeps temporary tables and indexes in memory
+    db_con.execute("pragma query_only=ON;")  # prevents any change to the database
+
+
+def get_connection(db_path=None):
+    """
+    Gets a read-only connection to the database version in use, reusing an idle one if available.
+    The connection must be given back through release_connection.
+    Args:
+        db_path:    The path to the database (by default, the one pinned for the current request)
+
+    Returns:    The database connection
+
+    """
+    db_path = db_path or get_db_path()
+    with pool_lock:
+        for i in range(len(idle_connections) - 1, -1, -1):
+            if idle_connections[i].db_path == db_path:
+                return idle_connections.pop(i)
+
+    global db_served
+    db_con = PooledConnection(db_path, check_same_thread=False, cached_statements=cached_statements)
+    read_only_preset(db_con)
+    db_served = True
+    return db_con
+
+
+def release_connection(db_con):
+    """
+    Gives back a connection obtained through get_connection, so that it can be reused.
+    Connections to replaced database versions are closed instead, releasing the replaced file.
+    Args:
+        db_con: The database connection to release
+
+    """
+    if db_con.in_transaction:
+        db_con.rollback()
+    with pool_lock:
+        stale_connections = [con for con in idle_connections if con.db_path != path_manager.current_db_path]
+        idle_connections[:] = [con for con in idle_connections if con.db_path == path_manager.current_db_path]
+        if db_con.db_path == path_manager.current_db_path and len(idle_connections) < pool_size:
+            idle_connections.append(db_con)
+        else:
+            stale_connections.append(db_con)
+    for con in stale_connections:
+        con.close()
+
+
+def has_tables(*tables):
+    """
+    Checks whether the database version in use contains the given tables (e.g., the optional tables
+    built at ingest). Database versions are never modified, hence the check is performed once per version.
+    Args:
+        tables: The names of the tables
+
+    Returns:    True if all the tables exist, False otherwise
+
+    """
+    db_path = get_db_path()
+    if db_path not in table_names:
+        db_con = get_connection()
+        table_names[db_path] = {name for name, in db_con.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        release_connection(db_con)
+    return all(table in table_names[db_path] for table in tables)
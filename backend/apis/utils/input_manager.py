@@ -0,0 +1,188 @@
+"""
+
+    INPUT FILE MANAGER UTILITY.
+    Utilities for reading the metadata file, possibly compressed.
+
+"""
+import gzip
+import io
+import locale
+import lzma
+import queue
+import tarfile
+import threading
+from contextlib import ExitStack
+from pathlib import Path
+
+chunk_size = 1 << 20  # size (in bytes) of the decompressed chunks passed to the parser
+buffer_size = 64  # max number of decompressed chunks waiting to be parsed
+
+compression_magics = {  # leading bytes identifying the supported compression formats
+    b'\x1f\x8b': 'gz',
+    b'\xfd7zXZ\x00': 'xz',
+    b'\x28\xb5\x2f\xfd': 'zst'
+}
+
+
+def get_compression(file_path):
+    """
+    Detects the compression format of a file from its leading bytes
+    Args:
+        file_path:  The path to the file
+
+    Returns:    The compression format ('gz', 'xz' or 'zst'), or None if the file is not compressed
+
+    """
+    with open(file_path, 'rb') as f:
+        head = f.read(6)
+    return next((compression for magic, compression in compression_magics.items() if head.startswith(magic)), None)
+
+
+def is_archive(file_path):
+    """
+    Checks whether a file is a tar archive, possibly compressed, based on its name
+    Args:
+        file_path:  The path to the file
+
+    Returns:    True iff the file is a tar archive
+
+    """
+    suffixes = [suffix.lower() for suffix in Path(file_path).suffixes]
+    return '.tar' in suffixes or '.tgz' in suffixes
+
+
+def is_compressed(file_path):
+    """
+    Checks whether a file has to be decompressed (or extracted) before being parsed
+    Args:
+        file_path:  The path to the file
+
+    Returns:    True iff the file is compressed or archived. Its content is not randomly accessible.
+
+    """
+    return get_compression(file_path) is not None or is_archive(file_path)
+
+
+def open_metadata(file_path):
+    """
+    Opens the metadata file as a text stream. Compressed files (gzip, xz or zstd, possibly containing a tar archive
+    with the .tsv file) are decompressed by a background thread, which feeds the stream through a bounded buffer
+    so that the parsing overlaps with the decompression.
+    Args:
+        file_path:  The path to the metadata file
+
+    Returns:    The text stream of the metadata file
+
+    """
+    if not is_compressed(file_path):
+        return open(file_path)
+
+    stack = ExitStack()
+    try:
+        source = stack.enter_context(open(file_path, 'rb'))
+        compression = get_compression(file_path)
+        if compression == 'gz':
+            source = stack.enter_context(gzip.open(source, 'rb'))
+        elif compression == 'xz':
+            source = stack.enter_context(lzma.open(source, 'rb'))
+        elif compression == 'zst':
+            try:
+                import zstandard
+            except ImportError:
+                print(
+                    "\n\033[91m* FATAL ERROR: \tThe metadata file is compressed with zstd, but the zstandard " +
+                    "package is not installed.\n*\n*\t\t" +
+                    "Install it (pip install zstandard) or decompress the file and try again. \033[0m")
+                exit(-1)
+            source = stack.enter_context(zstandard.ZstdDecompressor().stream_reader(source, read_across_frames=True))
+
+        if is_archive(file_path):
+            # Stream the first .tsv file of the archive
+            archive = stack.enter_context(tarfile.open(fileobj=source, mode='r|'))
+            member = next((member for member in archive if member.isfile() and member.name.endswith('.tsv')), None)
+            if member is None:
+                raise ValueError(f'No .tsv file found in the archive {file_path}')
+            source = stack.enter_context(archive.extractfile(member))
+    except BaseException:
+        stack.close()
+        raise
+
+    pipe = DecompressionPipe(source, stack, file_path)
+    return io.TextIOWrapper(io.BufferedReader(pipe, buffer_size=chunk_size), encoding=locale.getpreferredencoding(False))
+
+
+class DecompressionPipe(io.RawIOBase):
+    """
+    Raw binary stream over the chunks produced by a background thread reading from a decompressing source
+    """
+
+    def __init__(self, source, stack, name):
+        """
+        Initializes the pipe and starts the decompression thread
+        Args:
+            source: Binary stream of the decompressed data
+            stack:  ExitStack closing the source (and the underlying files) when the decompression ends
+            name:   The path to the compressed file
+        """
+        super().__init__()
+        self.name = name
+        self.chunks = queue.Queue(maxsize=buffer_size)
+        self.pending = memoryview(b'')
+        self.finished = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.decompress, args=(source, stack), daemon=True)
+        self.thread.start()
+
+    def decompress(self, source, stack):
+        """
+        Decompression thread entry point: reads the source until its end, or until the pipe is closed
+        Args:
+            source: Binary stream of the decompressed data
+            stack:  ExitStack closing the source when the decompression ends
+        """
+        with stack:
+            try:
+                while not self.stopped.is_set():
+                    chunk = source.read(chunk_size)
+                    self.put(chunk)
+                    if not chunk:
+                        break
+            except Exception as e:
+                self.put(e)
+
+    def put(self, item):
+        """
+        Puts an item into the buffer, waiting for a free slot unless the pipe is closed
+        Args:
+            item:   The chunk of data (empty at the end of the data) or the exception raised by the source
+        """
+        while not self.stopped.is_set():
+            try:
+                self.chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while len(self.pending) == 0:
+            if self.finished:
+                return 0
+            item = self.chunks.get()
+            if isinstance(item, Exception):
+                raise item
+            if not item:
+                self.finished = True
+                return 0
+            self.pending = memoryview(item)
+
+        size = min(len(b), len(self.pending))
+        b[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+    def close(self):
+        self.stopped.set()
+        super().close()
@@ -0,0 +1,68 @@
+"""
+
+    LINEAGE MANAGER UTILITY.
+    Utilities for managing the Pango lineages hierarchy and aliases.
+
+"""
+import json
+
+
+def load_aliases(file_path):
+    """
+    Loads the Pango aliases from an alias key file (the alias_key.json file of pango-designation),
+    i.e., a JSON object of the form {alias: unaliased lineage}
+    Args:
+        file_path:  The path to the alias key file
+
+    Returns:    Dictionary of the form {alias: unaliased lineage}. Aliases of recombinant lineages (aliasing a list
+                of parents) and root lineages (aliasing an empty string) are left out, since they have no ancestors
+
+    """
+    try:
+        with open(file_path) as alias_file:
+            alias_key = json.load(alias_file)
+    except (OSError, ValueError):
+        print(
+            "\n\033[91m* FATAL ERROR: \tThe alias key file cannot be read or is not a valid JSON object.\n*\n*\t\t" +
+            "Make sure the alias key file path is correct (e.g., the alias_key.json file of pango-designation) " +
+            "and try again. \033[0m")
+        exit(-1)
+    return {alias: lineage for alias, lineage in alias_key.items() if isinstance(lineage, str) and lineage != ''}
+
+
+def unalias_lineage(lineage, aliases):
+    """
+    Computes the unaliased name of a lineage (e.g., BA.2 -> B.1.1.529.2)
+    Args:
+        lineage:    The lineage name
+        aliases:    Dictionary of the form {alias: unaliased lineage}
+
+    Returns:    The unaliased lineage name
+
+    """
+    alias, _, suffix = lineage.partition('.')
+    if alias in aliases:
+        return aliases[alias] + ('.' + suffix if suffix else '')
+    return lineage
+
+
+def get_lineage_ancestors(lineage, aliases, unaliased_aliases):
+    """
+    Computes the names of the ancestors of a lineage, the lineage itself included. Each ancestor is named
+    both unaliased and through each alias applying to it (e.g., for BA.2: B, B.1, B.1.1, B.1.1.529, BA,
+    B.1.1.529.2 and BA.2)
+    Args:
+        lineage:            The lineage name
+        aliases:            Dictionary of the form {alias: unaliased lineage}
+        unaliased_aliases:  Dictionary of the form {unaliased lineage: list of its aliases}
+
+    Returns:    The set of the names of the ancestors
+
+    """
+    ancestors = set()
+    names = []  # names of the current ancestor, the unaliased one first
+    for level in unalias_lineage(lineage, aliases).split('.'):
+        names = [name + '.' + level for name in names] if names else [level]
+        names.extend(unaliased_aliases.get(names[0], []))
+        ancestors.update(names)
+    return ancestors
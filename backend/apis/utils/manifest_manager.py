@@ -0,0 +1,98 @@
+"""
+
+    DATASET MANIFEST MANAGER UTILITY.
+    Utilities for accessing the dataset manifest, i.e., the summary of the dataset computed at ingest
+    (info, last date, date coverage and totals of locations and lineages). It is kept in memory, so that
+    the APIs can fill their metadata and skip the periods without sequences without querying the database.
+
+"""
+from . import path_manager
+from .db_manager import get_connection, release_connection, has_tables
+from .path_manager import get_db_path
+
+manifests = {}  # {database path: manifest of the database version (see get_manifest)}
+
+
+def get_manifest():
+    """
+    Gets the manifest of the database version in use. Database versions are never modified, hence it is loaded
+    once and kept in memory until the database is updated. Databases created without the manifest tables have
+    their manifest computed from the aggregated sequences
+    Returns:    A dictionary as follows
+                {
+                    'info': (file_type, filtered_countries, beginning_date, end_date, parse_date, version)
+                    'first_date': date (as diff from reference date) of the oldest sequence, None if empty
+                    'last_date': date (as diff from reference date) of the most recent sequence, None if empty
+                    'locations': { location identifier: (first date, last date, number of sequences) }
+                    'lineages': { lineage identifier: number of sequences }
+                }
+
+    """
+    db_path = get_db_path()
+    manifest = manifests.get(db_path)
+    if manifest is None:
+        con = get_connection()
+        cur = con.cursor()
+        info = cur.execute('''SELECT file_type, filtered_countries, beginning_date, end_date, parse_date, version
+                              FROM  info;''').fetchone()
+        if has_tables('manifest_locations', 'manifest_lineages'):
+            locations_query = ''' SELECT location_id, first_date, last_date, count
+                                  FROM manifest_locations;'''
+            lineages_query = '''  SELECT lineage_id, count
+                                  FROM manifest_lineages;'''
+        else:
+            locations_query = ''' SELECT location_id, min(date), max(date), sum(count)
+                                  FROM aggr_sequences
+                                  GROUP BY location_id;'''
+            lineages_query = '''  SELECT lineage_id, sum(count)
+                                  FROM aggr_sequences SQ JOIN continents CO ON SQ.location_id = CO.continent_id
+                                  GROUP BY lineage_id;'''
+        locations = {loc_id: (first, last, count) for loc_id, first, last, count in cur.execute(locations_query)}
+        lineages = dict(cur.execute(lineages_query))
+        release_connection(con)
+
+        # Only the manifest of the current database version is kept
+        manifest = {
+            'info': info,
+            'first_date': min((first for first, _, _ in locations.values()), default=None),
+            'last_date': max((last for _, last, _ in locations.values()), default=None),
+            'locations': locations,
+            'lineages': lineages
+        }
+        for manifest_path in list(manifests):
+            if manifest_path != path_manager.current_db_path:
+                manifests.pop(manifest_path, None)
+        if db_path == path_manager.current_db_path:
+            manifests[db_path] = manifest
+    return manifest
+
+
+def has_coverage(location, begin, end):
+    """
+    Checks whether the given location may have sequences in the given period, according to the manifest
+    Args:
+        location:   Identifier of the location to be considered
+        begin:      Begin date (as diff from reference date) of the period, excluded
+        end:        End date (as diff from reference date) of the period, included
+
+    Returns:    False if the location has no sequences in the period, True otherwise
+
+    """
+    try:
+        first_date, last_date, _ = get_manifest()['locations'][int(location)]
+    except (KeyError, TypeError, ValueError):
+        return False
+    return first_date <= end and last_date > begin
+
+
+def has_lineage_sequences(lineage_ids):
+    """
+    Checks whether the given lineages have any sequence in the dataset, according to the manifest
+    Args:
+        lineage_ids:    List of identifiers of the lineages to be considered
+
+    Returns:    True if at least one of the lineages has sequences, False otherwise
+
+    """
+    lineages = get_manifest()['lineages']
+    return any(lineages.get(lineage_id, 0) > 0 for lineage_id in lineage_ids)
@@ -4,8 +4,12 @@
     Utilities for managing paths and folders.
 
 """
+import glob
+import os
 import shutil
+import threading
 from argparse import Namespace
+from datetime import datetime
 from os import mkdir, getenv
 
 
@@ -53,6 +57,8 @@ def get_db_paths():
     args = Namespace()
 
     args.__setattr__('db_path', base_path + 'varianthunter.db')
+    args.__setattr__('db_pointer_path', base_path + 'current_db')
+    args.__setattr__('cache_db_path', base_path + 'cache.db')
 
     args.__setattr__('temp_tree', base_path + 'temp/')
     args.__setattr__('temp_db1_path', base_path + 'temp/temp_table1.db')
@@ -60,6 +66,127 @@ def get_db_paths():
     return args
 
 
+def get_shard_db_paths(shard_idx):
+    """
+    Compute the paths of the temporary databases used by a parsing worker for the given shard
+    Args:
+        shard_idx:  The index of the shard
+
+    Returns:    Tuple containing the paths for the sequences and the aa substitutions databases of the shard
+
+    """
+    return (db_paths.temp_tree + f'shard_{shard_idx}_table1.db',
+            db_paths.temp_tree + f'shard_{shard_idx}_table2.db')
+
+
+def read_db_pointer():
+    """
+    Reads the pointer file naming the database version in use. Databases created before the versioning
+    (without pointer file) are named varianthunter.db
+    Returns:    The path to the database version in use
+
+    """
+    try:
+        with open(db_paths.db_pointer_path) as pointer:
+            return os.path.join(os.path.dirname(db_paths.db_pointer_path), pointer.read().strip())
+    except FileNotFoundError:
+        return db_paths.db_path
+
+
+def new_db_path():
+    """
+    Computes the path for a new database version, to be built while the current one is still in use
+    Returns:    The path to the new database version
+
+    """
+    path = db_paths.db_path[:-len('.db')] + f'_{datetime.now():%Y%m%d%H%M%S}.db'
+    suffix = 0
+    while os.path.exists(path):
+        suffix += 1
+        path = db_paths.db_path[:-len('.db')] + f'_{datetime.now():%Y%m%d%H%M%S}_{suffix}.db'
+    return path
+
+
+def switch_db_path(path):
+    """
+    Atomically replaces the database version in use with the given one. No version is removed here, since
+    the switch may be performed by a separate ingest process, which does not know the version served by the
+    running server: the replaced versions are removed by the server through remove_old_db_versions.
+    Args:
+        path:   The path to the new database version
+
+    """
+    global current_db_path, previous_db_path
+    temp_pointer_path = db_paths.db_pointer_path + '.tmp'
+    with open(temp_pointer_path, 'w') as pointer:
+        pointer.write(os.path.basename(path))
+    os.replace(temp_pointer_path, db_paths.db_pointer_path)
+    if os.path.abspath(path) != os.path.abspath(current_db_path):
+        previous_db_path = current_db_path
+    current_db_path = path
+
+
+def reload_db_path():
+    """
+    Reloads the database version in use from the pointer file (e.g., after a switch performed
+    by a separate ingest process)
+    Returns:    The path to the database version in use
+
+    """
+    global current_db_path, previous_db_path
+    path = read_db_pointer()
+    if os.path.abspath(path) != os.path.abspath(current_db_path):
+        previous_db_path = current_db_path
+    current_db_path = path
+    return current_db_path
+
+
+def remove_old_db_versions():
+    """
+    Removes the database versions older than the one in use (by the timestamp in their name), to be called by the
+    server after switching version. The version it has just replaced is kept until the next switch, so that the
+    requests still using it can complete, as well as the newer versions (e.g., being built by an ingest process)
+
+    """
+    def version_key(path):
+        # Databases created before the versioning (varianthunter.db) are the oldest ones
+        return os.path.basename(path)[len(os.path.basename(db_paths.db_path)) - len('.db'):-len('.db')]
+
+    kept_paths = {os.path.abspath(current_db_path)}
+    if previous_db_path is not None:
+        kept_paths.add(os.path.abspath(previous_db_path))
+    for old_path in glob.glob(db_paths.db_path[:-len('.db')] + '*.db'):
+        if os.path.abspath(old_path) not in kept_paths and version_key(old_path) < version_key(current_db_path):
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass  # still in use (e.g., on Windows): removed at the next switch
+
+
+def get_db_path():
+    """
+    Gets the path to the database version in use. Within a request pinned by pin_db_path, the version
+    in use at the beginning of the request is returned, even if a switch occurred meanwhile.
+    Returns:    The path to the database version in use
+
+    """
+    return getattr(pinned_db_path, 'path', None) or current_db_path
+
+
+def pin_db_path():
+    """
+    Pins the database version in use for the current thread (i.e., for the current request)
+    """
+    pinned_db_path.path = current_db_path
+
+
+def unpin_db_path():
+    """
+    Releases the database version pinned for the current thread
+    """
+    pinned_db_path.path = None
+
+
 def print_disk_usage():
     """
     Utility function to print disk usage statistics
@@ -76,7 +203,17 @@ db_paths = get_db_paths()
     Namespace containing the values for db_path, temp_dir, temp_db1_path e temp_db1_path
 """
 
-db_path = db_paths.db_path
+current_db_path = read_db_pointer()
+"""
+    Path to the database version in use
+"""
+
+previous_db_path = None
+"""
+    Path to the database version replaced by the last switch, possibly still used by requests in progress
+"""
+
+pinned_db_path = threading.local()
 """
-    Path to the main database
+    Database version pinned by each thread
 """
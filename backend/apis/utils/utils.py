@@ -50,6 +50,18 @@ def compute_diff_from_date(date):
     return diff
 
 
+def normalize_date(date):
+    """
+    Normalize a date string, so that the same date is always represented by the same string (e.g., in cache keys)
+    Args:
+        date: String representing the date to be considered. Takes format YYYY-mm-dd (e.g., 2022-5-1 is accepted)
+
+    Returns: A string representing the date in format YYYY-mm-dd (e.g., 2022-05-01)
+
+    """
+    return compute_date_from_diff(compute_diff_from_date(date))
+
+
 def compute_date_from_diff(diff):
     """
     Compute date value from diff from the start_date
@@ -63,64 +75,62 @@ def compute_date_from_diff(diff):
     return date.strftime("%Y-%m-%d")
 
 
-def compute_pvalue(freq1, freq2):
+def compute_pvalues(freq1, freq2):
     """
-    Compute p-value for the hypothesis test of independence of the observed frequencies
+    Compute the p-values for the hypothesis tests of independence of the observed frequencies,
+    one test for each row of the given matrices (i.e., chi-square test of the 2x4 contingency table)
     Args:
-        freq1:  Observed freq 1
-        freq2:  Observed freq 2
+        freq1:  Matrix of the observed freq 1, with one row per test and one column per week
+        freq2:  Matrix of the observed freq 2, with one row per test and one column per week
 
-    Returns: The computed p-value
+    Returns: Array with the computed p-values (-1 when the test cannot be performed)
 
     """
-    try:
-        return scipy.stats.chi2_contingency(observed=[freq1, freq2])[1]
-    except:
-        return -1
+    observed = np.stack([freq1, freq2], axis=1).astype(np.float64)  # one 2x4 table per test
+    expected = observed.sum(axis=2, keepdims=True) * observed.sum(axis=1, keepdims=True) \
+        / observed.sum(axis=(1, 2), keepdims=True)
+    # Tests with negative frequencies or null expected frequencies cannot be performed
+    invalid = (observed < 0).any(axis=(1, 2)) | (expected == 0).any(axis=(1, 2))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        terms = (observed - expected) ** 2 / expected
+        p_values = scipy.stats.chi2.sf(terms.reshape(len(terms), -1).sum(axis=1), 3)  # (2-1)x(4-1) dof
+    p_values[invalid] = -1
+    return p_values
 
 
-def correct_pvalues(statistics):
+def correct_pvalues(p_values):
     """
-    Given a list of statistics including the values for the p-values, it corrects the p-values fot multiple tests
+    Given an array of p-values, it corrects them for multiple tests
     Args:
-        statistics: Dictionary including the p-values to be corrected
+        p_values:   Array of the p-values to be corrected
 
-    Returns:    Statistics dictionary including the corrected p-values
+    Returns:    Array of the corrected p-values
 
     """
-    uncorrected_p_vals = []
-    for s in statistics:
-        uncorrected_p_vals.extend([s['p_value_with_mut'], s['p_value_without_mut'], s['p_value_comp']])
     # Filter out cases where p-value is unknown (-1) or equal to 1.0 (avoid library exceptions)
-    uncorrected_valid_p_vals = list(filter(lambda p_val: abs(p_val) != 1, uncorrected_p_vals))
-
-    if len(uncorrected_valid_p_vals) > 0:
-        corrected_p_vals = sm.stats.multipletests(pvals=uncorrected_valid_p_vals)[1]
-
-        # Update statistics by replacing p-values
-        idx = 0
-        for s in statistics:
-            if abs(uncorrected_p_vals[idx]) != 1:
-                s['p_value_with_mut'] = corrected_p_vals[idx]
-                idx += 1
+    valid = np.abs(p_values) != 1
+    p_values = p_values.copy()
 
-            if abs(uncorrected_p_vals[idx]) != 1:
-                s['p_value_without_mut'] = corrected_p_vals[idx]
-                idx += 1
+    if valid.any():
+        corrected_p_vals = sm.stats.multipletests(pvals=p_values[valid])[1]
 
-            if abs(uncorrected_p_vals[idx]) != 1:
-                s['p_value_comp'] = corrected_p_vals[idx]
-                idx += 1
+        # Replace the p-values preceding the first unknown (or equal to 1.0) one, as the original
+        # row-by-row implementation does: the following ones are left uncorrected
+        idx = len(valid) if valid.all() else np.argmin(valid)
+        p_values[:idx] = corrected_p_vals[:idx]
 
-    return statistics
+    return p_values
 
 
-def produce_statistics(week_sequence_counts, mutation_data):
+def produce_statistics(week_sequence_counts, mutation_data, mutation_names):
     """
-    Process the statistics values by properly formatting them into a list of dicts
+    Process the statistics values by properly formatting them into a list of dicts.
+    The values are computed for all the mutations at once on the matrix of the counts (mutations x weeks)
     Args:
         week_sequence_counts:   Week sequences data
-        mutation_data:          Mutation data
+        mutation_data:          Mutation data, as week dictionaries of the form {mut_id: count}
+        mutation_names:         Dictionary of the form {mut_id: (protein, mut)} for the mutations of the 4th week
 
     Returns:    A list of the following form
                 [
@@ -147,22 +157,35 @@ def produce_statistics(week_sequence_counts, mutation_data):
                 ]
 
     """
-    statistics = []
-    tot_seq_w1, tot_seq_w2, tot_seq_w3, tot_seq_w4 = week_sequence_counts
     mut_w1, mut_w2, mut_w3, mut_w4 = mutation_data
-
-    for mut, c4 in mut_w4.items():
-        protein, mutation = mut.split("_")
-        c1 = mut_w1.get(mut, 0)
-        c2 = mut_w2.get(mut, 0)
-        c3 = mut_w3.get(mut, 0)
-        f1 = (c1 / tot_seq_w1) * 100 if tot_seq_w1 > 0 else 0
-        f2 = (c2 / tot_seq_w2) * 100 if tot_seq_w2 > 0 else 0
-        f3 = (c3 / tot_seq_w3) * 100 if tot_seq_w3 > 0 else 0
-        f4 = (c4 / tot_seq_w4) * 100 if tot_seq_w4 > 0 else 0
-        slope, intercept = np.polyfit([0, 1, 2, 3], [f1, f2, f3, f4], 1)
+    if len(mut_w4) == 0:
+        return []
+
+    # Counts of the mutations (rows) in the 4 weeks (columns)
+    counts = np.array([[mut_w1.get(mut_id, 0), mut_w2.get(mut_id, 0), mut_w3.get(mut_id, 0), c4]
+                       for mut_id, c4 in mut_w4.items()], dtype=np.int64)
+    totals = np.array(week_sequence_counts, dtype=np.int64)
+    freqs = np.array([(counts[:, week] / totals[week]) * 100 if totals[week] > 0 else np.zeros(len(counts))
+                      for week in range(4)]).T
+
+    # Slope of the least squares line through the points (0, f1), (1, f2), (2, f3), (3, f4)
+    slopes = freqs @ np.array([-1.5, -0.5, 0.5, 1.5]) / 5
+
+    # p-values with mut, without mut and comp of each mutation, corrected all together
+    p_values = np.stack([compute_pvalues(counts, np.broadcast_to(totals, counts.shape)),
+                         compute_pvalues(totals - counts, np.broadcast_to(totals, counts.shape)),
+                         compute_pvalues(counts, totals - counts)], axis=1)
+    p_values = correct_pvalues(p_values.reshape(-1)).reshape(-1, 3)
+
+    # Frequencies are 0 (int) for the weeks without sequences
+    f_columns = [freqs[:, week].tolist() if totals[week] > 0 else [0] * len(counts) for week in range(4)]
+    statistics = []
+    for mut_id, (c1, c2, c3, c4), slope, (f1, f2, f3, f4), p_vals in zip(
+            mut_w4, counts.tolist(), slopes.tolist(), zip(*f_columns), p_values.tolist()):
+        protein, mutation = mutation_names[mut_id]
+        p_with, p_without, p_comp = p_vals
         statistics.append({
-            'item_key': mut,
+            'item_key': protein + '_' + mutation,
             'protein': protein,
             'mut': mutation,
             'slope': slope,
@@ -174,18 +197,83 @@ def produce_statistics(week_sequence_counts, mutation_data):
             'w2': c2,
             'w3': c3,
             'w4': c4,
-            'p_value_with_mut':
-                compute_pvalue([c1, c2, c3, c4], week_sequence_counts),
-            'p_value_without_mut':
-                compute_pvalue(
-                    [tot_seq_w1 - c1, tot_seq_w2 - c2, tot_seq_w3 - c3, tot_seq_w4 - c4],
-                    week_sequence_counts),
-            'p_value_comp':
-                compute_pvalue(
-                    [c1, c2, c3, c4],
-                    [tot_seq_w1 - c1, tot_seq_w2 - c2, tot_seq_w3 - c3, tot_seq_w4 - c4]),
+            'p_value_with_mut': p_with,
+            'p_value_without_mut': p_without,
+            'p_value_comp': p_comp,
         })
-    if len(statistics) > 0:
-        statistics = correct_pvalues(statistics)
 
     return statistics
+
+
+def produce_statistics_series(first_day, daily_sequence_counts, daily_mutation_counts, mutation_names):
+    """
+    Process the statistics values for every end date of a period, as produce_statistics does for the 4 weeks
+    ending on each date. The week counts are updated as the 4 weeks slide by one day (i.e., adding the day
+    entering each week and subtracting the one leaving it), through the running sums of the daily counts
+    Args:
+        first_day:              Date (as diff from reference date) of the first day of the daily counts. The first
+                                end date is the last day of the 4 weeks starting on it
+        daily_sequence_counts:  Array of the daily sequence counts, from the first day to the last end date
+        daily_mutation_counts:  Matrix of the daily mutation counts, with one row per mutation (sorted as the rows
+                                of produce_statistics) and one column per day (as daily_sequence_counts)
+        mutation_names:         List of the (protein, mut) pairs naming the rows of daily_mutation_counts
+
+    Returns:    A dictionary of the following form
+                {
+                    'dates': list of the end dates. Take format YYYY-mm-dd
+                    'tot_seq': list reporting for each end date the total number of sequences of each of the 4 weeks
+                               [[tot_seq_week1, tot_seq_week2, tot_seq_week3, tot_seq_week4], ...]
+                    'rows': [
+                        {
+                            'item_key': row identifier obtained as protein_mut
+                            'protein': name of the protein, example='NSP4'
+                            'mut': name of the mutation, example='A146V'
+                            'positions': list of the positions in 'dates' of the end dates in which the mutation
+                                         is reported (i.e., it has tot>min_seq in the 4th week)
+                            'slope', 'f1', ..., 'p_value_comp': lists reporting for each of those end dates the
+                                                                value computed by produce_statistics
+                        },...
+                    ]
+                }
+
+    """
+    # Sums of the 7 days ending on each day, from the 7th one: week_counts[..., d] is the week ending on day d+6
+    def compute_week_counts(daily_counts):
+        running_sums = np.cumsum(daily_counts, axis=-1, dtype=np.int64)
+        running_sums = np.concatenate([np.zeros(running_sums.shape[:-1] + (1,), dtype=np.int64), running_sums],
+                                      axis=-1)
+        return running_sums[..., 7:] - running_sums[..., :-7]
+
+    sequence_week_counts = compute_week_counts(np.array(daily_sequence_counts, dtype=np.int64))
+    mutation_week_counts = compute_week_counts(np.array(daily_mutation_counts, dtype=np.int64)
+                                               .reshape(len(mutation_names), len(daily_sequence_counts)))
+    dates_num = max(sequence_week_counts.shape[-1] - 21, 0)
+
+    series = {'dates': [], 'tot_seq': [], 'rows': []}
+    series_keys = ['slope', 'f1', 'f2', 'f3', 'f4', 'w1', 'w2', 'w3', 'w4',
+                   'p_value_with_mut', 'p_value_without_mut', 'p_value_comp']
+    mutation_series = {}  # {row of daily_mutation_counts: series of the mutation, only for the dates reporting it}
+    names = dict(enumerate(mutation_names))
+    for d in range(dates_num):
+        weeks = [d, d + 7, d + 14, d + 21]  # positions of the weeks ending on the end date (and 1, 2, 3 weeks before)
+        week_sequence_counts = sequence_week_counts[weeks].tolist()
+
+        # Mutations of the 4th week having tot>min_seq, in the order of the rows
+        min_sequences = int(week_sequence_counts[-1] * 0.005 + 1)  # 0.5% of seq in the last week
+        selected = np.flatnonzero(mutation_week_counts[:, weeks[-1]] >= min_sequences).tolist()
+        counts = mutation_week_counts[selected][:, weeks].tolist()
+        mutation_data = [{m: c[week] for m, c in zip(selected, counts) if c[week] > 0} for week in range(3)]
+        mutation_data.append({m: c[3] for m, c in zip(selected, counts)})
+
+        for m, statistics in zip(selected, produce_statistics(week_sequence_counts, mutation_data, names)):
+            if m not in mutation_series:
+                mutation_series[m] = {'item_key': statistics['item_key'], 'protein': statistics['protein'],
+                                      'mut': statistics['mut'], 'positions': [], **{key: [] for key in series_keys}}
+            mutation_series[m]['positions'].append(d)
+            for key in series_keys:
+                mutation_series[m][key].append(statistics[key])
+        series['dates'].append(compute_date_from_diff(first_day + 27 + d))
+        series['tot_seq'].append(week_sequence_counts)
+
+    series['rows'] = [mutation_series[m] for m in sorted(mutation_series)]
+    return series
@@ -14,6 +14,7 @@ from flask_cors import CORS
 from flask_executor import Executor
 
 from apis import api_blueprint
+from apis.startup import args as startup_args, thread as startup_thread
 
 base_url = '/variant_hunter/'  # webapp base url
 api_url = base_url + 'api'  # api base url
@@ -95,4 +96,7 @@ log.setLevel(logging.ERROR)
 os.environ['WERKZEUG_RUN_MAIN'] = 'true'
 
 if __name__ == '__main__':
-    my_app.run(host="0.0.0.0", port=5000)
+    if startup_args.ingest_only:
+        startup_thread.join()
+    else:
+        my_app.run(host="0.0.0.0", port=5000)
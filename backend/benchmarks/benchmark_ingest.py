@@ -0,0 +1,243 @@
+"""
+
+    INGEST BENCHMARK
+    Runs the database setup (parsing, aggregation and indexing) on synthetic metadata files and reports,
+    for each configuration, rows/sec, peak memory, temporary disk usage and the time of each step as JSON.
+
+    Run with: python3 ./benchmarks/benchmark_ingest.py --rows 1000000 --config sqlite="-en sqlite" \
+                --config columnar="-en columnar -w 4" -o report.json
+    For more details run `python3 ./benchmarks/benchmark_ingest.py --help`
+
+"""
+
+import argparse
+import json
+import os
+import shlex
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+from time import time
+
+from generate_metadata import generate, get_arguments as get_generator_arguments
+
+app_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+
+
+def get_tree_size(dir_path):
+    """
+    Computes the size of the files in a directory tree
+    Args:
+        dir_path:   The path to the directory
+
+    Returns:    The overall size of the files in bytes
+
+    """
+    size = 0
+    for root, _, files in os.walk(dir_path):
+        for file in files:
+            try:
+                size += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                pass  # file removed meanwhile
+    return size
+
+
+class DiskMonitor:
+    """
+    Samples the size of a directory tree in a background thread, keeping track of the peak
+    """
+
+    def __init__(self, dir_path, interval=0.1):
+        """
+        Initializes the monitor and starts its thread
+        Args:
+            dir_path:   The path to the directory to be monitored
+            interval:   Seconds between two samples
+        """
+        self.dir_path = dir_path
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, get_tree_size(self.dir_path))
+
+    def stop(self):
+        """
+        Stops the monitor
+
+        Returns:    The peak size of the directory tree in bytes
+
+        """
+        self.stopped.set()
+        self.thread.join()
+        return self.peak
+
+
+def count_rows(file_path):
+    """
+    Counts the data rows of a plain metadata file
+    Args:
+        file_path:  The path to the metadata file
+
+    Returns:    The number of rows, header excluded
+
+    """
+    with open(file_path, 'rb') as f:
+        return sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1 << 20), b'')) - 1
+
+
+def check_database(db_path):
+    """
+    Checks that the database setup produced a plausible database, so that a wrong ingest is not measured
+    Args:
+        db_path:    The path to the database
+
+    Returns:    None. It raises an exception if the database has no sequences or if any protein or mutation name
+                contains whitespace (e.g., the line terminator of the metadata file)
+
+    """
+    con = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        sequences = con.execute('''SELECT count(*) FROM aggr_sequences''').fetchone()[0]
+        names = [name for query in ('''SELECT protein FROM proteins''', '''SELECT mut FROM mutations''')
+                 for name, in con.execute(query)]
+    finally:
+        con.close()
+    if sequences == 0:
+        raise RuntimeError(f'Database setup produced no sequences: {db_path}')
+    malformed = [name for name in names if any(c.isspace() for c in name)]
+    if malformed:
+        raise RuntimeError(f'Database setup produced {len(malformed)} names containing whitespace '
+                           f'(e.g., {malformed[0]!r}): {db_path}')
+
+
+def run_ingest(file_path, file_type, app_args, work_dir, verbose=False):
+    """
+    Runs the database setup in a separate process and measures it
+    Args:
+        file_path:  The path to the metadata file
+        file_type:  Type of the metadata file (gisaid or nextstrain)
+        app_args:   List with the additional arguments for the application (e.g., ['-en', 'columnar'])
+        work_dir:   The directory where the database is created (it must contain a previous database for
+                    incremental updates)
+        verbose:    True to show the output of the application
+
+    Returns:    Dictionary with the measures and the report of the application
+
+    """
+    report_path = os.path.join(work_dir, 'report.json')
+    data_dir = os.path.join(work_dir, 'data_i')
+    env = dict(os.environ)
+    env.pop('DB_PATH', None)
+
+    command = [sys.executable, '-u', app_path, '--ingest-only', '--report', report_path,
+               '-fp', os.path.abspath(file_path), '-ft', file_type] + app_args
+    start = time()
+    monitor = DiskMonitor(os.path.join(data_dir, 'temp'))
+    process = subprocess.Popen(command, cwd=work_dir, env=env,
+                               stdout=None if verbose else subprocess.DEVNULL,
+                               stderr=None if verbose else subprocess.DEVNULL)
+    # wait4 returns the resource usage of the process (and of its workers)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time() - start
+    peak_temp = monitor.stop()
+
+    if not os.path.exists(report_path):
+        raise RuntimeError(f'Database setup failed: {" ".join(command)} (exit code {process.returncode})')
+    with open(report_path) as f:
+        report = json.load(f)
+    os.remove(report_path)
+    with open(os.path.join(data_dir, 'current_db')) as pointer:
+        db_path = os.path.join(data_dir, pointer.read().strip())
+    check_database(db_path)
+
+    return {
+        'elapsed': elapsed,
+        'peak_rss_bytes': usage.ru_maxrss * 1024,  # largest resident set size among the processes
+        'peak_temp_bytes': peak_temp,
+        'db_bytes': os.path.getsize(db_path),
+        'report': report
+    }
+
+
+def benchmark(args):
+    """
+    Runs the benchmark: generates the metadata file (unless given) and runs each configuration on it
+    Args:
+        args:   The namespace with the benchmark parameters (see get_arguments)
+
+    Returns:    Dictionary with the parameters and the results of the benchmark
+
+    """
+    results = {'file_type': args.file_type, 'configs': {}}
+    with tempfile.TemporaryDirectory(dir=args.temp_dir) as temp_dir:
+        if args.input is None:
+            file_path = os.path.join(temp_dir, 'metadata.tsv')
+            generator_args = get_generator_arguments(['-o', file_path, '-ft', args.file_type, '-n', str(args.rows),
+                                                      '--seed', str(args.seed)] + shlex.split(args.generator_args))
+            print(f'> Generating {args.rows} rows ... ', end='', flush=True, file=sys.stderr)
+            start = time()
+            rows = generate(generator_args)
+            print(f'done in {time() - start:.2f} seconds.', file=sys.stderr)
+        else:
+            file_path = args.input
+            rows = count_rows(file_path)
+        results['rows'] = rows
+        results['input_bytes'] = os.path.getsize(file_path)
+
+        for config in args.configs or ['default=']:
+            name, _, app_args = config.partition('=')
+            print(f'> Running {name} ... ', end='', flush=True, file=sys.stderr)
+            work_dir = tempfile.mkdtemp(dir=temp_dir)
+            result = run_ingest(file_path, args.file_type, shlex.split(app_args), work_dir, args.verbose)
+            result['args'] = app_args
+            result['rows_per_sec'] = rows / result['report']['total']
+            results['configs'][name] = result
+            print(f"done in {result['elapsed']:.2f} seconds ({result['rows_per_sec']:.0f} rows/sec).",
+                  file=sys.stderr)
+    return results
+
+
+def get_arguments():
+    """
+    Convert command line argument strings to objects and assign them as attributes of the namespace
+    Returns:  the populated namespace
+    """
+    parser = argparse.ArgumentParser(description='Benchmarks the database setup on a synthetic metadata file')
+    parser.add_argument('--rows', '-n', type=int, default=100000, dest='rows',
+                        help="number of rows of the generated metadata file")
+    parser.add_argument('--filetype', '-ft', type=str.lower, default='gisaid', choices=['gisaid', 'nextstrain'],
+                        dest='file_type', help="format of the metadata file")
+    parser.add_argument('--seed', type=int, default=1, dest='seed', help="seed of the generator")
+    parser.add_argument('--generator-args', type=str, default='', dest='generator_args',
+                        help='''additional arguments for the generator, e.g. "--lineages 3000 --date-skew 2"''')
+    parser.add_argument('--input', '-fp', type=str, default=None, dest='input',
+                        help="existing metadata file to be used instead of a generated one")
+    parser.add_argument('--config', '-c', type=str, action='append', dest='configs',
+                        help='''configuration to be benchmarked, as name="application arguments"
+                                (e.g. columnar="-en columnar -w 4"). It can be repeated''')
+    parser.add_argument('--tempdir', type=str, default=None, dest='temp_dir',
+                        help="directory for the generated file and the databases")
+    parser.add_argument('--output', '-o', type=str, default=None, dest='output',
+                        help="path of the JSON report. If not set, the report is printed")
+    parser.add_argument('--verbose', '-v', default=False, action='store_true', dest='verbose',
+                        help="boolean flag to show the output of the application")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    cmd_args = get_arguments()
+    benchmark_results = benchmark(cmd_args)
+    if cmd_args.output is not None:
+        with open(cmd_args.output, 'w') as output:
+            json.dump(benchmark_results, output, indent=2)
+    else:
+        print(json.dumps(benchmark_results, indent=2))
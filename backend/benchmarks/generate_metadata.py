@@ -0,0 +1,291 @@
+"""
+
+    SYNTHETIC METADATA GENERATOR
+    Generates GISAID-like or Nextstrain-like metadata.tsv files of configurable size and skew,
+    to be used for measuring the performance of the database setup.
+
+    Run with: python3 ./benchmarks/generate_metadata.py -o metadata.tsv --rows 1000000
+    For more details run `python3 ./benchmarks/generate_metadata.py --help`
+
+"""
+
+import argparse
+import bz2
+import gzip
+import json
+import lzma
+import random
+from datetime import date, timedelta
+from string import ascii_uppercase
+
+continents = ['Europe', 'North America', 'Asia', 'South America', 'Africa', 'Oceania']
+
+gisaid_proteins = {  # protein name: protein length
+    'NSP1': 180, 'NSP2': 638, 'NSP3': 1945, 'NSP4': 500, 'NSP5': 306, 'NSP6': 290, 'NSP7': 83, 'NSP8': 198,
+    'NSP9': 113, 'NSP10': 139, 'NSP12': 932, 'NSP13': 601, 'NSP14': 527, 'NSP15': 346, 'NSP16': 298,
+    'Spike': 1273, 'NS3': 275, 'E': 75, 'M': 222, 'NS6': 61, 'NS7a': 121, 'NS7b': 43, 'NS8': 121, 'N': 419
+}
+
+nextstrain_proteins = {  # protein name: protein length
+    'ORF1a': 4405, 'ORF1b': 2695, 'S': 1273, 'ORF3a': 275, 'E': 75, 'M': 222, 'ORF6': 61, 'ORF7a': 121,
+    'ORF7b': 43, 'ORF8': 121, 'N': 419, 'ORF9b': 97
+}
+
+amino_acids = 'ACDEFGHIKLMNPQRSTVWY'
+
+gisaid_cols = ['Virus name', 'Type', 'Accession ID', 'Collection date', 'Location', 'Additional location information',
+               'Sequence length', 'Host', 'Patient age', 'Gender', 'Clade', 'Pango lineage', 'Pango version',
+               'Variant', 'AA Substitutions', 'Submission date', 'Is reference?', 'Is complete?',
+               'Is high coverage?', 'Is low coverage?', 'N-Content', 'GC-Content']
+
+nextstrain_cols = ['strain', 'virus', 'gisaid_epi_isl', 'genbank_accession', 'date', 'region', 'country',
+                   'division', 'location', 'region_exposure', 'country_exposure', 'division_exposure', 'segment',
+                   'length', 'host', 'age', 'sex', 'Nextstrain_clade', 'pango_lineage', 'originating_lab',
+                   'submitting_lab', 'date_submitted', 'missing_data', 'aaSubstitutions', 'clock_deviation',
+                   'QC_overall_status']
+
+
+def zipf_weights(n, skew):
+    """
+    Computes the weights of a Zipf-like distribution
+    Args:
+        n:      Number of items
+        skew:   Exponent of the distribution. 0 means uniform, the greater the more skewed towards the first items
+
+    Returns:    List with the weight of each item
+
+    """
+    return [1 / (rank ** skew) for rank in range(1, n + 1)]
+
+
+def cumulative(weights):
+    """
+    Computes the cumulative weights to be used with random.choices
+    Args:
+        weights:    List of weights
+
+    Returns:    List of cumulative weights
+
+    """
+    cum_weights, total = [], 0
+    for weight in weights:
+        total += weight
+        cum_weights.append(total)
+    return cum_weights
+
+
+def make_mutations(rng, proteins, count):
+    """
+    Generates a pool of distinct aa substitutions
+    Args:
+        rng:        The random generator
+        proteins:   Dictionary with the names and the lengths of the proteins
+        count:      Number of aa substitutions to be generated
+
+    Returns:    List of tuples (protein name, mutation name)
+
+    """
+    names, lengths = list(proteins.keys()), list(proteins.values())
+    mutations = set()
+    while len(mutations) < count:
+        protein = rng.choices(names, weights=lengths)[0]
+        position = rng.randint(1, proteins[protein])
+        original, alternative = rng.sample(amino_acids, 2)
+        mutations.add((protein, f'{original}{position}{alternative}'))
+    return sorted(mutations)
+
+
+def make_lineages(rng, count, mutations):
+    """
+    Generates a Pango-like tree of lineages, each one with its characteristic aa substitutions
+    (those of the parent lineage plus a few new ones). As in Pango, lineages deeper than 3 levels are
+    named after an alias of their parent (e.g., C.1 is the first child of B.1.1.1).
+    Args:
+        rng:        The random generator
+        count:      Number of lineages to be generated
+        mutations:  Pool of aa substitutions
+
+    Returns:    List of tuples (lineage name, list of characteristic aa substitutions) and the alias key,
+                as dictionary of the form {alias: unaliased lineage}
+
+    """
+    aliases = list(ascii_uppercase[2:]) + [first + second for first in ascii_uppercase for second in ascii_uppercase]
+    lineages = [('A', rng.sample(mutations, 2)), ('B', rng.sample(mutations, 3))]
+    children, parent_aliases, alias_key = {}, {}, {'A': '', 'B': ''}
+    while len(lineages) < count:
+        parent, parent_mutations = rng.choice(lineages)
+        if parent.count('.') == 3:
+            if parent not in parent_aliases:
+                parent_aliases[parent] = aliases[len(parent_aliases)]
+                alias, _, suffix = parent.partition('.')
+                alias_key[parent_aliases[parent]] = (alias_key[alias] or alias) + '.' + suffix
+            parent = parent_aliases[parent]
+        children[parent] = children.get(parent, 0) + 1
+        lineage_mutations = parent_mutations + rng.sample(mutations, rng.randint(1, 3))
+        lineages.append((f'{parent}.{children[parent]}', lineage_mutations))
+    return lineages, alias_key
+
+
+def make_locations(rng, countries_count, regions_count):
+    """
+    Generates continents, countries and regions. Countries have a random number of regions.
+    Args:
+        rng:                The random generator
+        countries_count:    Number of countries to be generated
+        regions_count:      Number of regions to be generated
+
+    Returns:    List of tuples (continent, country, region). Region is None for sequences located only at country level.
+
+    """
+    countries = [(continents[i % len(continents)], f'Country {i + 1}') for i in range(countries_count)]
+    locations = [(continent, country, None) for continent, country in countries]
+    for i in range(regions_count):
+        continent, country = countries[int(countries_count * rng.random() ** 2)]
+        locations.append((continent, country, f'Region {i + 1}'))
+    rng.shuffle(locations)
+    return locations
+
+
+def open_output(file_path):
+    """
+    Opens the output file, compressing it if the name ends with .gz, .bz2 or .xz
+    Args:
+        file_path:  The path to the output file
+
+    Returns:    The text stream of the output file
+
+    """
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, 'wt', compresslevel=6)
+    if file_path.endswith('.bz2'):
+        return bz2.open(file_path, 'wt')
+    if file_path.endswith('.xz'):
+        return lzma.open(file_path, 'wt', preset=1)
+    return open(file_path, 'w')
+
+
+def generate(args):
+    """
+    Writes the synthetic metadata file
+    Args:
+        args:   The namespace with the generator parameters (see get_arguments)
+
+    Returns:    Number of data rows written
+
+    """
+    rng = random.Random(args.seed)
+    is_gisaid = args.file_type == 'gisaid'
+    proteins = gisaid_proteins if is_gisaid else nextstrain_proteins
+    mutations = make_mutations(rng, proteins, args.mutations)
+    lineages, alias_key = make_lineages(rng, args.lineages, mutations)
+    if args.aliases_output is not None:
+        with open(args.aliases_output, 'w') as aliases_output:
+            json.dump(alias_key, aliases_output, indent=2)
+    locations = make_locations(rng, args.countries, args.regions)
+    location_weights = cumulative(zipf_weights(len(locations), args.location_skew))
+    mutation_weights = cumulative(zipf_weights(len(mutations), args.mutation_skew))
+    first_date = date.fromisoformat(args.start_date)
+    max_lag = 180  # max number of days between collection and submission
+    days = [(first_date + timedelta(days=day)).isoformat() for day in range(args.days + max_lag + 1)]
+
+    # The time span is split in epochs with different dominant lineages: in each epoch the lineages are ranked
+    # starting from a different position, so that the lineages created later dominate the later epochs
+    epochs = 16
+    lineage_weights = zipf_weights(len(lineages), args.lineage_skew)
+    epoch_weights = []
+    for epoch in range(epochs):
+        offset = (epoch * len(lineages)) // epochs
+        epoch_weights.append(cumulative(lineage_weights[-offset:] + lineage_weights[:-offset] if offset > 0 else
+                                        lineage_weights))
+
+    date_exponent = 1 / (1 + args.date_skew)
+    cols = gisaid_cols if is_gisaid else nextstrain_cols
+    with open_output(args.output) as out:
+        out.write('\t'.join(cols) + '\n')
+        for i in range(args.rows):
+            # Collection date: skewed towards the end of the time span; some dates are incomplete
+            day = int(args.days * rng.random() ** date_exponent)
+            collection_date = days[day] if rng.random() >= args.partial_dates else days[day][:7]
+            lag = min(int(rng.expovariate(1 / args.submission_lag)), max_lag) if args.submission_lag > 0 else 0
+            submission_date = days[day + lag]
+
+            continent, country, region = rng.choices(locations, cum_weights=location_weights)[0]
+            lineage, lineage_mutations = rng.choices(lineages, cum_weights=epoch_weights[day * epochs // args.days])[0]
+            if rng.random() < args.unassigned:
+                lineage = ''
+
+            # Characteristic aa substitutions (a few may be missing) plus some private ones
+            sequence_mutations = [mutation for mutation in lineage_mutations if rng.random() >= 0.05]
+            private_count = min(int(rng.expovariate(1 / args.private_mutations)), 50) \
+                if args.private_mutations > 0 else 0
+            sequence_mutations += rng.choices(mutations, cum_weights=mutation_weights, k=private_count)
+
+            # Quality: some sequences are too short or have too many Ns
+            length = rng.randint(29400, 29903) if rng.random() >= args.low_quality else rng.randint(20000, 28999)
+            n_content = rng.random() * 0.02 if rng.random() >= args.low_quality else 0.05 + rng.random() * 0.2
+
+            if is_gisaid:
+                location = f'{continent} / {country}' + (f' / {region}' if region is not None else '')
+                subs = '(' + ','.join(f'{protein}_{mutation}' for protein, mutation in sequence_mutations) + ')'
+                row = [f'hCoV-19/{country}/{i + 1}/{collection_date[:4]}', 'betacoronavirus', f'EPI_ISL_{i + 1}',
+                       collection_date, location, '', str(length), 'Human', '', '', '', lineage, '', '', subs,
+                       submission_date, '', 'True', '', '', f'{n_content:.4f}', '0.38']
+            else:
+                subs = ','.join(f'{protein}:{mutation}' for protein, mutation in sequence_mutations)
+                row = [f'{country}/{i + 1}/{collection_date[:4]}', 'ncov', f'EPI_ISL_{i + 1}', '?', collection_date,
+                       continent, country, region if region is not None else country, '?', continent, country,
+                       region if region is not None else country, 'genome', str(length), 'Human', '?', '?', '?',
+                       lineage if lineage != '' else '?', '?', '?', submission_date, str(int(n_content * length)),
+                       subs, '?', '?']
+            out.write('\t'.join(row) + '\n')
+    return args.rows
+
+
+def get_arguments(arguments=None):
+    """
+    Convert command line argument strings to objects and assign them as attributes of the namespace
+    Args:
+        arguments:  List of arguments to be parsed. If None, the command line arguments are used
+
+    Returns:  the populated namespace
+    """
+    parser = argparse.ArgumentParser(description='Generates a synthetic metadata.tsv file')
+    parser.add_argument('--output', '-o', type=str, required=True, dest='output',
+                        help="path to the output file. It is compressed if it ends with .gz, .bz2 or .xz")
+    parser.add_argument('--aliases-output', type=str, default=None, dest='aliases_output',
+                        help="path of the alias key file (JSON) of the generated lineages, as in pango-designation")
+    parser.add_argument('--filetype', '-ft', type=str.lower, default='gisaid', choices=['gisaid', 'nextstrain'],
+                        dest='file_type', help="format of the metadata file")
+    parser.add_argument('--rows', '-n', type=int, default=100000, dest='rows', help="number of sequences")
+    parser.add_argument('--seed', type=int, default=1, dest='seed', help="seed of the random generator")
+    parser.add_argument('--lineages', type=int, default=1500, dest='lineages', help="number of distinct lineages")
+    parser.add_argument('--lineage-skew', type=float, default=1.1, dest='lineage_skew',
+                        help="Zipf exponent of the lineage frequencies in each period (0 means uniform)")
+    parser.add_argument('--countries', type=int, default=150, dest='countries', help="number of distinct countries")
+    parser.add_argument('--regions', type=int, default=2000, dest='regions', help="number of distinct regions")
+    parser.add_argument('--location-skew', type=float, default=1.2, dest='location_skew',
+                        help="Zipf exponent of the location frequencies (0 means uniform)")
+    parser.add_argument('--startdate', type=str, default='2020-01-01', dest='start_date',
+                        help="first collection date. Use the format YYYY-mm-dd")
+    parser.add_argument('--days', type=int, default=1000, dest='days', help="number of days of collection dates")
+    parser.add_argument('--date-skew', type=float, default=1.0, dest='date_skew',
+                        help="skew of the collection dates towards the end of the period (0 means uniform)")
+    parser.add_argument('--partial-dates', type=float, default=0.02, dest='partial_dates',
+                        help="fraction of sequences with an incomplete collection date (YYYY-mm)")
+    parser.add_argument('--submission-lag', type=float, default=20, dest='submission_lag',
+                        help="mean number of days between collection and submission")
+    parser.add_argument('--mutations', type=int, default=20000, dest='mutations',
+                        help="number of distinct aa substitutions")
+    parser.add_argument('--private-mutations', type=float, default=3, dest='private_mutations',
+                        help="mean number of aa substitutions per sequence besides the lineage characteristic ones")
+    parser.add_argument('--mutation-skew', type=float, default=1.0, dest='mutation_skew',
+                        help="Zipf exponent of the frequencies of the private aa substitutions (0 means uniform)")
+    parser.add_argument('--unassigned', type=float, default=0.01, dest='unassigned',
+                        help="fraction of sequences without lineage")
+    parser.add_argument('--low-quality', type=float, default=0.05, dest='low_quality',
+                        help="fraction of sequences discarded by the quality filters")
+    return parser.parse_args(arguments)
+
+
+if __name__ == '__main__':
+    generate(get_arguments())